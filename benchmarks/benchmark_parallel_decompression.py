@@ -0,0 +1,121 @@
+"""
+Measures throughput of reading compressed event data with parallel direct chunk
+decompression (--decompression-workers) for increasing numbers of workers.
+
+Run from the repository root with:
+python benchmarks/benchmark_parallel_decompression.py
+"""
+import argparse
+import os
+import sys
+import tempfile
+from time import perf_counter
+from typing import Dict
+
+import h5py
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from nexus_streamer.chunk_decompression import (  # noqa: E402
+    THREAD_POOL,
+    PROCESS_POOL,
+    create_decompression_pool,
+)
+from nexus_streamer.event_data_source import (  # noqa: E402
+    _create_data_loader,
+    DEFAULT_SOURCE_MEMORY_BUDGET_BYTES,
+)
+
+
+def _compression_options() -> Dict[str, dict]:
+    options: Dict[str, dict] = {
+        "gzip": {"compression": "gzip", "compression_opts": 4},
+        "lzf": {"compression": "lzf"},
+    }
+    try:
+        import hdf5plugin
+
+        options["blosc"] = dict(hdf5plugin.Blosc())
+    except ImportError:
+        print("hdf5plugin is not installed, skipping blosc")
+    return options
+
+
+def _write_file(
+    filename: str, number_of_events: int, chunk_size: int, compression: dict
+):
+    rng = np.random.default_rng(1)
+    with h5py.File(filename, "w") as nexus_file:
+        nexus_file.create_dataset(
+            "event_id",
+            data=rng.integers(0, 100_000, number_of_events).astype(np.uint32),
+            chunks=(chunk_size,),
+            **compression,
+        )
+        nexus_file.create_dataset(
+            "event_time_offset",
+            data=rng.integers(0, 70_000_000, number_of_events).astype(np.uint32),
+            chunks=(chunk_size,),
+            **compression,
+        )
+
+
+def _read_all_pulses(
+    filename: str, events_per_pulse: int, workers: int, pool_type: str
+) -> float:
+    """
+    :return: time taken in seconds
+    """
+    pool = create_decompression_pool(workers, pool_type)
+    try:
+        with h5py.File(filename, "r") as nexus_file:
+            start_time = perf_counter()
+            for dataset_name in ("event_id", "event_time_offset"):
+                dataset = nexus_file[dataset_name]
+                loader = _create_data_loader(
+                    dataset, pool, DEFAULT_SOURCE_MEMORY_BUDGET_BYTES
+                )
+                for pulse_start in range(0, dataset.len(), events_per_pulse):
+                    loader.get_data_for_pulse(
+                        pulse_start, pulse_start + events_per_pulse
+                    )
+            return perf_counter() - start_time
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--events", type=int, default=20_000_000)
+    parser.add_argument("--events-per-pulse", type=int, default=100_000)
+    parser.add_argument("--chunk-size", type=int, default=1_000_000)
+    parser.add_argument(
+        "--pool", choices=(THREAD_POOL, PROCESS_POOL), default=THREAD_POOL
+    )
+    args = parser.parse_args()
+
+    cpu_count = os.cpu_count() or 1
+    worker_counts = [0] + [
+        2**power for power in range(cpu_count.bit_length()) if 2**power <= cpu_count
+    ]
+    uncompressed_mb = 2 * args.events * 4 / 1e6
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for codec, compression in _compression_options().items():
+            filename = os.path.join(temp_dir, f"{codec}.h5")
+            _write_file(filename, args.events, args.chunk_size, compression)
+            for workers in worker_counts:
+                seconds = _read_all_pulses(
+                    filename, args.events_per_pulse, workers, args.pool
+                )
+                print(
+                    f"{codec:>6} workers={workers:<3} "
+                    f"{2 * args.events / seconds / 1e6:8.1f} M events/s "
+                    f"{uncompressed_mb / seconds:8.1f} MB/s"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+"""
+Synthetic NeXus files and helpers shared by the pytest-benchmark suite.
+No Kafka broker is needed, messages are published to a stub producer.
+"""
+import os
+import sys
+from typing import Dict, NamedTuple, Optional, Tuple
+
+import h5py
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+# Files are generated with about this many events, unless that would mean more
+# than MAX_PULSES or fewer than MIN_PULSES pulses
+TOTAL_EVENTS = 2_000_000
+MIN_PULSES = 4
+MAX_PULSES = 10_000
+LOG_SAMPLES = 100_000
+NUMBER_OF_PIXELS = 100_000
+CONTIGUOUS_LOG = "temperature"
+CHUNKED_LOG = "pressure"
+LOG_NAMES = (CONTIGUOUS_LOG, CHUNKED_LOG)
+
+
+class EventLayout(NamedTuple):
+    """
+    Storage of the event_id and event_time_offset datasets
+    :param chunk_length: None for contiguous storage
+    :param compression: h5py compression name, None for uncompressed
+    :param isis_index: ISIS files have the start of the next pulse as the last event_index
+    """
+
+    chunk_length: Optional[int] = 1_000_000
+    compression: Optional[str] = "gzip"
+    isis_index: bool = False
+
+    @property
+    def name(self) -> str:
+        storage = (
+            "contiguous"
+            if self.chunk_length is None
+            else f"chunks{self.chunk_length}-{self.compression or 'none'}"
+        )
+        return f"{storage}{'-isis' if self.isis_index else ''}"
+
+
+EVENT_LAYOUTS = (
+    EventLayout(chunk_length=None, compression=None),
+    EventLayout(chunk_length=1_000_000, compression=None),
+    EventLayout(chunk_length=1_000_000, compression="gzip"),
+    EventLayout(chunk_length=1_000_000, compression="lzf"),
+    EventLayout(chunk_length=1_000, compression="gzip"),
+    EventLayout(chunk_length=4_000_000, compression="gzip"),
+    EventLayout(chunk_length=1_000_000, compression="gzip", isis_index=True),
+)
+EVENTS_PER_PULSE = (10, 1_000, 100_000, 1_000_000)
+
+
+class SyntheticFile(NamedTuple):
+    filename: str
+    number_of_events: int
+    number_of_pulses: int
+
+
+def _number_of_pulses(events_per_pulse: int) -> int:
+    return min(max(TOTAL_EVENTS // events_per_pulse, MIN_PULSES), MAX_PULSES)
+
+
+def _write_file(
+    filename: str, layout: EventLayout, events_per_pulse: int
+) -> SyntheticFile:
+    rng = np.random.default_rng(1)
+    number_of_pulses = _number_of_pulses(events_per_pulse)
+    number_of_events = number_of_pulses * events_per_pulse
+    dataset_options: Dict = {}
+    if layout.chunk_length is not None:
+        dataset_options = {
+            "chunks": (min(layout.chunk_length, number_of_events),),
+            "compression": layout.compression,
+        }
+
+    with h5py.File(filename, "w") as nexus_file:
+        entry = nexus_file.create_group("entry")
+        entry.attrs["NX_class"] = "NXentry"
+        entry["start_time"] = "2021-06-01T12:00:00Z"
+        instrument = entry.create_group("instrument")
+        instrument.attrs["NX_class"] = "NXinstrument"
+        detector = instrument.create_group("detector")
+        detector.attrs["NX_class"] = "NXdetector"
+        detector["detector_number"] = np.arange(1, NUMBER_OF_PIXELS + 1, dtype=np.int32)
+
+        events = detector.create_group("events")
+        events.attrs["NX_class"] = "NXevent_data"
+        events.create_dataset(
+            "event_id",
+            data=rng.integers(1, NUMBER_OF_PIXELS + 1, number_of_events).astype(
+                np.uint32
+            ),
+            **dataset_options,
+        )
+        event_time_offset = events.create_dataset(
+            "event_time_offset",
+            data=rng.uniform(0.0, 71_000.0, number_of_events).astype(np.float32),
+            **dataset_options,
+        )
+        event_time_offset.attrs["units"] = "microseconds"
+        event_index = np.arange(number_of_pulses, dtype=np.uint64) * events_per_pulse
+        if layout.isis_index:
+            event_index = np.append(event_index, np.uint64(number_of_events))
+        events["event_index"] = event_index
+        event_time_zero = events.create_dataset(
+            "event_time_zero", data=np.arange(number_of_pulses) / 14.0
+        )
+        event_time_zero.attrs["units"] = "s"
+        event_time_zero.attrs["offset"] = "2021-06-01T12:00:00Z"
+
+        for log_name, time_options, value_options in (
+            (CONTIGUOUS_LOG, {}, {}),
+            # Time and value datasets with different chunk sizes
+            (
+                CHUNKED_LOG,
+                {"chunks": (1_000,), "compression": "gzip"},
+                {"chunks": (768,), "compression": "gzip"},
+            ),
+        ):
+            log = entry.create_group(log_name)
+            log.attrs["NX_class"] = "NXlog"
+            time = log.create_dataset(
+                "time",
+                data=np.linspace(0.0, number_of_pulses / 14.0, LOG_SAMPLES),
+                **time_options,
+            )
+            time.attrs["units"] = "s"
+            time.attrs["start"] = "2021-06-01T12:00:00Z"
+            value = log.create_dataset(
+                "value", data=rng.normal(300.0, 1.0, LOG_SAMPLES), **value_options
+            )
+            value.attrs["units"] = "K"
+
+    return SyntheticFile(filename, number_of_events, number_of_pulses)
+
+
+@pytest.fixture(scope="session")
+def synthetic_file(tmp_path_factory):
+    """
+    Factory for synthetic NeXus files, each layout is only written once per session
+    """
+    files: Dict[Tuple[EventLayout, int], SyntheticFile] = {}
+
+    def _get_file(layout: EventLayout, events_per_pulse: int) -> SyntheticFile:
+        if (layout, events_per_pulse) not in files:
+            filename = str(
+                tmp_path_factory.getbasetemp() / f"{layout.name}-{events_per_pulse}.nxs"
+            )
+            files[(layout, events_per_pulse)] = _write_file(
+                filename, layout, events_per_pulse
+            )
+        return files[(layout, events_per_pulse)]
+
+    return _get_file
+
+
+class StubProducer:
+    """
+    Counts what would be published to Kafka
+    """
+
+    def __init__(self):
+        self.number_of_messages = 0
+        self.number_of_bytes = 0
+
+    def produce(
+        self,
+        topic: str,
+        payload: bytes,
+        timestamp_ns: int,
+        partition: Optional[int] = None,
+    ):
+        self.number_of_messages += 1
+        self.number_of_bytes += len(payload)
+
+    async def produce_when_queue_has_space(
+        self,
+        topic: str,
+        payload: bytes,
+        timestamp_ns: int,
+        partition: Optional[int] = None,
+    ):
+        self.produce(topic, payload, timestamp_ns, partition)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def report_throughput(
+    benchmark, number_of_events: int, number_of_bytes: int, unit: str = "events"
+):
+    """
+    Adds rates based on the mean time of a round to the benchmark results
+    and prints them, as pytest-benchmark only reports times
+    """
+    if benchmark.stats is None:
+        # Benchmarking is disabled, for example with --benchmark-disable
+        return
+    mean_s = benchmark.stats.stats.mean
+    benchmark.extra_info[f"{unit}_per_s"] = number_of_events / mean_s
+    benchmark.extra_info["MB_per_s"] = number_of_bytes / mean_s / 1e6
+    print(
+        f"\n{benchmark.name}: {number_of_events / mean_s / 1e6:.2f} M {unit}/s, "
+        f"{number_of_bytes / mean_s / 1e6:.1f} MB/s"
+    )
@@ -0,0 +1,107 @@
+"""
+Reading and decompressing data from the NeXus file, without serialising it
+"""
+from typing import Optional
+
+import h5py
+import pytest
+from conftest import (
+    EVENT_LAYOUTS,
+    EVENTS_PER_PULSE,
+    LOG_NAMES,
+    EventLayout,
+    report_throughput,
+)
+
+from nexus_streamer.event_data_source import EventDataSource
+from nexus_streamer.generate_json_description import nexus_file_to_json_tree
+from nexus_streamer.log_data_source import LogDataSource
+from nexus_streamer.pulse_index_cache import PulseIndexCache
+
+_ROUNDS = 3
+_BYTES_PER_EVENT = 8  # uint32 detector id and float32 time-of-flight in the file
+
+
+def _read_all_events(filename: str) -> int:
+    with h5py.File(filename, "r") as nexus_file:
+        source = EventDataSource(nexus_file["entry/instrument/detector/events"])
+        number_of_events = 0
+        for time_of_flight, _, _ in source.get_data():
+            if time_of_flight is None:
+                break
+            number_of_events += time_of_flight.size
+    return number_of_events
+
+
+def _create_event_data_source(
+    filename: str, pulse_index_cache: Optional[PulseIndexCache]
+) -> int:
+    with h5py.File(filename, "r") as nexus_file:
+        source = EventDataSource(
+            nexus_file["entry/instrument/detector/events"],
+            pulse_index_cache=pulse_index_cache,
+        )
+        return source.final_timestamp
+
+
+def _read_all_log_samples(filename: str, log_name: str) -> int:
+    with h5py.File(filename, "r") as nexus_file:
+        source = LogDataSource(nexus_file[f"entry/{log_name}"])
+        number_of_samples = 0
+        for value, _ in source.get_data():
+            if value is None:
+                break
+            number_of_samples += 1
+    return number_of_samples
+
+
+@pytest.mark.parametrize("layout", EVENT_LAYOUTS, ids=lambda layout: layout.name)
+def test_event_data_source_layouts(benchmark, synthetic_file, layout):
+    nexus_file = synthetic_file(layout, 1_000)
+    number_of_events = benchmark.pedantic(
+        _read_all_events, args=(nexus_file.filename,), rounds=_ROUNDS
+    )
+    report_throughput(benchmark, number_of_events, number_of_events * _BYTES_PER_EVENT)
+
+
+@pytest.mark.parametrize("events_per_pulse", EVENTS_PER_PULSE)
+def test_event_data_source_pulse_sizes(benchmark, synthetic_file, events_per_pulse):
+    nexus_file = synthetic_file(EventLayout(), events_per_pulse)
+    number_of_events = benchmark.pedantic(
+        _read_all_events, args=(nexus_file.filename,), rounds=_ROUNDS
+    )
+    report_throughput(benchmark, number_of_events, number_of_events * _BYTES_PER_EVENT)
+
+
+@pytest.mark.parametrize("cached", (False, True), ids=("uncached", "cached"))
+def test_event_data_source_creation(benchmark, synthetic_file, tmp_path, cached):
+    nexus_file = synthetic_file(EventLayout(), 10)
+    pulse_index_cache = None
+    if cached:
+        pulse_index_cache = PulseIndexCache(str(tmp_path), nexus_file.filename)
+        # Pulse times and event index are saved when the first source is created
+        _create_event_data_source(nexus_file.filename, pulse_index_cache)
+    benchmark.pedantic(
+        _create_event_data_source,
+        args=(nexus_file.filename, pulse_index_cache),
+        rounds=_ROUNDS,
+    )
+
+
+@pytest.mark.parametrize("log_name", LOG_NAMES)
+def test_log_data_source(benchmark, synthetic_file, log_name):
+    nexus_file = synthetic_file(EventLayout(), 1_000)
+    number_of_samples = benchmark.pedantic(
+        _read_all_log_samples, args=(nexus_file.filename, log_name), rounds=_ROUNDS
+    )
+    # float64 value and time for each sample
+    report_throughput(benchmark, number_of_samples, number_of_samples * 16, "samples")
+
+
+def test_json_description(benchmark, synthetic_file):
+    nexus_file = synthetic_file(EventLayout(), 1_000)
+    benchmark.pedantic(
+        nexus_file_to_json_tree,
+        args=(nexus_file.filename, "TEST_events", "TEST_sampleEnv"),
+        rounds=_ROUNDS,
+    )
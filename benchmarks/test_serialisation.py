@@ -0,0 +1,31 @@
+"""
+Serialising single messages, this is done for every pulse and log sample
+"""
+import numpy as np
+import pytest
+from conftest import EVENTS_PER_PULSE, report_throughput
+from streaming_data_types.eventdata_ev42 import serialise_ev42
+from streaming_data_types.logdata_f142 import serialise_f142
+
+_PULSE_TIME_NS = 1_622_548_800_000_000_000
+
+
+@pytest.mark.parametrize("events_per_pulse", EVENTS_PER_PULSE)
+def test_serialise_ev42(benchmark, events_per_pulse):
+    rng = np.random.default_rng(1)
+    time_of_flight = rng.integers(0, 71_000_000, events_per_pulse, dtype=np.uint32)
+    detector_id = rng.integers(1, 100_000, events_per_pulse, dtype=np.uint32)
+    payload = benchmark(
+        serialise_ev42,
+        "detector_events",
+        0,
+        _PULSE_TIME_NS,
+        time_of_flight,
+        detector_id,
+    )
+    report_throughput(benchmark, events_per_pulse, len(payload))
+
+
+def test_serialise_f142(benchmark):
+    payload = benchmark(serialise_f142, 300.0, "temperature", _PULSE_TIME_NS)
+    report_throughput(benchmark, 1, len(payload), "samples")
@@ -0,0 +1,149 @@
+"""
+Complete loop of reading, serialising and publishing to a stub producer or message sink
+"""
+import asyncio
+from typing import Callable, List, Optional
+
+import h5py
+import pytest
+from conftest import (
+    EVENTS_PER_PULSE,
+    LOG_NAMES,
+    LOG_SAMPLES,
+    NUMBER_OF_PIXELS,
+    EventLayout,
+    StubProducer,
+    report_throughput,
+)
+
+from nexus_streamer.detector_partitioning import DetectorIdPartitioning
+from nexus_streamer.event_data_source import EventDataSource
+from nexus_streamer.log_data_source import LogDataSource
+from nexus_streamer.merge_scheduler import MergeScheduler
+from nexus_streamer.message_sinks import (
+    FILE_SINK,
+    NULL_SINK,
+    FileSink,
+    MessageSink,
+    NullSink,
+    read_message_file,
+)
+from nexus_streamer.playback_clock import PlaybackClock
+from nexus_streamer.source_to_stream import EventSourceToStream, LogSourceToStream
+
+_ROUNDS = 3
+
+
+async def _publish(streamer):
+    scheduler = MergeScheduler([streamer])
+    try:
+        await scheduler.run()
+    finally:
+        scheduler.stop()
+
+
+def _stream_events(
+    filename: str, partitioning: Optional[DetectorIdPartitioning] = None
+) -> StubProducer:
+    producer = StubProducer()
+    with h5py.File(filename, "r") as nexus_file:
+        source = EventDataSource(nexus_file["entry/instrument/detector/events"])
+        asyncio.run(
+            _publish(EventSourceToStream(source, producer, "TEST_events", PlaybackClock(0), partitioning=partitioning))  # type: ignore
+        )
+    return producer
+
+
+def _stream_events_to_sink(filename: str, create_sink: Callable[[], MessageSink]):
+    sink = create_sink()
+    try:
+        with h5py.File(filename, "r") as nexus_file:
+            source = EventDataSource(nexus_file["entry/instrument/detector/events"])
+            asyncio.run(
+                _publish(
+                    EventSourceToStream(source, sink, "TEST_events", PlaybackClock(0))
+                )
+            )
+    finally:
+        sink.close()
+
+
+def _stream_logs(filename: str, log_name: str) -> StubProducer:
+    producer = StubProducer()
+    with h5py.File(filename, "r") as nexus_file:
+        source = LogDataSource(nexus_file[f"entry/{log_name}"])
+        asyncio.run(
+            _publish(LogSourceToStream(source, producer, "TEST_sampleEnv", PlaybackClock(0)))  # type: ignore
+        )
+    return producer
+
+
+@pytest.mark.parametrize("events_per_pulse", EVENTS_PER_PULSE)
+def test_event_source_to_stream(benchmark, synthetic_file, events_per_pulse):
+    nexus_file = synthetic_file(EventLayout(), events_per_pulse)
+    producer = benchmark.pedantic(
+        _stream_events, args=(nexus_file.filename,), rounds=_ROUNDS
+    )
+    assert producer.number_of_messages == nexus_file.number_of_pulses
+    report_throughput(benchmark, nexus_file.number_of_events, producer.number_of_bytes)
+
+
+@pytest.mark.parametrize("number_of_ranges", (4, 16))
+@pytest.mark.parametrize("events_per_pulse", (1_000, 100_000))
+def test_partitioned_event_source_to_stream(
+    benchmark, synthetic_file, events_per_pulse, number_of_ranges
+):
+    nexus_file = synthetic_file(EventLayout(), events_per_pulse)
+    partitioning = DetectorIdPartitioning(
+        [
+            1 + range_number * NUMBER_OF_PIXELS // number_of_ranges
+            for range_number in range(number_of_ranges)
+        ]
+    )
+    producer = benchmark.pedantic(
+        _stream_events, args=(nexus_file.filename, partitioning), rounds=_ROUNDS
+    )
+    assert producer.number_of_messages == nexus_file.number_of_pulses * number_of_ranges
+    report_throughput(benchmark, nexus_file.number_of_events, producer.number_of_bytes)
+
+
+@pytest.mark.parametrize("sink_type", (NULL_SINK, FILE_SINK))
+def test_event_source_to_sink(benchmark, synthetic_file, tmp_path, sink_type):
+    nexus_file = synthetic_file(EventLayout(), 1_000)
+    message_filename = str(tmp_path / "messages")
+    null_sinks: List[NullSink] = []
+
+    def create_sink() -> MessageSink:
+        if sink_type == FILE_SINK:
+            return FileSink(message_filename)
+        null_sinks.append(NullSink())
+        return null_sinks[-1]
+
+    benchmark.pedantic(
+        _stream_events_to_sink,
+        args=(nexus_file.filename, create_sink),
+        rounds=_ROUNDS,
+    )
+    if sink_type == NULL_SINK:
+        number_of_messages = null_sinks[-1].number_of_messages
+        number_of_bytes = null_sinks[-1].number_of_bytes
+    else:
+        payload_sizes = [
+            len(message.payload) for message in read_message_file(message_filename)
+        ]
+        number_of_messages = len(payload_sizes)
+        number_of_bytes = sum(payload_sizes)
+    assert number_of_messages == nexus_file.number_of_pulses
+    report_throughput(benchmark, nexus_file.number_of_events, number_of_bytes)
+
+
+@pytest.mark.parametrize("log_name", LOG_NAMES)
+def test_log_source_to_stream(benchmark, synthetic_file, log_name):
+    nexus_file = synthetic_file(EventLayout(), 1_000)
+    producer = benchmark.pedantic(
+        _stream_logs, args=(nexus_file.filename, log_name), rounds=_ROUNDS
+    )
+    assert producer.number_of_messages == LOG_SAMPLES
+    report_throughput(
+        benchmark, producer.number_of_messages, producer.number_of_bytes, "samples"
+    )
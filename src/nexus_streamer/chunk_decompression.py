@@ -0,0 +1,209 @@
+import zlib
+from collections import deque
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Deque, Optional, Tuple
+
+import h5py
+import numpy as np
+
+from .application_logger import get_logger
+
+# Codecs for filters which are not built into HDF5 are optional dependencies
+try:
+    import lzf
+except ImportError:
+    lzf = None
+try:
+    import blosc
+except ImportError:
+    blosc = None
+
+_FILTER_DEFLATE = h5py.h5z.FILTER_DEFLATE
+_FILTER_SHUFFLE = h5py.h5z.FILTER_SHUFFLE
+_FILTER_FLETCHER32 = h5py.h5z.FILTER_FLETCHER32
+_FILTER_LZF = h5py.h5z.FILTER_LZF
+_FILTER_BLOSC = 32001
+
+_FLETCHER32_CHECKSUM_BYTES = 4
+
+THREAD_POOL = "thread"
+PROCESS_POOL = "process"
+
+
+def _supported_filters() -> Tuple[int, ...]:
+    filters = [_FILTER_DEFLATE, _FILTER_SHUFFLE, _FILTER_FLETCHER32]
+    if lzf is not None:
+        filters.append(_FILTER_LZF)
+    if blosc is not None:
+        filters.append(_FILTER_BLOSC)
+    return tuple(filters)
+
+
+def _get_filter_ids(dataset: h5py.Dataset) -> Tuple[int, ...]:
+    """
+    Filter ids in the order they are applied when the data are written
+    """
+    create_plist = dataset.id.get_create_plist()
+    return tuple(
+        create_plist.get_filter(filter_number)[0]
+        for filter_number in range(create_plist.get_nfilters())
+    )
+
+
+def can_read_chunks_directly(dataset: h5py.Dataset) -> bool:
+    """
+    True if the raw chunks of the dataset can be decompressed by this module
+    """
+    if dataset.chunks is None or dataset.ndim != 1:
+        return False
+    supported_filters = _supported_filters()
+    return all(filter_id in supported_filters for filter_id in _get_filter_ids(dataset))
+
+
+def _unshuffle(data: bytes, item_size: int) -> bytes:
+    whole_items_bytes = len(data) - len(data) % item_size
+    shuffled = np.frombuffer(data, dtype=np.uint8, count=whole_items_bytes)
+    unshuffled = shuffled.reshape((item_size, -1)).T.tobytes()
+    return unshuffled + data[whole_items_bytes:]
+
+
+def decode_chunk(
+    raw_chunk: bytes,
+    filter_ids: Tuple[int, ...],
+    filter_mask: int,
+    dtype: str,
+    chunk_length: int,
+) -> np.ndarray:
+    """
+    Undo the filter pipeline for a raw chunk. zlib and blosc release the GIL
+    while decompressing, so this scales when run in a thread pool.
+    Module level function so that it can also be run in a process pool.
+    """
+    item_size = np.dtype(dtype).itemsize
+    data = raw_chunk
+    for filter_number in reversed(range(len(filter_ids))):
+        if filter_mask & (1 << filter_number):
+            # Filter was not applied to this chunk
+            continue
+        filter_id = filter_ids[filter_number]
+        if filter_id == _FILTER_DEFLATE:
+            data = zlib.decompress(data)
+        elif filter_id == _FILTER_SHUFFLE:
+            data = _unshuffle(data, item_size)
+        elif filter_id == _FILTER_FLETCHER32:
+            data = data[:-_FLETCHER32_CHECKSUM_BYTES]
+        elif filter_id == _FILTER_LZF:
+            data = lzf.decompress(data, chunk_length * item_size)
+        elif filter_id == _FILTER_BLOSC:
+            data = blosc.decompress(data)
+        else:
+            raise ValueError(f"Unsupported HDF5 filter {filter_id}")
+    return np.frombuffer(data, dtype=dtype, count=chunk_length)
+
+
+class DecompressionPool:
+    def __init__(self, number_of_workers: int, pool_type: str = THREAD_POOL):
+        """
+        Workers shared by all event data sources to decompress chunks in parallel
+        :param pool_type: "thread" or "process", a process pool is only worthwhile
+          for codecs which do not release the GIL, such as LZF
+        """
+        self.number_of_workers = number_of_workers
+        self.executor: Executor
+        if pool_type == PROCESS_POOL:
+            self.executor = ProcessPoolExecutor(max_workers=number_of_workers)
+        else:
+            if blosc is not None:
+                blosc.set_releasegil(True)
+            self.executor = ThreadPoolExecutor(
+                max_workers=number_of_workers, thread_name_prefix="decompression"
+            )
+
+    def shutdown(self):
+        self.executor.shutdown()
+
+
+class ParallelChunkReader:
+    def __init__(self, dataset: h5py.Dataset, decompression_pool: DecompressionPool):
+        """
+        Iterates over decoded chunks of a 1D dataset in order. Raw compressed chunks are read
+        with HDF5 direct chunk read and decompressed in the pool, keeping two chunks per worker
+        in flight ahead of the chunk which is being requested.
+        """
+        self._dataset = dataset
+        self._executor = decompression_pool.executor
+        self._chunks_in_flight = 2 * decompression_pool.number_of_workers
+        self._chunk_length: int = dataset.chunks[0]
+        self._filter_ids = _get_filter_ids(dataset)
+        self._dtype = dataset.dtype.str
+        self._next_chunk_start = 0
+        self._pending: Deque[Tuple[Future, int]] = deque()
+
+    def _submit_next_chunk(self) -> bool:
+        chunk_start = self._next_chunk_start
+        if chunk_start >= self._dataset.len():
+            return False
+        self._next_chunk_start += self._chunk_length
+        elements_in_chunk = min(self._chunk_length, self._dataset.len() - chunk_start)
+        try:
+            filter_mask, raw_chunk = self._dataset.id.read_direct_chunk((chunk_start,))
+        except (KeyError, RuntimeError, OSError):
+            # Chunk was never written, so contains only the fill value
+            future: Future = Future()
+            future.set_result(
+                np.full(self._chunk_length, self._dataset.fillvalue, dtype=self._dtype)
+            )
+            self._pending.append((future, elements_in_chunk))
+            return True
+        self._pending.append(
+            (
+                self._executor.submit(
+                    decode_chunk,
+                    raw_chunk,
+                    self._filter_ids,
+                    filter_mask,
+                    self._dtype,
+                    self._chunk_length,
+                ),
+                elements_in_chunk,
+            )
+        )
+        return True
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> np.ndarray:
+        while len(self._pending) < self._chunks_in_flight:
+            if not self._submit_next_chunk():
+                break
+        if not self._pending:
+            raise StopIteration
+        future, elements_in_chunk = self._pending.popleft()
+        # Last chunk may extend beyond the end of the dataset
+        return future.result()[:elements_in_chunk]
+
+    def close(self):
+        """
+        Cancel decompression of chunks which will not be requested
+        """
+        for future, _ in self._pending:
+            future.cancel()
+        self._pending.clear()
+        self._next_chunk_start = self._dataset.len()
+
+
+def create_decompression_pool(
+    number_of_workers: int, pool_type: str = THREAD_POOL
+) -> Optional[DecompressionPool]:
+    """
+    :return: None if number_of_workers is 0, meaning chunks are decompressed by h5py as they are read
+    """
+    if number_of_workers < 1:
+        return None
+    if pool_type == THREAD_POOL and lzf is not None:
+        get_logger().debug(
+            "LZF decompression does not release the GIL, consider using a process pool "
+            "for LZF compressed files"
+        )
+    return DecompressionPool(number_of_workers, pool_type)
@@ -1,5 +1,6 @@
 import pint
-from typing import Callable, Union
+from functools import lru_cache
+from typing import Callable, Optional, Union
 from pint.errors import UndefinedUnitError
 import numpy as np
 from datetime import datetime, timezone
@@ -11,6 +12,10 @@ MILLISECONDS = ureg("milliseconds")
 MICROSECONDS = ureg("microseconds")
 NANOSECONDS = ureg("nanoseconds")
 
+# Number of elements converted at a time by convert_to_nanoseconds, small enough
+# for the intermediate float64 values to stay in CPU cache
+_CONVERSION_BLOCK_LENGTH = 65536
+
 
 def iso8601_to_ns_since_epoch(iso8601_timestamp: Union[str, bytes]) -> int:
     try:
@@ -33,42 +38,110 @@ def ns_since_epoch_to_iso8601(ns_since_epoch: int) -> str:
     return dt.isoformat()
 
 
+def _scale_to_nanoseconds(
+    input_value: Union[float, int, np.ndarray], nanoseconds_per_unit: int
+) -> np.ndarray:
+    values = np.asarray(input_value)
+    if np.issubdtype(values.dtype, np.integer):
+        return values.astype(np.int64) * nanoseconds_per_unit
+    # Scale whole and fractional parts separately, otherwise large values
+    # such as times since the unix epoch lose nanosecond precision in float multiplication
+    whole_units = np.floor(values)
+    fraction_in_ns = np.rint((values - whole_units) * nanoseconds_per_unit)
+    return whole_units.astype(np.int64) * nanoseconds_per_unit + fraction_in_ns.astype(
+        np.int64
+    )
+
+
 def seconds_to_nanoseconds(input_value: Union[float, int, np.ndarray]) -> np.ndarray:
-    return (np.array(input_value) * 1_000_000_000).astype(int)
+    return _scale_to_nanoseconds(input_value, 1_000_000_000)
 
 
 def milliseconds_to_nanoseconds(
     input_value: Union[float, int, np.ndarray]
 ) -> np.ndarray:
-    return (np.array(input_value) * 1_000_000).astype(int)
+    return _scale_to_nanoseconds(input_value, 1_000_000)
 
 
 def microseconds_to_nanoseconds(
     input_value: Union[float, int, np.ndarray]
 ) -> np.ndarray:
-    return (np.array(input_value) * 1_000).astype(int)
+    return _scale_to_nanoseconds(input_value, 1_000)
 
 
 def nanoseconds_to_nanoseconds(
     input_value: Union[float, int, np.ndarray]
 ) -> np.ndarray:
-    return np.array(input_value).astype(int)
+    return _scale_to_nanoseconds(input_value, 1)
 
 
-def get_to_nanoseconds_conversion_method(units: Union[str, bytes]) -> Callable:
-    try:
-        units = str(units, encoding="utf8")  # type: ignore
-    except TypeError:
-        pass
+def convert_to_nanoseconds(
+    input_value: Union[float, int, np.ndarray],
+    nanoseconds_per_unit: int,
+    out: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """
+    Converts relative times, such as time-of-flight, directly into out, which may have a
+    narrower integer dtype than int64, for example the uint32 used by ev42 messages.
+    Integers are scaled exactly, floats are rounded to the nearest nanosecond.
+    Floats are scaled in blocks to avoid full size temporary arrays, so are not suitable for
+    absolute times which need more precision than float64 has, use _scale_to_nanoseconds for those.
+    :param out: if None, an int64 array is returned
+    """
+    values = np.asarray(input_value)
+    if out is None:
+        return _scale_to_nanoseconds(values, nanoseconds_per_unit)
+    if np.issubdtype(values.dtype, np.integer):
+        if nanoseconds_per_unit == 1:
+            np.copyto(out, values, casting="unsafe")
+        else:
+            np.multiply(
+                values, nanoseconds_per_unit, out=out, dtype=np.int64, casting="unsafe"
+            )
+        return out
+    scaled = np.empty(min(values.size, _CONVERSION_BLOCK_LENGTH), dtype=np.float64)
+    for start in range(0, values.size, _CONVERSION_BLOCK_LENGTH):
+        block = values[start : start + _CONVERSION_BLOCK_LENGTH]
+        scaled_block = scaled[: block.size]
+        np.multiply(block, nanoseconds_per_unit, out=scaled_block, dtype=np.float64)
+        np.rint(scaled_block, out=out[start : start + block.size], casting="unsafe")
+    return out
+
+
+@lru_cache(maxsize=None)
+def _parse_nanoseconds_per_unit(units: str) -> int:
     input_units = ureg(units)
-
     if input_units == SECONDS:
-        return seconds_to_nanoseconds
+        return 1_000_000_000
     elif input_units == MILLISECONDS:
-        return milliseconds_to_nanoseconds
+        return 1_000_000
     elif input_units == MICROSECONDS:
-        return microseconds_to_nanoseconds
+        return 1_000
     elif input_units == NANOSECONDS:
-        return nanoseconds_to_nanoseconds
+        return 1
     else:
-        raise UndefinedUnitError
+        raise UndefinedUnitError(units)
+
+
+def get_nanoseconds_per_unit(units: Union[str, bytes]) -> int:
+    """
+    Unit strings are parsed by pint once and then looked up
+    :raises UndefinedUnitError if units are not a recognised time unit
+    """
+    try:
+        units = str(units, encoding="utf8")  # type: ignore
+    except TypeError:
+        pass
+    return _parse_nanoseconds_per_unit(units)
+
+
+_CONVERSION_METHODS = {
+    1_000_000_000: seconds_to_nanoseconds,
+    1_000_000: milliseconds_to_nanoseconds,
+    1_000: microseconds_to_nanoseconds,
+    1: nanoseconds_to_nanoseconds,
+}
+
+
+def get_to_nanoseconds_conversion_method(units: Union[str, bytes]) -> Callable:
+    return _CONVERSION_METHODS[get_nanoseconds_per_unit(units)]
@@ -1,50 +1,92 @@
 import h5py
-from typing import Union, Tuple, Dict, List, Optional
+from typing import Union, Tuple, List, Optional
 from .data_source import EventDataSource, FakeEventDataSource
+from .event_data_source import (
+    DEFAULT_SOURCE_MEMORY_BUDGET_BYTES,
+    UNIFORM_DISTRIBUTION,
+)
 from .log_data_source import LogDataSource
 from .source_error import BadSource
 from .application_logger import get_logger
 from .convert_units import iso8601_to_ns_since_epoch
+from .chunk_decompression import DecompressionPool
+from .nexus_file_index import NX_ENTRY, NexusFileIndex
+from .pulse_index_cache import PulseIndexCache
 
 
-def get_attr_as_str(h5_object, attribute_name: str):
-    try:
-        return h5_object.attrs[attribute_name].decode("utf8")
-    except AttributeError:
-        return h5_object.attrs[attribute_name]
+def get_event_source_memory_budget(
+    number_of_event_sources: int,
+    source_memory_budget_bytes: int = DEFAULT_SOURCE_MEMORY_BUDGET_BYTES,
+    total_memory_budget_bytes: Optional[int] = None,
+) -> int:
+    """
+    Memory each event data source may use, the total budget is shared equally
+    """
+    if total_memory_budget_bytes is not None and number_of_event_sources:
+        return min(
+            source_memory_budget_bytes,
+            total_memory_budget_bytes // number_of_event_sources,
+        )
+    return source_memory_budget_bytes
 
 
-def find_by_nx_class(
-    nx_class_names: Tuple[str, ...], root: Union[h5py.File, h5py.Group]
-) -> Dict[str, List[h5py.Group]]:
-    groups_with_requested_nx_class: Dict[str, List[h5py.Group]] = {
-        class_name: [] for class_name in nx_class_names
-    }
-
-    def _match_nx_class(_, h5_object):
-        if isinstance(h5_object, h5py.Group):
-            try:
-                if get_attr_as_str(h5_object, "NX_class") in nx_class_names:
-                    groups_with_requested_nx_class[
-                        get_attr_as_str(h5_object, "NX_class")
-                    ].append(h5_object)
-            except KeyError:
-                pass
-
-    root.visititems(_match_nx_class)
-    return groups_with_requested_nx_class
+def create_event_data_source(
+    group: h5py.Group,
+    fake_events_per_pulse: Optional[int],
+    decompression_pool: Optional[DecompressionPool] = None,
+    memory_budget_bytes: int = DEFAULT_SOURCE_MEMORY_BUDGET_BYTES,
+    fake_events_distribution: str = UNIFORM_DISTRIBUTION,
+    fake_events_poisson: bool = False,
+    pulse_index_cache: Optional[PulseIndexCache] = None,
+) -> Union[EventDataSource, FakeEventDataSource]:
+    """
+    :raises BadSource if there is a critical problem with the data source
+    """
+    if fake_events_per_pulse is not None:
+        return FakeEventDataSource(
+            group,
+            fake_events_per_pulse,
+            fake_events_distribution,
+            fake_events_poisson,
+            pulse_index_cache,
+        )
+    return EventDataSource(
+        group, decompression_pool, memory_budget_bytes, pulse_index_cache
+    )
 
 
 def create_data_sources_from_nexus_file(
     nexus_file: h5py.File,
     fake_events_per_pulse: Optional[int],
+    decompression_pool: Optional[DecompressionPool] = None,
+    source_memory_budget_bytes: int = DEFAULT_SOURCE_MEMORY_BUDGET_BYTES,
+    total_memory_budget_bytes: Optional[int] = None,
+    fake_events_distribution: str = UNIFORM_DISTRIBUTION,
+    fake_events_poisson: bool = False,
+    nexus_file_index: Optional[NexusFileIndex] = None,
+    pulse_index_cache: Optional[PulseIndexCache] = None,
 ) -> Tuple[List[LogDataSource], List[Union[EventDataSource, FakeEventDataSource]]]:
-    nx_log = "NXlog"
-    nx_event_data = "NXevent_data"
-    groups = find_by_nx_class((nx_log, nx_event_data), nexus_file)
+    """
+    :param source_memory_budget_bytes: memory each event data source may use for event data
+    :param total_memory_budget_bytes: if provided, memory all event data sources may use, shared equally
+    :param fake_events_distribution: "uniform" or "file", see FakeEventDataSource
+    :param fake_events_poisson: vary the number of fake events per pulse
+    :param nexus_file_index: index of the file, if it has already been created
+    :param pulse_index_cache: if provided, pulse times and event index of event data sources are cached in it
+    """
+    if nexus_file_index is None:
+        nexus_file_index = NexusFileIndex(nexus_file)
+    log_groups = nexus_file_index.get_groups("NXlog")
+    event_data_groups = nexus_file_index.get_groups("NXevent_data")
+
+    memory_budget_bytes = get_event_source_memory_budget(
+        len(event_data_groups),
+        source_memory_budget_bytes,
+        total_memory_budget_bytes,
+    )
 
     log_sources = []
-    for group in groups[nx_log]:
+    for group in log_groups:
         try:
             log_sources.append(LogDataSource(group))
         except BadSource:
@@ -52,12 +94,19 @@ def create_data_sources_from_nexus_file(
             pass
 
     event_sources: List[Union[EventDataSource, FakeEventDataSource]] = []
-    for group in groups[nx_event_data]:
+    for group in event_data_groups:
         try:
-            if fake_events_per_pulse is not None:
-                event_sources.append(FakeEventDataSource(group, fake_events_per_pulse))
-            else:
-                event_sources.append(EventDataSource(group))
+            event_sources.append(
+                create_event_data_source(
+                    group,
+                    fake_events_per_pulse,
+                    decompression_pool,
+                    memory_budget_bytes,
+                    fake_events_distribution,
+                    fake_events_poisson,
+                    pulse_index_cache,
+                )
+            )
         except BadSource:
             # Reason for error is logged in source init
             pass
@@ -65,32 +114,29 @@ def create_data_sources_from_nexus_file(
     return log_sources, event_sources
 
 
-def get_recorded_run_start_time_ns(filename: str) -> Tuple[int, str]:
+def get_recorded_run_start_time_ns(
+    nexus_file_index: NexusFileIndex,
+) -> Tuple[int, str]:
+    """
+    :return: earliest start_time of the NXentry groups, and path of its dataset
+    """
     logger = get_logger()
-    with h5py.File(filename, "r") as nexus_file:
-        # start_time dataset in the NXentry is method of recording run start supported by the standard
-        nx_entry_class = "NXentry"
-        entry_groups = find_by_nx_class((nx_entry_class,), nexus_file)
-        if len(entry_groups) > 1:
-            logger.warning(
-                "More than one NXentry group found."
-                "Note: NeXus Streamer will stream data from all groups as if it were one experiment run."
-            )
-        run_start_time_ns = None
-        run_start_dataset_path = ""
-        for entry_group in entry_groups[nx_entry_class]:
-            try:
-                start_time_dataset = entry_group["start_time"]
-                found_start_time_ns = iso8601_to_ns_since_epoch(start_time_dataset[()])
-                if run_start_time_ns is None or found_start_time_ns < run_start_time_ns:
-                    run_start_time_ns = found_start_time_ns
-                    run_start_dataset_path = start_time_dataset.name
-            except KeyError:
-                pass
+    if len(nexus_file_index.get_group_paths(NX_ENTRY)) > 1:
+        logger.warning(
+            "More than one NXentry group found."
+            "Note: NeXus Streamer will stream data from all groups as if it were one experiment run."
+        )
+    run_start_time_ns = None
+    run_start_dataset_path = ""
+    for start_time_path, start_time in nexus_file_index.start_times.items():
+        found_start_time_ns = iso8601_to_ns_since_epoch(start_time)
+        if run_start_time_ns is None or found_start_time_ns < run_start_time_ns:
+            run_start_time_ns = found_start_time_ns
+            run_start_dataset_path = start_time_path
 
-        if run_start_time_ns is not None:
-            return run_start_time_ns, run_start_dataset_path
+    if run_start_time_ns is not None:
+        return run_start_time_ns, run_start_dataset_path
 
-        logger.error("No start_time dataset found in NXentry to use as run start time")
-        raise RuntimeError("Found nothing to use as run start time")
-        # TODO find earliest NXlog or NXevent_data timestamp and use that as run start...
+    logger.error("No start_time dataset found in NXentry to use as run start time")
+    raise RuntimeError("Found nothing to use as run start time")
+    # TODO find earliest NXlog or NXevent_data timestamp and use that as run start...
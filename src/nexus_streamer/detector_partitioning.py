@@ -0,0 +1,122 @@
+from bisect import bisect_right
+from typing import List, Optional, Sequence
+
+import h5py
+import numpy as np
+
+from .application_logger import get_logger
+from .event_data_source import EventPulseBlock
+
+# Publish each detector id range to a different partition of the event data topic
+PARTITION_TARGET = "partition"
+# Publish each detector id range to a separate topic
+TOPIC_TARGET = "topic"
+
+# Largest sort key for which a 16-bit key, and therefore numpy's linear time radix sort, can be used
+_MAX_UINT16_KEY = np.iinfo(np.uint16).max
+
+
+class DetectorIdPartitioning:
+    def __init__(self, range_starts: Sequence[int]):
+        """
+        Splits events into ranges of detector id, range i contains the ids from
+        range_starts[i] up to but not including range_starts[i + 1].
+        Ids below the first range start are put in the first range.
+        :param range_starts: first detector id of each range, in increasing order
+        """
+        if len(range_starts) == 0:
+            raise ValueError("At least one detector id range is required")
+        if any(np.diff(range_starts) <= 0):
+            raise ValueError("Detector id ranges must be in increasing order")
+        self.range_starts = [int(start) for start in range_starts]
+        # Only the boundaries between ranges are needed to find which range an id is in
+        self._boundaries = np.array(self.range_starts[1:], dtype=np.int64)
+
+    @property
+    def number_of_ranges(self) -> int:
+        return len(self.range_starts)
+
+    def get_range(self, detector_id: int) -> int:
+        return bisect_right(self.range_starts, detector_id, lo=1) - 1
+
+    def split_block(self, block: EventPulseBlock) -> EventPulseBlock:
+        """
+        Reorders the events of a block so that the events of each detector id range in
+        each pulse are consecutive, in a single sort over the whole block.
+        In the returned block events for range r of pulse i are
+        detector_id[event_offsets[i * number_of_ranges + r]:event_offsets[i * number_of_ranges + r + 1]]
+        and similarly for time_of_flight. The order of events within each range is kept.
+        """
+        number_of_ranges = self.number_of_ranges
+        number_of_keys = block.number_of_pulses * number_of_ranges
+        key_dtype = np.uint16 if number_of_keys <= _MAX_UINT16_KEY else np.int64
+        # Only events which belong to a pulse are kept
+        events = slice(block.event_offsets[0], block.event_offsets[-1])
+        detector_id = block.detector_id[events]
+        sort_key: np.ndarray = np.repeat(
+            np.arange(0, number_of_keys, number_of_ranges, dtype=key_dtype),
+            np.diff(block.event_offsets),
+        )
+        if number_of_ranges > 1:
+            sort_key += np.searchsorted(
+                self._boundaries, detector_id, side="right"
+            ).astype(key_dtype)
+        # A stable sort of 16-bit keys is a radix sort, linear in the number of events
+        order = np.argsort(sort_key, kind="stable")
+        event_offsets = np.zeros(number_of_keys + 1, dtype=np.int64)
+        np.cumsum(
+            np.bincount(sort_key, minlength=number_of_keys), out=event_offsets[1:]
+        )
+        return EventPulseBlock(
+            block.time_of_flight[events][order],
+            detector_id[order],
+            event_offsets,
+            block.pulse_times,
+        )
+
+
+def create_partitioning_from_detector_numbers(
+    detector_numbers: np.ndarray, number_of_ranges: int
+) -> DetectorIdPartitioning:
+    """
+    Ranges containing similar numbers of detector pixels
+    """
+    detector_numbers = np.unique(detector_numbers)
+    number_of_ranges = max(min(number_of_ranges, detector_numbers.size), 1)
+    range_starts = detector_numbers[
+        np.arange(number_of_ranges) * detector_numbers.size // number_of_ranges
+    ]
+    return DetectorIdPartitioning(range_starts.tolist())
+
+
+def create_partitioning(
+    nexus_file: h5py.File,
+    source_path: str,
+    number_of_ranges: Optional[int],
+    range_starts: Optional[Sequence[int]],
+) -> Optional[DetectorIdPartitioning]:
+    """
+    :param source_path: path of the NXevent_data group in the file
+    :param number_of_ranges: if provided, ranges are derived from detector_number in the parent group
+    :param range_starts: if provided, first detector id of each range, takes precedence over number_of_ranges
+    :return: None if events are not to be split by detector id
+    """
+    if range_starts is not None:
+        return DetectorIdPartitioning(range_starts)
+    if number_of_ranges is None:
+        return None
+    try:
+        detector_numbers = nexus_file[source_path].parent["detector_number"][...]
+    except KeyError:
+        get_logger().warning(
+            f"detector_number dataset not found in parent group of {source_path}, "
+            f"events from this NXevent_data will not be split by detector id"
+        )
+        return None
+    return create_partitioning_from_detector_numbers(detector_numbers, number_of_ranges)
+
+
+def get_range_topics(event_data_topic: str, number_of_ranges: int) -> List[str]:
+    return [
+        f"{event_data_topic}_{range_index}" for range_index in range(number_of_ranges)
+    ]
@@ -1,73 +1,278 @@
 import h5py
-from typing import Tuple, Optional, Generator, Callable, Union
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import (
+    Deque,
+    Tuple,
+    Optional,
+    Generator,
+    Callable,
+    Union,
+    NamedTuple,
+    Iterator,
+)
 import numpy as np
 from .application_logger import get_logger
 from .convert_units import (
+    convert_to_nanoseconds,
+    get_nanoseconds_per_unit,
     get_to_nanoseconds_conversion_method,
     iso8601_to_ns_since_epoch,
 )
 from pint.errors import UndefinedUnitError
 from .source_error import BadSource
+from .chunk_decompression import (
+    DecompressionPool,
+    ParallelChunkReader,
+    can_read_chunks_directly,
+)
+from .pulse_index_cache import EVENT_INDEX, PULSE_TIMES, PulseIndexCache
 
 
 class _ChunkDataLoader:
-    def __init__(self, dataset: h5py.Dataset):
+    def __init__(
+        self,
+        dataset: h5py.Dataset,
+        create_chunk_iterator: Optional[Callable[[], Iterator[np.ndarray]]] = None,
+    ):
+        """
+        Serves data for consecutive pulses from a sliding window of decoded chunks.
+        Chunks are dropped from the front of the window once no later pulse can need them.
+        :param create_chunk_iterator: creates an iterator which yields consecutive parts of the
+          dataset from its start, defaults to reading the dataset's chunks
+        """
         self._dataset = dataset
-        self._chunk_iterator = self._dataset.iter_chunks()
-        next_slice = next(self._chunk_iterator)
-        self._current_chunk = self._dataset[next_slice]
-        self._start_index: int = 0
+        self._chunks: Deque[np.ndarray] = deque()
+        # Index in the dataset of the first and one past the last element in the window
+        self._window_start: int = 0
+        self._window_end: int = 0
+
+        if create_chunk_iterator is None:
+            create_chunk_iterator = self._read_chunks
+        self._create_chunk_iterator = create_chunk_iterator
+        self._chunk_iterator = create_chunk_iterator()
+
+    def _read_chunks(self) -> Iterator[np.ndarray]:
+        return (
+            self._dataset[chunk_slice] for chunk_slice in self._dataset.iter_chunks()
+        )
+
+    def rewind(self):
+        """
+        Serve data from the start of the dataset again, for example for the next run
+        """
+        if self._window_end == 0:
+            # Nothing has been read yet
+            return
+        # Reads which are in progress or queued for the old iterator are abandoned
+        close = getattr(self._chunk_iterator, "close", None)
+        if close is not None:
+            close()
+        self._chunks.clear()
+        self._window_start = 0
+        self._window_end = 0
+        self._chunk_iterator = self._create_chunk_iterator()
+
+    def _load_next_chunk(self) -> bool:
+        try:
+            chunk = next(self._chunk_iterator)
+        except StopIteration:
+            return False
+        self._chunks.append(chunk)
+        self._window_end += chunk.size
+        return True
+
+    def _drop_chunks_before(self, index: int):
+        while self._chunks and self._window_start + self._chunks[0].size <= index:
+            self._window_start += self._chunks.popleft().size
 
     def get_data_for_pulse(
         self, pulse_start_event: int, pulse_end_event: int
     ) -> np.ndarray:
-        start_index = int(pulse_start_event - self._start_index)
-        end_index = int(pulse_end_event - self._start_index)
-
-        data_for_pulse = np.array([], dtype=self._current_chunk.dtype)
-        while True:
-            # If all the data we need is in the current, cached chunk,
-            # then just append and return it
-            if end_index < self._current_chunk.size:
-                return np.append(
-                    data_for_pulse, self._current_chunk[start_index:end_index]
-                )
-            # else...
-            # we need all the data in the current chunk...
-            data_for_pulse = np.append(
-                data_for_pulse, self._current_chunk[start_index:]
-            )
-            # and at least some from the next chunk, so load the next chunk and continue
-            end_index -= self._current_chunk.size
-            start_index = 0
-            self._start_index += self._current_chunk.size
-            try:
-                next_slice = next(self._chunk_iterator)
-            except StopIteration:
-                return data_for_pulse
-            self._current_chunk = self._dataset[next_slice]
+        start_index = int(pulse_start_event)
+        end_index = int(pulse_end_event)
+
+        self._drop_chunks_before(start_index)
+        while self._window_end < end_index:
+            if not self._load_next_chunk():
+                # Reached end of the dataset, return whatever data we have for this pulse
+                end_index = self._window_end
+                break
+            self._drop_chunks_before(start_index)
+
+        if end_index <= start_index:
+            return np.array([], dtype=self._dataset.dtype)
+
+        start_in_window = start_index - self._window_start
+        end_in_window = end_index - self._window_start
+        first_chunk = self._chunks[0]
+        # If all the data we need is in one chunk then return a view of it
+        if end_in_window <= first_chunk.size:
+            return first_chunk[start_in_window:end_in_window]
+
+        # else the pulse spans chunks, copy each part once into a preallocated array
+        data_for_pulse = np.empty(end_index - start_index, dtype=first_chunk.dtype)
+        filled = 0
+        for chunk in self._chunks:
+            if filled == data_for_pulse.size:
+                break
+            part = chunk[
+                start_in_window : start_in_window + data_for_pulse.size - filled
+            ]
+            data_for_pulse[filled : filled + part.size] = part
+            filled += part.size
+            start_in_window = 0
+        return data_for_pulse
+
+
+class _ParallelChunkDataLoader(_ChunkDataLoader):
+    def __init__(self, dataset: h5py.Dataset, decompression_pool: DecompressionPool):
+        """
+        Same as _ChunkDataLoader, but raw chunks are read directly and decompressed in parallel in the pool
+        """
+        super().__init__(
+            dataset, lambda: ParallelChunkReader(dataset, decompression_pool)
+        )
 
 
 class _ContiguousDataLoader:
     def __init__(self, dataset: h5py.Dataset):
-        self._dataset = dataset
-        max_bytes_willing_to_load_into_memory = 100_000_000  # 100 MB
-        if self._dataset.nbytes < max_bytes_willing_to_load_into_memory:
-            self._dataset = self._dataset[...]
-        elif self._dataset.compression is not None:
-            get_logger().warning(
-                f"{self._dataset.name} is larger than {max_bytes_willing_to_load_into_memory} bytes,"
-                f"contiguous and compressed, it will be very slow to stream if these event data are from many pulses"
-            )
+        """
+        Loads the whole dataset into memory, use only if it fits within the memory budget
+        """
+        self._data = dataset[...]
+
+    def rewind(self):
+        # The whole dataset stays in memory, so it is not read again
+        pass
 
     def get_data_for_pulse(
         self, pulse_start_event: int, pulse_end_event: int
     ) -> np.ndarray:
-        return self._dataset[pulse_start_event:pulse_end_event]
+        return self._data[pulse_start_event:pulse_end_event]
+
+
+class _ReadAheadWindows:
+    def __init__(self, dataset: h5py.Dataset, window_length: int):
+        """
+        Iterates over consecutive hyperslabs of a 1D dataset, always reading the next one
+        in a worker thread while the current one is being used
+        """
+        self._dataset = dataset
+        self._window_length = window_length
+        self._next_window_start = 0
+        self._read_ahead = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="read-ahead"
+        )
+        self._next_window = self._read_next_window()
+
+    def _read_next_window(self) -> Optional[Future]:
+        window_start = self._next_window_start
+        if window_start >= self._dataset.len():
+            self._read_ahead.shutdown(wait=False)
+            return None
+        self._next_window_start += self._window_length
+        return self._read_ahead.submit(
+            self._dataset.__getitem__,
+            slice(window_start, window_start + self._window_length),
+        )
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> np.ndarray:
+        if self._next_window is None:
+            raise StopIteration
+        window = self._next_window.result()
+        self._next_window = self._read_next_window()
+        return window
+
+    def close(self):
+        self._next_window = None
+        self._read_ahead.shutdown(wait=False)
+
+
+class _WindowedDataLoader(_ChunkDataLoader):
+    def __init__(self, dataset: h5py.Dataset, memory_budget_bytes: int):
+        """
+        For contiguous datasets which are too large to load into memory.
+        Same as _ChunkDataLoader but with large windows of the dataset in place of chunks.
+        """
+        # A third of the budget per window: two can be in use while a pulse spans the boundary
+        # between them and another is being read ahead
+        window_length = max(memory_budget_bytes // (3 * dataset.dtype.itemsize), 1)
+        super().__init__(dataset, lambda: _ReadAheadWindows(dataset, window_length))
 
 
 _DataLoader = Union[_ChunkDataLoader, _ContiguousDataLoader]
 
+# Memory which each event data source may use for its event_time_offset and event_id data
+DEFAULT_SOURCE_MEMORY_BUDGET_BYTES = 200_000_000
+
+
+def _create_data_loader(
+    dataset: h5py.Dataset,
+    decompression_pool: Optional[DecompressionPool],
+    memory_budget_bytes: int,
+) -> _DataLoader:
+    try:
+        dataset.iter_chunks()
+    except TypeError:
+        if dataset.nbytes <= memory_budget_bytes:
+            return _ContiguousDataLoader(dataset)
+        return _WindowedDataLoader(dataset, memory_budget_bytes)
+    if decompression_pool is not None and can_read_chunks_directly(dataset):
+        return _ParallelChunkDataLoader(dataset, decompression_pool)
+    return _ChunkDataLoader(dataset)
+
+
+# Number of pulses read and converted at once by get_data_blocks,
+# about 10 seconds of data at 14 Hz
+DEFAULT_PULSES_PER_BLOCK = 140
+
+# Time-of-flight is published in ev42 messages as uint32 nanoseconds
+_TIME_OF_FLIGHT_DTYPE = np.uint32
+
+
+class EventPulseBlock(NamedTuple):
+    """
+    Event data for consecutive pulses, events for pulse i are
+    time_of_flight[event_offsets[i]:event_offsets[i + 1]] and similarly for detector_id
+    """
+
+    time_of_flight: np.ndarray
+    detector_id: np.ndarray
+    event_offsets: np.ndarray
+    pulse_times: np.ndarray
+
+    @property
+    def number_of_pulses(self) -> int:
+        return self.pulse_times.size
+
+    def get_pulse(self, pulse_number: int) -> Tuple[np.ndarray, np.ndarray, int]:
+        """
+        Returns views of the time-of-flight and detector id arrays for a single pulse,
+        and the pulse time in nanoseconds
+        """
+        start_event = self.event_offsets[pulse_number]
+        end_event = self.event_offsets[pulse_number + 1]
+        return (
+            self.time_of_flight[start_event:end_event],
+            self.detector_id[start_event:end_event],
+            int(self.pulse_times[pulse_number]),
+        )
+
+
+def _get_pulses_from_blocks(
+    get_blocks: Generator[Optional[EventPulseBlock], None, None]
+) -> Generator[Tuple[Optional[np.ndarray], Optional[np.ndarray], int], None, None]:
+    for block in get_blocks:
+        if block is None:
+            break
+        for pulse_number in range(block.number_of_pulses):
+            yield block.get_pulse(pulse_number)
+    yield None, None, 0
+
 
 def _get_pulse_time_offset_in_ns(pulse_time_dataset: h5py.Group) -> int:
     """
@@ -81,10 +286,104 @@ def _get_pulse_time_offset_in_ns(pulse_time_dataset: h5py.Group) -> int:
     return iso8601_to_ns_since_epoch(date_string)
 
 
+# Elements of event_time_zero and event_index read at once, about 78 minutes at 14 Hz
+_PULSE_WINDOW_LENGTH = 2**16
+
+
+class _WindowedPulseColumn:
+    def __init__(
+        self,
+        dataset: h5py.Dataset,
+        size: int,
+        convert: Optional[Callable[[np.ndarray], np.ndarray]] = None,
+        last_value: Optional[int] = None,
+        window_length: int = _PULSE_WINDOW_LENGTH,
+    ):
+        """
+        A 1D pulse dataset, such as event_time_zero or event_index, read in windows which
+        advance with the publish position instead of all at once, so that memory use does
+        not grow with the length of the run. Sliced like a numpy array.
+        :param size: number of elements, one more than the dataset has if last_value is appended
+        :param convert: applied to each window as it is read
+        :param last_value: if provided, replaces or is appended as the last element
+        """
+        self._dataset = dataset
+        self.size = size
+        self._convert = convert
+        self._last_value = last_value
+        self._window_length = window_length
+        # Elements from the dataset, the last one is last_value if that is provided
+        self._stored_size = size if last_value is None else size - 1
+        self._window: np.ndarray = self._read(0, 0)
+        self._window_start = 0
+
+    def _read(self, start: int, end: int) -> np.ndarray:
+        data = self._dataset[start:end]
+        if self._convert is not None:
+            data = self._convert(data)
+        return data
+
+    def _get_stored(self, start: int, end: int) -> np.ndarray:
+        parts = []
+        position = start
+        while position < end:
+            window_end = self._window_start + self._window.size
+            if not self._window_start <= position < window_end:
+                # A new array rather than overwriting the old window, as blocks
+                # which are waiting to be published may have views of it
+                self._window = self._read(
+                    position,
+                    min(max(position + self._window_length, end), self._stored_size),
+                )
+                self._window_start = position
+                window_end = self._window_start + self._window.size
+            part_end = min(end, window_end)
+            parts.append(
+                self._window[
+                    position - self._window_start : part_end - self._window_start
+                ]
+            )
+            position = part_end
+        if not parts:
+            return self._window[:0]
+        if len(parts) == 1:
+            return parts[0]
+        return np.concatenate(parts)
+
+    def __getitem__(self, key: Union[int, slice]):
+        if isinstance(key, slice):
+            start, end, step = key.indices(self.size)
+            if step != 1:
+                raise IndexError("Only contiguous slices are supported")
+            data = self._get_stored(start, min(end, self._stored_size))
+            if self._last_value is not None and start < end == self.size:
+                data = np.append(data, np.array([self._last_value], dtype=data.dtype))
+            return data
+        index = key + self.size if key < 0 else key
+        if not 0 <= index < self.size:
+            raise IndexError(f"Index {key} is out of range for size {self.size}")
+        if self._last_value is not None and index == self.size - 1:
+            return self._last_value
+        # Read directly, without moving the window, for example for the final timestamp
+        return self._read(index, index + 1)[0]
+
+
+_PulseColumn = Union[np.ndarray, _WindowedPulseColumn]
+
+
 class EventDataSource:
-    def __init__(self, group: h5py.Group):
+    def __init__(
+        self,
+        group: h5py.Group,
+        decompression_pool: Optional[DecompressionPool] = None,
+        memory_budget_bytes: int = DEFAULT_SOURCE_MEMORY_BUDGET_BYTES,
+        pulse_index_cache: Optional[PulseIndexCache] = None,
+    ):
         """
         Load data, one pulse at a time from NXevent_data in NeXus file
+        :param decompression_pool: if provided, compressed chunks are decompressed in parallel in this pool
+        :param memory_budget_bytes: contiguous event data larger than this are read in windows rather than all at once
+        :param pulse_index_cache: if provided, pulse times and event index are loaded from and saved to this cache
         :raises BadSource if there is a critical problem with the data source
         """
         self._group = group
@@ -95,8 +394,8 @@ class EventDataSource:
         if self._has_missing_fields():
             raise BadSource()
         try:
-            self._convert_pulse_time = _get_pulse_time_unit_converter(group)
-            self._convert_event_time = self._get_event_time_unit_converter()
+            convert_pulse_time = _get_pulse_time_unit_converter(group)
+            self._event_time_ns_per_unit = self._get_event_time_ns_per_unit()
         except UndefinedUnitError:
             self._logger.error(
                 f"Unable to publish data from NXevent_data at {self._group.name} due to unrecognised "
@@ -104,45 +403,30 @@ class EventDataSource:
             )
             raise BadSource()
 
-        self._event_time_zero = self._group["event_time_zero"][...]
-        self._event_index = self._group["event_index"][...]
-
-        # There is some variation in the last recorded event_index in files from different institutions
-        # for example ISIS files often have what would be the first index of the next pulse at the end.
-        # This logic hopefully covers most cases
-        if self._event_index[-1] < self._group["event_id"].len():
-            self._event_index = np.append(
-                self._event_index,
-                np.array([self._group["event_id"].len() - 1]).astype(
-                    self._event_index.dtype
-                ),
-            )
-        else:
-            self._event_index[-1] = self._group["event_id"].len()
-
-        try:
-            self._group["event_time_offset"].iter_chunks()
-            self._tof_loader = _ChunkDataLoader(self._group["event_time_offset"])
-        except TypeError:
-            self._tof_loader = _ContiguousDataLoader(self._group["event_time_offset"])
-
-        try:
-            self._group["event_id"].iter_chunks()
-            self._id_loader = _ChunkDataLoader(self._group["event_id"])
-        except TypeError:
-            self._id_loader = _ContiguousDataLoader(self._group["event_id"])
+        self._pulse_times_ns = _load_or_create(
+            pulse_index_cache,
+            group,
+            PULSE_TIMES,
+            _get_pulse_times_in_ns(group, convert_pulse_time),
+        )
+        self._event_index = _load_or_create(
+            pulse_index_cache, group, EVENT_INDEX, _get_event_index(group)
+        )
 
-        self._pulse_time_offset_ns = _get_pulse_time_offset_in_ns(
-            self._group["event_time_zero"]
+        # Budget is shared equally by the two event datasets
+        self._tof_loader = _create_data_loader(
+            self._group["event_time_offset"],
+            decompression_pool,
+            memory_budget_bytes // 2,
+        )
+        self._id_loader = _create_data_loader(
+            self._group["event_id"], decompression_pool, memory_budget_bytes // 2
         )
 
     @property
     def final_timestamp(self) -> int:
         # Last pulse time is good enough, we won't try to find the last event in the last pulse
-        return (
-            self._convert_pulse_time(self._event_time_zero[-1])
-            + self._pulse_time_offset_ns
-        )
+        return int(self._pulse_times_ns[-1])
 
     def get_data(
         self,
@@ -150,18 +434,37 @@ class EventDataSource:
         """
         Returns None instead of a data when there is no more data
         """
+        return _get_pulses_from_blocks(self.get_data_blocks())
+
+    def get_data_blocks(
+        self, pulses_per_block: int = DEFAULT_PULSES_PER_BLOCK
+    ) -> Generator[Optional[EventPulseBlock], None, None]:
+        """
+        Returns None instead of a block when there is no more data.
+        Each call starts from the first pulse, so that the source can be streamed again in later runs.
+        """
+        self._tof_loader.rewind()
+        self._id_loader.rewind()
         # -1 as last index would be start of the next pulse after the end of the run
-        for pulse_number in range(self._event_index.size - 1):
-            pulse_time = (
-                self._convert_pulse_time(self._event_time_zero[pulse_number])
-                + self._pulse_time_offset_ns
-            )
-            start_event = self._event_index[pulse_number]
-            end_event = self._event_index[pulse_number + 1]
-            yield self._convert_event_time(
+        number_of_pulses = self._event_index.size - 1
+        for first_pulse in range(0, number_of_pulses, pulses_per_block):
+            end_pulse = min(first_pulse + pulses_per_block, number_of_pulses)
+            pulse_times = self._pulse_times_ns[first_pulse:end_pulse]
+            event_index = self._event_index[first_pulse : end_pulse + 1]
+            start_event = event_index[0]
+            end_event = event_index[-1]
+            time_of_flight = self._convert_event_time(
                 self._tof_loader.get_data_for_pulse(start_event, end_event)
-            ), self._id_loader.get_data_for_pulse(start_event, end_event), pulse_time
-        yield None, None, 0
+            )
+            detector_id = self._id_loader.get_data_for_pulse(start_event, end_event)
+            # Loaders return less data than requested if event_index points past the end of the datasets
+            event_offsets = np.minimum(
+                (event_index - start_event).astype(np.int64), detector_id.size
+            )
+            yield EventPulseBlock(
+                time_of_flight, detector_id, event_offsets, pulse_times
+            )
+        yield None
 
     def _has_missing_fields(self) -> bool:
         missing_field = False
@@ -179,17 +482,71 @@ class EventDataSource:
                 missing_field = True
         return missing_field
 
-    def _get_event_time_unit_converter(self) -> Callable:
+    def _get_event_time_ns_per_unit(self) -> int:
         try:
             units = self._group["event_time_offset"].attrs["units"]
         except AttributeError:
             raise UndefinedUnitError
-        return get_to_nanoseconds_conversion_method(units)
+        return get_nanoseconds_per_unit(units)
+
+    def _convert_event_time(self, event_time_offset: np.ndarray) -> np.ndarray:
+        """
+        Converts straight to the dtype of time-of-flight in ev42 messages,
+        so serialisation does not need to narrow a wider array
+        """
+        if (
+            event_time_offset.dtype == _TIME_OF_FLIGHT_DTYPE
+            and self._event_time_ns_per_unit == 1
+        ):
+            return event_time_offset
+        return convert_to_nanoseconds(
+            event_time_offset,
+            self._event_time_ns_per_unit,
+            out=np.empty(event_time_offset.size, dtype=_TIME_OF_FLIGHT_DTYPE),
+        )
 
     @property
     def name(self):
         return self._group.name.split("/")[-1]
 
+    @property
+    def path(self) -> str:
+        return self._group.name
+
+
+def _get_event_index(group: h5py.Group) -> _WindowedPulseColumn:
+    event_index = group["event_index"]
+    number_of_events = group["event_id"].len()
+    # There is some variation in the last recorded event_index in files from different institutions
+    # for example ISIS files often have what would be the first index of the next pulse at the end.
+    # This logic hopefully covers most cases
+    if event_index[-1] < number_of_events:
+        return _WindowedPulseColumn(
+            event_index, event_index.len() + 1, last_value=number_of_events - 1
+        )
+    return _WindowedPulseColumn(
+        event_index, event_index.len(), last_value=number_of_events
+    )
+
+
+def _load_or_create(
+    pulse_index_cache: Optional[PulseIndexCache],
+    group: h5py.Group,
+    array_name: str,
+    column: _WindowedPulseColumn,
+) -> _PulseColumn:
+    """
+    Array from the cache if it has been saved, otherwise it is read in full and saved.
+    Without a cache the column is read in windows.
+    """
+    if pulse_index_cache is None:
+        return column
+    array = pulse_index_cache.load(group.name, array_name)
+    if array is None:
+        array = column[:]
+        pulse_index_cache.save(group.name, array_name, array)
+    return array
+
 
 def _get_pulse_time_unit_converter(group: h5py.Group) -> Callable:
     try:
@@ -199,37 +556,140 @@ def _get_pulse_time_unit_converter(group: h5py.Group) -> Callable:
     return get_to_nanoseconds_conversion_method(units)
 
 
+def _get_pulse_times_in_ns(
+    group: h5py.Group, convert_pulse_time: Callable
+) -> _WindowedPulseColumn:
+    """
+    Pulse times converted to int64 nanoseconds since unix epoch as they are read
+    """
+    pulse_time_dataset = group["event_time_zero"]
+    offset_ns = _get_pulse_time_offset_in_ns(pulse_time_dataset)
+    return _WindowedPulseColumn(
+        pulse_time_dataset,
+        pulse_time_dataset.len(),
+        lambda pulse_times: convert_pulse_time(pulse_times) + offset_ns,
+    )
+
+
+UNIFORM_DISTRIBUTION = "uniform"
+FILE_DISTRIBUTION = "file"
+
+# Fake time-of-flight range for the uniform distribution
+_FAKE_TOF_MIN_NS = 10000
+_FAKE_TOF_MAX_NS = 10000000
+# Number of real events read to learn distributions from the file
+_DISTRIBUTION_SAMPLE_EVENTS = 10_000_000
+# Resolution of the lookup tables used to sample learned distributions,
+# the time-of-flight table is kept small enough to stay in CPU cache
+_ID_SAMPLING_TABLE_SIZE = 2**20
+_TOF_SAMPLING_TABLE_SIZE = 2**16
+
+
+def _create_sampling_table(sample: np.ndarray, table_size: int) -> np.ndarray:
+    """
+    Quantised inverse cumulative distribution of the sample, drawing uniformly
+    random elements of the table samples the empirical distribution, including the
+    weight of each detector pixel or time-of-flight value
+    """
+    sorted_sample = np.sort(sample)
+    quantile_positions = (
+        (np.arange(table_size) + 0.5) * (sorted_sample.size / table_size)
+    ).astype(np.int64)
+    return sorted_sample[quantile_positions]
+
+
 class FakeEventDataSource:
-    def __init__(self, group: h5py.Group, events_per_pulse: int):
-        logger = get_logger()
+    def __init__(
+        self,
+        group: h5py.Group,
+        events_per_pulse: int,
+        distribution: str = UNIFORM_DISTRIBUTION,
+        poisson_events_per_pulse: bool = False,
+        pulse_index_cache: Optional[PulseIndexCache] = None,
+    ):
+        """
+        Generates random events, a block of pulses at a time, with the pulse times from NXevent_data
+        :param distribution: "uniform" draws detector ids and time-of-flight uniformly, "file" draws
+          them from the distributions of event_id and event_time_offset in the file
+        :param poisson_events_per_pulse: if True the number of events in each pulse is Poisson
+          distributed with mean events_per_pulse
+        :param pulse_index_cache: if provided, pulse times are loaded from and saved to this cache
+        :raises BadSource if there is a critical problem with the data source
+        """
+        self._group = group
+        self._events_per_pulse = events_per_pulse
+        self._poisson_events_per_pulse = poisson_events_per_pulse
+
+        self._pulse_times_ns = _load_or_create(
+            pulse_index_cache,
+            group,
+            PULSE_TIMES,
+            _get_pulse_times_in_ns(group, _get_pulse_time_unit_converter(group)),
+        )
+        self._rng = np.random.default_rng(12345)
+
+        id_table, self._tof_table = None, None
+        if distribution == FILE_DISTRIBUTION:
+            id_table, self._tof_table = self._learn_distributions()
+        if id_table is None:
+            id_table = self._get_detector_ids()
+        self._id_table: np.ndarray = id_table
+
+    def _get_detector_ids(self) -> np.ndarray:
         try:
-            self._detector_ids = group.parent["detector_number"][...]
+            return self._group.parent["detector_number"][...].flatten()
         except KeyError:
-            logger.error(
+            get_logger().error(
                 "detector_number dataset not found in parent group of "
                 "NXevent_data, this must be present when using "
                 "--fake-events-per-pulse"
             )
             raise BadSource()
-        self._events_per_pulse = events_per_pulse
-
-        self._event_time_zero = group["event_time_zero"][...]
-        self._convert_pulse_time = _get_pulse_time_unit_converter(group)
 
-        self._pulse_time_offset_ns = _get_pulse_time_offset_in_ns(
-            group["event_time_zero"]
+    def _learn_distributions(
+        self,
+    ) -> Tuple[Optional[np.ndarray], Optional[np.ndarray]]:
+        """
+        Sampling tables for detector id and time-of-flight from the start of the real event data
+        :return: None for each table that could not be created from the file
+        """
+        logger = get_logger()
+        try:
+            event_ids = self._group["event_id"]
+            event_time_offsets = self._group["event_time_offset"]
+            convert_event_time = get_to_nanoseconds_conversion_method(
+                event_time_offsets.attrs["units"]
+            )
+        except (KeyError, UndefinedUnitError):
+            logger.warning(
+                f"Unable to learn event distributions from NXevent_data at {self._group.name}, "
+                f"missing event fields or units, falling back to uniform fake events"
+            )
+            return None, None
+        number_of_events = min(
+            event_ids.len(), event_time_offsets.len(), _DISTRIBUTION_SAMPLE_EVENTS
+        )
+        if number_of_events == 0:
+            logger.warning(
+                f"No events in NXevent_data at {self._group.name} to learn distributions from, "
+                f"falling back to uniform fake events"
+            )
+            return None, None
+        id_table = _create_sampling_table(
+            event_ids[:number_of_events], _ID_SAMPLING_TABLE_SIZE
+        )
+        tof_table = _create_sampling_table(
+            convert_event_time(event_time_offsets[:number_of_events]),
+            _TOF_SAMPLING_TABLE_SIZE,
+        )
+        return id_table, np.clip(tof_table, 0, np.iinfo(np.uint32).max).astype(
+            np.uint32
         )
-        self._rng = np.random.default_rng(12345)
-
-        self.name = group.name.split("/")[-1]
 
     @property
     def final_timestamp(self) -> int:
         # Last pulse time is good enough, we won't try to find the last event in the last pulse
-        return (
-            self._convert_pulse_time(self._event_time_zero[-1])
-            + self._pulse_time_offset_ns
-        )
+        return int(self._pulse_times_ns[-1])
 
     def get_data(
         self,
@@ -237,19 +697,61 @@ class FakeEventDataSource:
         """
         Returns None instead of a data when there is no more data
         """
-        for pulse_number in range(self._event_time_zero.size):
-            pulse_time = (
-                self._convert_pulse_time(self._event_time_zero[pulse_number])
-                + self._pulse_time_offset_ns
-            )
-
-            tofs = self._rng.integers(
-                low=10000, high=10000000, size=self._events_per_pulse
+        return _get_pulses_from_blocks(self.get_data_blocks())
+
+    def _get_event_offsets(self, number_of_pulses: int) -> np.ndarray:
+        event_offsets = np.zeros(number_of_pulses + 1, dtype=np.int64)
+        if self._poisson_events_per_pulse:
+            np.cumsum(
+                self._rng.poisson(self._events_per_pulse, number_of_pulses),
+                out=event_offsets[1:],
             )
-            detector_num_indices = self._rng.integers(
-                low=0, high=self._detector_ids.size, size=self._events_per_pulse
+        else:
+            np.multiply(
+                np.arange(1, number_of_pulses + 1, dtype=np.int64),
+                self._events_per_pulse,
+                out=event_offsets[1:],
             )
-            ids = self._detector_ids[detector_num_indices]
+        return event_offsets
+
+    def _sample(self, table: np.ndarray, number_of_events: int) -> np.ndarray:
+        return table.take(
+            self._rng.integers(0, table.size, size=number_of_events, dtype=np.uint32)
+        )
+
+    def get_data_blocks(
+        self, pulses_per_block: int = DEFAULT_PULSES_PER_BLOCK
+    ) -> Generator[Optional[EventPulseBlock], None, None]:
+        """
+        Returns None instead of a block when there is no more data.
+        Events for all pulses in the block are drawn together, new arrays are
+        created for each block as earlier blocks may still be waiting to be published.
+        """
+        number_of_pulses = self._pulse_times_ns.size
+        for first_pulse in range(0, number_of_pulses, pulses_per_block):
+            end_pulse = min(first_pulse + pulses_per_block, number_of_pulses)
+            pulse_times = self._pulse_times_ns[first_pulse:end_pulse]
+            event_offsets = self._get_event_offsets(pulse_times.size)
+            number_of_events = int(event_offsets[-1])
+
+            if self._tof_table is None:
+                tofs = self._rng.integers(
+                    _FAKE_TOF_MIN_NS,
+                    _FAKE_TOF_MAX_NS,
+                    size=number_of_events,
+                    dtype=np.uint32,
+                )
+            else:
+                tofs = self._sample(self._tof_table, number_of_events)
+            ids = self._sample(self._id_table, number_of_events)
 
-            yield tofs, ids, pulse_time
-        yield None, None, 0
+            yield EventPulseBlock(tofs, ids, event_offsets, pulse_times)
+        yield None
+
+    @property
+    def name(self):
+        return self._group.name.split("/")[-1]
+
+    @property
+    def path(self) -> str:
+        return self._group.name
@@ -1,9 +1,16 @@
 import time
 import numpy as np
-import nexusformat.nexus as nexus
+import h5py
 import json
+import hashlib
+import os
+import tempfile
+from collections import OrderedDict
+from contextlib import contextmanager
+from threading import Lock
+from .application_logger import get_logger
 from .convert_units import ns_since_epoch_to_iso8601
-from typing import Tuple, Union
+from typing import Any, Collection, Iterator, Optional, Tuple, Union
 
 
 # These datasets are always truncated, this avoids JSON descriptions
@@ -18,10 +25,85 @@ _always_truncate_list = (
     "counts",
 )
 
+# Descriptions generated with nexusformat left out datasets larger than its memory
+# limit, unless they had fewer elements than it loads when opening the file.
+# They are still left out so that descriptions are unchanged.
+_MAX_DATASET_BYTES = 2000 * 1000 * 1000
+_MAX_UNCHECKED_DATASET_SIZE = 1000
+
+# Part of the key of cached JSON trees, increment it if the generated tree changes
+# so that trees cached in files by an older version are not used
+_JSON_TREE_CACHE_VERSION = 1
+# Number of JSON trees kept in memory, for the most recently used files
+_MAX_CACHED_JSON_TREES = 8
+_json_tree_cache: "OrderedDict[str, dict]" = OrderedDict()
+_json_tree_cache_lock = Lock()
+# Stands in for the run start time in description templates
+_RUN_START_TIME_PLACEHOLDER = "NEXUS_STREAMER_RUN_START_TIME"
+
+
+class _SkippedDataset(Exception):
+    pass
+
+
+def _read_attributes(root: Union[h5py.Group, h5py.Dataset]) -> dict:
+    attrs = {}
+    for attr_name in root.attrs:
+        try:
+            attrs[attr_name] = root.attrs[attr_name]
+        except Exception:
+            attrs[attr_name] = None
+    return attrs
+
+
+def _text(value) -> str:
+    """
+    String value of an attribute or scalar dataset, as nexusformat converts them
+    """
+    if isinstance(value, np.ndarray) and value.shape == (1,):
+        value = value[0]
+    if isinstance(value, bytes):
+        try:
+            text = value.decode("utf-8")
+        except UnicodeDecodeError:
+            text = value.decode("latin-1", errors="replace")
+    else:
+        text = str(value)
+    return text.replace("\x00", "").rstrip()
+
+
+def _read_first_elements(dataset: h5py.Dataset, number_of_elements: int) -> np.ndarray:
+    """
+    The first elements of the dataset in C order, only a hyperslab containing them is read
+    """
+    selection = []
+    for dim_number in range(len(dataset.shape)):
+        inner_size = int(np.prod(dataset.shape[dim_number + 1 :]))
+        if number_of_elements <= inner_size:
+            selection.append(slice(0, 1))
+        else:
+            selection.append(slice(0, -(-number_of_elements // inner_size)))
+            break
+    return _read_strings_as_str(dataset, tuple(selection)).reshape(-1)[
+        :number_of_elements
+    ]
+
+
+def _read_strings_as_str(dataset: h5py.Dataset, selection=()) -> np.ndarray:
+    """
+    Variable length strings are read as str, rather than bytes which cannot be
+    written as JSON, other data are read as usual
+    """
+    if dataset.dtype.kind == "O" and h5py.check_string_dtype(dataset.dtype):
+        return dataset.asstr()[selection]
+    return dataset[selection]
+
 
 class NexusToDictConverter:
     """
-    Class used to convert nexus format root to python dict
+    Class used to convert a NeXus file, opened with h5py, to python dict.
+    Output is the same as when the file was loaded with nexusformat, but
+    datasets are read directly and only the part of truncated datasets which is kept.
     """
 
     def __init__(
@@ -40,51 +122,70 @@ class NexusToDictConverter:
         self._event_data_topic = event_data_topic
         self._log_data_topic = log_data_topic
 
-    def convert(self, nexus_root: nexus.NXroot) -> dict:
+    def convert(self, nexus_root: h5py.Group) -> dict:
         """
         Converts the given nexus_root to dict
         """
         return {
             "children": [
-                self._root_to_dict(entry) for _, entry in nexus_root.entries.items()
+                self._root_to_dict(nexus_root, name) for name in nexus_root.keys()
             ]
         }
 
-    def _root_to_dict(self, root: nexus.NXgroup) -> dict:
+    def _root_to_dict(self, parent: h5py.Group, name: str) -> dict:
+        root = parent.get(name)
+        if root is None:
+            # Link which cannot be resolved
+            return {}
         try:
-            if hasattr(root, "entries"):
-                root_dict = self._handle_group(root)
+            attrs = _read_attributes(root)
+            if isinstance(root, h5py.Group):
+                nx_class = _text(attrs.pop("NX_class", "NXgroup"))
+                root_dict = self._handle_group(root, name, nx_class, attrs)
             else:
-                root_dict = self._handle_dataset(root)
+                nx_class = "NXfield"
+                if "NX_class" in attrs and _text(attrs["NX_class"]) == "SDS":
+                    del attrs["NX_class"]
+                root_dict = self._handle_dataset(root, name)
 
-            root_dict = self._handle_attributes(root, root_dict)
-        except nexus.tree.NeXusError:
+            root_dict = self._handle_attributes(nx_class, attrs, root_dict)
+        except _SkippedDataset:
             root_dict = {}
         return root_dict
 
-    def truncate_if_large(self, size, data, name: str):
-        if self.truncate_large_datasets:
-            return self.truncate(data, size)
-        if name in _always_truncate_list:
-            return self.truncate(data, size)
-        return data
-
-    def truncate(self, data, size):
-        size = list(size)
-        for dim_number, dim_size in enumerate(size):
-            if dim_size > self.large:
-                size[dim_number] = self.large
-        data_copy = np.copy(data[...])
-        data_copy.resize(size)
-        return data_copy
-
-    def _get_data_and_type(self, root, name: str):
-        size: Union[int, Tuple[int, ...]] = 1
-        data = root.nxdata
-        dtype = str(root.dtype)
+    def _is_truncated(self, name: str) -> bool:
+        return self.truncate_large_datasets or name in _always_truncate_list
+
+    def _truncated_size(self, size: Tuple[int, ...]) -> Tuple[int, ...]:
+        return tuple(min(dim_size, self.large) for dim_size in size)
+
+    def _read_dataset(self, dataset: h5py.Dataset, name: str):
+        """
+        Scalars are returned as python values, arrays as numpy arrays, truncated if large
+        """
+        if dataset.shape == ():
+            data = dataset[()]
+            if isinstance(data, bytes):
+                # Fixed length strings are stripped, variable length strings are not
+                return (
+                    _text(data).encode("utf-8") if dataset.dtype.kind == "S" else data
+                )
+            return data.item() if isinstance(data, np.generic) else data
+        if (
+            dataset.size >= _MAX_UNCHECKED_DATASET_SIZE
+            and dataset.size * dataset.dtype.itemsize > _MAX_DATASET_BYTES
+        ):
+            raise _SkippedDataset
+        if self._is_truncated(name):
+            truncated_size = self._truncated_size(dataset.shape)
+            return _read_first_elements(dataset, int(np.prod(truncated_size))).reshape(
+                truncated_size
+            )
+        return _read_strings_as_str(dataset)
+
+    @staticmethod
+    def _get_data_and_type(data, dtype: str) -> Tuple[Any, str]:
         if isinstance(data, np.ndarray):
-            size = data.shape
-            data = self.truncate_if_large(size, data, name)
             if dtype[:2] == "|S":
                 data = np.char.decode(data)
             data = data.tolist()
@@ -103,46 +204,55 @@ class NexusToDictConverter:
                 except AttributeError:
                     pass  # already str
             dtype = "string"
-        return data, dtype, size
+        return data, dtype
+
+    def _get_attribute_data_and_type(self, value, name: str) -> Tuple[Any, str]:
+        if value is None:
+            return None, "None"
+        if isinstance(value, (bytes, str)):
+            return _text(value), "string"
+        value = np.asarray(value)
+        if value.shape == ():
+            return self._get_data_and_type(value.item(), str(value.dtype))
+        if self._is_truncated(name):
+            truncated_size = self._truncated_size(value.shape)
+            value = value.reshape(-1)[: int(np.prod(truncated_size))].reshape(
+                truncated_size
+            )
+        return self._get_data_and_type(value, str(value.dtype))
 
     @staticmethod
-    def _skip_isis_specific_nodes(root):
-        if root.nxclass[:2] == "IX":
+    def _skip_isis_specific_nodes(nx_class: str):
+        if nx_class[:2] == "IX":
             return True
         return False
 
-    def _handle_attributes(self, root, root_dict):
-        if root.nxclass and root.nxclass != "NXfield" and root.nxclass != "NXgroup":
-            root_dict["attributes"] = [{"name": "NX_class", "values": root.nxclass}]
-        if root.attrs:
-            if "attributes" not in root_dict:
-                root_dict["attributes"] = []
+    def _handle_attributes(self, nx_class: str, attrs: dict, root_dict: dict):
+        if nx_class and nx_class != "NXfield" and nx_class != "NXgroup":
+            root_dict["attributes"] = [{"name": "NX_class", "values": nx_class}]
+        if attrs:
             root_dict["attributes"] = []
-            for attr_name, attr in root.attrs.items():
-                data, dtype, size = self._get_data_and_type(attr, attr_name)
+            for attr_name, attr in attrs.items():
+                data, dtype = self._get_attribute_data_and_type(attr, attr_name)
                 new_attribute = {"name": attr_name, "values": data}
                 if dtype != "object":
                     new_attribute["type"] = dtype
                 root_dict["attributes"].append(new_attribute)
         return root_dict
 
-    def _handle_group(self, root):
-        root_dict = {"type": "group", "name": root.nxname, "children": []}
-        # Add the entries
-        entries = root.entries
+    def _handle_group(self, root: h5py.Group, name: str, nx_class: str, attrs: dict):
+        root_dict: dict = {"type": "group", "name": name, "children": []}
 
         if not self._handle_stream(
-            root, root_dict
-        ) and not self._skip_isis_specific_nodes(root):
-            if entries:
-                for entry in entries:
-                    child_dict = self._root_to_dict(entries[entry])
-                    root_dict["children"].append(child_dict)
+            root, name, nx_class, attrs, root_dict
+        ) and not self._skip_isis_specific_nodes(nx_class):
+            for child_name in root.keys():
+                root_dict["children"].append(self._root_to_dict(root, child_name))
 
         return root_dict
 
     @staticmethod
-    def _get_dtype(root) -> str:
+    def _get_dtype(root: h5py.Dataset) -> str:
         """
         Get the datatype as a string in the format expected by the file writer
         """
@@ -155,37 +265,34 @@ class NexusToDictConverter:
             dtype = "float"
         return dtype
 
-    def _handle_stream(self, root, root_dict: dict) -> bool:
+    def _handle_stream(
+        self, root: h5py.Group, name: str, nx_class: str, attrs: dict, root_dict: dict
+    ) -> bool:
         """
         Insert information to get this data from Kafka stream if it is of an NXclass supported by the NeXus-Streamer
-        :param root:
-        :param root_dict:
         :return: true if data will be streamed
         """
         stream_info = {}
         is_stream = False
-        if isinstance(root, nexus.NXlog):
+        if nx_class == "NXlog":
             stream_info["writer_module"] = "f142"
             is_stream = True
-            if root.nxname == "value_log":
+            if name == "value_log":
                 # For ISIS files the parent of the NXlog has a more useful name
                 # which the NeXus-Streamer uses as the source name
-                stream_info["source"] = root.nxgroup.nxname
+                stream_info["source"] = root.parent.name.split("/")[-1]
             else:
-                stream_info["source"] = root.nxname
+                stream_info["source"] = name
             stream_info["topic"] = self._log_data_topic
-            try:
-                stream_info["dtype"] = self._get_dtype(root.entries["value"])
-            except KeyError:
-                try:
-                    stream_info["dtype"] = self._get_dtype(root.entries["raw_value"])
-                except KeyError:
-                    is_stream = False
-            try:
-                stream_info["unit"] = root.attrs["units"]
-            except KeyError:
-                pass
-        elif isinstance(root, nexus.NXevent_data):
+            if isinstance(root.get("value"), h5py.Dataset):
+                stream_info["dtype"] = self._get_dtype(root["value"])
+            elif isinstance(root.get("raw_value"), h5py.Dataset):
+                stream_info["dtype"] = self._get_dtype(root["raw_value"])
+            else:
+                is_stream = False
+            if "units" in attrs:
+                stream_info["unit"] = _text(attrs["units"])
+        elif nx_class == "NXevent_data":
             stream_info["writer_module"] = "ev42"
             stream_info["topic"] = self._event_data_topic
             stream_info["source"] = "NeXus-Streamer"
@@ -194,16 +301,18 @@ class NexusToDictConverter:
             root_dict["children"].append({"type": "stream", "stream": stream_info})
         return is_stream
 
-    def _handle_dataset(self, root):
-        data, dataset_type, size = self._get_data_and_type(root, root.nxname)
-        root_dict = {
+    def _handle_dataset(self, root: h5py.Dataset, name: str):
+        data, dataset_type = self._get_data_and_type(
+            self._read_dataset(root, name), str(root.dtype)
+        )
+        root_dict: dict = {
             "type": "dataset",
-            "name": root.nxname,
+            "name": name,
             "dataset": {"type": dataset_type},
             "values": data,
         }
-        if size != 1:
-            root_dict["dataset"]["size"] = size
+        if root.shape != ():
+            root_dict["dataset"]["size"] = root.shape
 
         return root_dict
 
@@ -219,36 +328,240 @@ def _get_child_node(name: str, tree: dict) -> dict:
 
 
 def _replace_old_start_time_with_streamer_start_time(
-    new_run_start_ns: int, run_start_dataset_path: str, json_tree: dict
+    new_run_start_time: str, run_start_dataset_path: str, json_tree: dict
 ):
-    new_run_start_time = ns_since_epoch_to_iso8601(new_run_start_ns)
     run_start_dataset_path_list = run_start_dataset_path.split("/")[1:]
     for node_name in run_start_dataset_path_list:
         json_tree = _get_child_node(node_name, json_tree)
     json_tree["values"] = [new_run_start_time]
 
 
-def nexus_file_to_json_description(
+def _get_indentation_size(node: Any, depth: int) -> int:
+    """
+    Characters json.dumps with indent=2 adds to a compact encoding of node: a newline
+    and indentation before each item of a non-empty container and before its closing bracket
+    """
+    items: Collection[Any]
+    if isinstance(node, dict):
+        items = node.values()
+    elif isinstance(node, (list, tuple)):
+        items = node
+    else:
+        return 0
+    if not items:
+        return 0
+    size = len(items) * (1 + 2 * (depth + 1)) + 1 + 2 * depth
+    for item in items:
+        if isinstance(item, (dict, list, tuple)):
+            size += _get_indentation_size(item, depth + 1)
+    return size
+
+
+def _get_description_size(tree: dict) -> int:
+    """
+    Size of the indented description. Encoding with indent uses json's pure Python
+    encoder, so the compact encoding, which uses the C encoder, is measured instead
+    and the indentation counted separately.
+    """
+    compact_size = len(json.dumps(tree, separators=(",", ": ")).encode("utf8"))
+    return compact_size + _get_indentation_size(tree, 0)
+
+
+@contextmanager
+def _open_file(filename: str, nexus_file: Optional[h5py.File]) -> Iterator[h5py.File]:
+    if nexus_file is not None:
+        yield nexus_file
+        return
+    with h5py.File(filename, "r") as opened_file:
+        yield opened_file
+
+
+def nexus_file_to_json_tree(
     filename: str,
     event_data_topic: str,
     log_data_topic: str,
+    max_description_bytes: Optional[int] = None,
+    nexus_file: Optional[h5py.File] = None,
+) -> dict:
+    """
+    Description of the file which does not depend on the run start time,
+    so that it can be generated ahead of the run
+    :param max_description_bytes: if the description is larger than this then it is
+      generated again with every large dataset truncated
+    :param nexus_file: the file, if it is already open
+    """
+    with _open_file(filename, nexus_file) as nexus_file:
+        tree = NexusToDictConverter(
+            truncate_large_datasets=False,
+            event_data_topic=event_data_topic,
+            log_data_topic=log_data_topic,
+        ).convert(nexus_file)
+        if max_description_bytes is None:
+            return tree
+        description_size = _get_description_size(tree)
+        if description_size <= max_description_bytes:
+            return tree
+        get_logger().warning(
+            f"JSON description of {filename} is {description_size} bytes, more than "
+            f"the limit of {max_description_bytes} bytes, large datasets will be truncated"
+        )
+        tree = NexusToDictConverter(
+            truncate_large_datasets=True,
+            event_data_topic=event_data_topic,
+            log_data_topic=log_data_topic,
+        ).convert(nexus_file)
+    description_size = _get_description_size(tree)
+    if description_size > max_description_bytes:
+        get_logger().error(
+            f"JSON description of {filename} is still {description_size} bytes after "
+            f"truncating large datasets, the run start message may be rejected by the broker"
+        )
+    return tree
+
+
+def _get_json_tree_cache_key(
+    filename: str,
+    event_data_topic: str,
+    log_data_topic: str,
+    max_description_bytes: Optional[int],
+) -> str:
+    file_status = os.stat(filename)
+    key = (
+        f"{_JSON_TREE_CACHE_VERSION}:{os.path.abspath(filename)}:{file_status.st_size}:"
+        f"{file_status.st_mtime_ns}:{event_data_topic}:{log_data_topic}:"
+        f"{max_description_bytes}"
+    )
+    return hashlib.sha1(key.encode("utf8")).hexdigest()
+
+
+def _load_cached_json_tree(cache_filename: str) -> Optional[dict]:
+    try:
+        with open(cache_filename, "r") as cache_file:
+            return json.load(cache_file)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as error:
+        get_logger().warning(
+            f"Failed to read cached JSON description {cache_filename}, "
+            f"it will be generated again: {error}"
+        )
+        return None
+
+
+def _save_cached_json_tree(cache_filename: str, tree: dict):
+    cache_directory = os.path.dirname(cache_filename)
+    try:
+        os.makedirs(cache_directory, exist_ok=True)
+        # Written to a temporary file and renamed, so that other streamers sharing
+        # the directory never read a partially written file
+        file_descriptor, temporary_filename = tempfile.mkstemp(
+            dir=cache_directory, suffix=".tmp"
+        )
+        try:
+            with os.fdopen(file_descriptor, "w") as cache_file:
+                json.dump(tree, cache_file)
+            os.replace(temporary_filename, cache_filename)
+        except BaseException:
+            os.remove(temporary_filename)
+            raise
+    except OSError as error:
+        get_logger().warning(
+            f"Failed to save JSON description to {cache_filename}: {error}"
+        )
+
+
+def get_json_tree(
+    filename: str,
+    event_data_topic: str,
+    log_data_topic: str,
+    cache_directory: Optional[str] = None,
+    max_description_bytes: Optional[int] = None,
+    nexus_file: Optional[h5py.File] = None,
+) -> dict:
+    """
+    Cached nexus_file_to_json_tree, the tree is only generated again if the file is
+    modified. The returned tree is shared between runs, only the run start time
+    is modified by json_tree_to_description and json_tree_to_description_template.
+    :param cache_directory: if provided, trees are also kept in files in this directory,
+      so that they are reused when the streamer is restarted
+    :param max_description_bytes: see nexus_file_to_json_tree
+    :param nexus_file: the file, if it is already open
+    """
+    key = _get_json_tree_cache_key(
+        filename, event_data_topic, log_data_topic, max_description_bytes
+    )
+    with _json_tree_cache_lock:
+        tree = _json_tree_cache.get(key)
+        if tree is not None:
+            _json_tree_cache.move_to_end(key)
+            return tree
+
+    cache_filename = None
+    if cache_directory is not None:
+        cache_filename = os.path.join(
+            cache_directory, f"{os.path.basename(filename)}.{key}.json"
+        )
+        tree = _load_cached_json_tree(cache_filename)
+    if tree is None:
+        tree = nexus_file_to_json_tree(
+            filename,
+            event_data_topic,
+            log_data_topic,
+            max_description_bytes,
+            nexus_file,
+        )
+        if cache_filename is not None:
+            _save_cached_json_tree(cache_filename, tree)
+
+    with _json_tree_cache_lock:
+        _json_tree_cache[key] = tree
+        while len(_json_tree_cache) > _MAX_CACHED_JSON_TREES:
+            _json_tree_cache.popitem(last=False)
+    return tree
+
+
+def json_tree_to_description(
+    tree: dict,
     new_run_start_ns: int,
     run_start_dataset_path: str,
 ) -> str:
-    nexus_file = nexus.nxload(filename)
-    converter = NexusToDictConverter(
-        truncate_large_datasets=False,
-        event_data_topic=event_data_topic,
-        log_data_topic=log_data_topic,
-    )
-    tree = converter.convert(nexus_file)
     _replace_old_start_time_with_streamer_start_time(
-        new_run_start_ns, run_start_dataset_path, tree
+        ns_since_epoch_to_iso8601(new_run_start_ns), run_start_dataset_path, tree
     )
+    return json.dumps(tree, indent=2, sort_keys=False)
 
+
+def json_tree_to_description_template(tree: dict, run_start_dataset_path: str) -> str:
+    """
+    Description with a placeholder for the run start time, descriptions for each run are
+    created from it by fill_description_template without serialising the tree again
+    """
+    _replace_old_start_time_with_streamer_start_time(
+        _RUN_START_TIME_PLACEHOLDER, run_start_dataset_path, tree
+    )
     return json.dumps(tree, indent=2, sort_keys=False)
 
 
+def fill_description_template(template: str, new_run_start_ns: int) -> str:
+    return template.replace(
+        _RUN_START_TIME_PLACEHOLDER, ns_since_epoch_to_iso8601(new_run_start_ns), 1
+    )
+
+
+def nexus_file_to_json_description(
+    filename: str,
+    event_data_topic: str,
+    log_data_topic: str,
+    new_run_start_ns: int,
+    run_start_dataset_path: str,
+) -> str:
+    return json_tree_to_description(
+        nexus_file_to_json_tree(filename, event_data_topic, log_data_topic),
+        new_run_start_ns,
+        run_start_dataset_path,
+    )
+
+
 # For convenience of testing during development
 # Run from src/ dir with:
 # python3 -m nexus_streamer.generate_json_description
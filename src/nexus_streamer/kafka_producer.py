@@ -1,47 +1,158 @@
+import asyncio
 import confluent_kafka
-from threading import Thread
+from functools import partial
+from threading import Lock, Thread
+from time import monotonic
 from .application_logger import setup_logger
-from typing import Optional
+from .metrics import get_metrics
+from .payload_cache import Payload
+from typing import Any, Dict, Optional
+
+DEFAULT_FLUSH_TIMEOUT_S = 30.0
+# How long to wait for space in the producer queue before trying again
+_QUEUE_FULL_WAIT_S = 0.005
 
 
 class KafkaProducer:
-    def __init__(self, configs: dict):
+    def __init__(self, configs: dict, flush_timeout_s: float = DEFAULT_FLUSH_TIMEOUT_S):
+        """
+        :param configs: librdkafka producer configuration
+        :param flush_timeout_s: maximum time to wait for queued messages to be delivered on close
+        """
         self._producer = confluent_kafka.Producer(configs)
+        self._flush_timeout_s = flush_timeout_s
         self._cancelled = False
         self._poll_thread = Thread(target=self._poll_loop)
         self._poll_thread.start()
         self.logger = setup_logger()
+        # Delivery callbacks may be called from the poll thread or the thread producing
+        self._delivery_count_lock = Lock()
+        self.failed_deliveries = 0
+
+        metrics = get_metrics()
+        self._queue_full_waits = metrics.producer_queue_full_waits.labels()
+        self._delivery_latency = metrics.delivery_latency
+        metrics.add_gauge(
+            "nexus_streamer_producer_queue_messages",
+            "Messages waiting in the producer queue to be delivered",
+            lambda: len(self._producer),
+        )
 
     def _poll_loop(self):
         while not self._cancelled:
             self._producer.poll(0.5)
 
-    def close(self):
+    def close(self) -> int:
+        """
+        Waits for queued messages to be delivered, up to the flush timeout
+        :return: number of messages which were not delivered
+        """
         self._cancelled = True
         self._poll_thread.join()
-        max_wait_to_publish_producer_queue = 2  # seconds
-        self._producer.flush(max_wait_to_publish_producer_queue)
+        not_flushed = self._producer.flush(self._flush_timeout_s)
+        with self._delivery_count_lock:
+            undelivered = not_flushed + self.failed_deliveries
+        if undelivered:
+            self.logger.error(
+                f"{undelivered} messages were not delivered, {not_flushed} were still "
+                f"queued after waiting {self._flush_timeout_s} seconds"
+            )
+        else:
+            self.logger.info("All messages were delivered")
+        return undelivered
+
+    def flush(self):
+        """
+        Waits for queued messages to be delivered, up to the flush timeout, for example so
+        that the run start message is delivered before worker processes publish event data
+        """
+        self._producer.flush(self._flush_timeout_s)
+
+    def _ack(self, produce_time_s: float, err, message):
+        self._delivery_latency.labels(message.topic()).observe(
+            monotonic() - produce_time_s
+        )
+        if err:
+            with self._delivery_count_lock:
+                self.failed_deliveries += 1
+            self.logger.error(f"Message failed delivery: {err}")
+
+    def _produce(
+        self,
+        topic: str,
+        payload: Payload,
+        timestamp_ns: Optional[int],
+        partition: Optional[int],
+    ):
+        """
+        :raises BufferError if the producer queue is full
+        """
+        if not isinstance(payload, bytes):
+            # Only bytes are accepted, payloads replayed from the payload cache are views
+            # of the cached messages
+            payload = bytes(payload)
+        options: Dict[str, Any] = {}
+        if timestamp_ns is not None:
+            options["timestamp"] = int(timestamp_ns * 0.000001)  # ns to ms
+        if partition is not None:
+            options["partition"] = partition
+        self._producer.produce(
+            topic, payload, on_delivery=partial(self._ack, monotonic()), **options
+        )
+        self._producer.poll(0)
 
     def produce(
         self,
         topic: str,
-        payload: bytes,
+        payload: Payload,
         timestamp_ns: Optional[int] = None,
+        partition: Optional[int] = None,
+    ):
+        """
+        Blocks while the producer queue is full
+        :param partition: if not given, the partition is chosen by the producer's partitioner
+        """
+        while True:
+            try:
+                self._produce(topic, payload, timestamp_ns, partition)
+                return
+            except BufferError:
+                self._queue_full_waits.inc()
+                self._producer.poll(_QUEUE_FULL_WAIT_S)
+
+    async def produce_when_queue_has_space(
+        self,
+        topic: str,
+        payload: Payload,
+        timestamp_ns: Optional[int] = None,
+        partition: Optional[int] = None,
+    ):
+        """
+        Waits for space in the producer queue without blocking the event loop
+        """
+        while True:
+            try:
+                self._produce(topic, payload, timestamp_ns, partition)
+                return
+            except BufferError:
+                self._queue_full_waits.inc()
+                self._producer.poll(0)
+                await asyncio.sleep(_QUEUE_FULL_WAIT_S)
+
+
+def create_producer_config(args) -> dict:
+    producer_config = {
+        "bootstrap.servers": args.broker,
+        "message.max.bytes": 200000000,
+    }
+    # Only override librdkafka defaults for options which were provided
+    for config_name, value in (
+        ("linger.ms", args.kafka_linger_ms),
+        ("batch.num.messages", args.kafka_batch_num_messages),
+        ("queue.buffering.max.messages", args.kafka_queue_max_messages),
+        ("queue.buffering.max.kbytes", args.kafka_queue_max_kbytes),
+        ("compression.codec", args.kafka_compression),
     ):
-        def ack(err, _):
-            if err:
-                self.logger.error(f"Message failed delivery: {err}")
-
-        try:
-            if timestamp_ns is not None:
-                self._producer.produce(
-                    topic,
-                    payload,
-                    on_delivery=ack,
-                    timestamp=int(timestamp_ns * 0.000001),  # ns to ms
-                )
-            else:
-                self._producer.produce(topic, payload, on_delivery=ack)
-            self._producer.poll(0)
-        except BufferError:
-            self.logger.error("Producer buffer full")
+        if value is not None:
+            producer_config[config_name] = value
+    return producer_config
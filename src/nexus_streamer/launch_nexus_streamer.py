@@ -1,170 +1,371 @@
 from .parse_commandline_args import parse_args
-from .application_logger import setup_logger
-from .create_data_sources_from_nexus import (
-    create_data_sources_from_nexus_file,
-)
-import h5py
-from .kafka_producer import KafkaProducer
+from .application_logger import get_logger, setup_logger
+import numpy as np
+from .message_sinks import MessageSink, create_sink
 from .source_to_stream import (
     LogSourceToStream,
     EventSourceToStream,
     SourceToStream,
 )
 from .publish_run_message import publish_run_start_message
-from .generate_json_description import nexus_file_to_json_description
-from .create_data_sources_from_nexus import get_recorded_run_start_time_ns
-from typing import List
+from .create_data_sources_from_nexus import get_event_source_memory_budget
+from typing import Iterator, List, Optional, Tuple, Union
+from concurrent.futures import Future, ThreadPoolExecutor
+from itertools import cycle
 import asyncio
 from time import time_ns
-from .isis_data_source import IsisDataSource
 from .read_detector_spectrum_map_file import read_map
 from .convert_units import ns_since_epoch_to_iso8601
+from .payload_cache import PayloadCache, SourcePayloadCache
+from .data_source import LogDataSource, EventDataSource, FakeEventDataSource
+from .merge_scheduler import MergeScheduler
+from .playback_clock import PlaybackClock
+from .metrics import MetricsReporter
+from .worker_pool import EventShard, WorkerPool, assign_event_shards
+from .prepared_run import PreparedRun, get_playlist
+
+
+def _get_source_cache(
+    payload_cache: Optional[PayloadCache],
+    filename: str,
+    source: Union[LogDataSource, EventDataSource, FakeEventDataSource],
+) -> Optional[SourcePayloadCache]:
+    if payload_cache is None:
+        return None
+    # Sources in different files of a playlist may have the same path
+    return payload_cache.get_source_cache(f"{filename}:{source.path}")
+
 
+def _assign_event_shards(
+    run: PreparedRun,
+    args,
+    worker_pool: WorkerPool,
+) -> List[List[EventShard]]:
+    source_sizes = {}
+    number_of_ranges = {}
+    for source in run.event_data_sources:
+        source_sizes[source.path] = (
+            run.nexus_file_index.get_dataset_info(f"{source.path}/event_id").shape[0]
+            if args.fake_events_per_pulse is None
+            else run.nexus_file_index.get_dataset_info(
+                f"{source.path}/event_time_zero"
+            ).shape[0]
+            * args.fake_events_per_pulse
+        )
+        partitioning = run.get_partitioning(source.path)
+        if partitioning is not None:
+            number_of_ranges[source.path] = partitioning.number_of_ranges
+    shards = assign_event_shards(
+        source_sizes, number_of_ranges, worker_pool.number_of_workers
+    )
+    logger = get_logger()
+    for worker_number, worker_shards in enumerate(shards):
+        descriptions = [
+            shard.source_path
+            if shard.ranges is None
+            else f"{shard.source_path} detector id ranges {list(shard.ranges)}"
+            for shard in worker_shards
+        ]
+        logger.info(f"Worker process {worker_number} publishes {descriptions}")
+    return shards
 
-async def publish_run(producer: KafkaProducer, run_id: int, args, logger):
+
+async def publish_run(
+    producer: MessageSink,
+    run_id: int,
+    args,
+    logger,
+    payload_cache: Optional[PayloadCache] = None,
+    worker_pool: Optional[WorkerPool] = None,
+    prepared_run: Optional[PreparedRun] = None,
+    detector_spectrum_map: Optional[Tuple[np.ndarray, np.ndarray]] = None,
+):
+    """
+    The producer is not closed, so that it can be used for later runs
+    :param prepared_run: if provided, the run is streamed from this rather than from
+      args.filename, it is not closed so that it can be streamed again
+    :param detector_spectrum_map: detector ids and spectrum numbers, if not provided
+      they are read from args.det_spec_map
+    """
     streamers: List[SourceToStream] = []
+    run = prepared_run
+    if run is None:
+        run = PreparedRun(args.filename, args)
     try:
-        with h5py.File(args.filename, "r") as nexus_file:
-            log_data_sources, event_data_sources = create_data_sources_from_nexus_file(
-                nexus_file, args.fake_events_per_pulse
-            )
+        log_data_sources = run.log_data_sources
+        event_data_sources = run.event_data_sources
+        if not run.has_data_sources:
+            logger.critical("No valid data sources found in file, aborting")
+            return
 
-            if not log_data_sources and not event_data_sources:
-                logger.critical("No valid data sources found in file, aborting")
-                return
+        last_timestamp = run.last_timestamp
+        recorded_run_start_time_ns = run.recorded_run_start_time_ns
 
-            isis_data_source = None
-            if args.isis_file:
-                isis_data_source = IsisDataSource(nexus_file)
-
-            last_timestamp = max(
-                [
-                    source.final_timestamp
-                    for source in event_data_sources + log_data_sources  # type: ignore
-                ]
+        # start_time_delta_ns = time difference between starting to stream with
+        # NeXus Streamer and the run start time which was recorded in the NeXus
+        # file, used as an offset for all timestamps so that output appears as
+        # if the data is being produced live by the beamline.
+        if args.slow:
+            streamer_start_time = time_ns()
+            start_time_delta_ns = streamer_start_time - recorded_run_start_time_ns
+            # Intervals in the run are scaled by the playback speed
+            run_duration = int(
+                (last_timestamp - recorded_run_start_time_ns) / args.speed
             )
+            stop_time_ns = streamer_start_time + run_duration
+        else:
+            # If we are publishing data into Kafka as fast as we can then we
+            # must pretend the run has already happened. Make the current wall
+            # clock time the run stop time. Otherwise consumers such as scippneutron
+            # must wait until a run stop time in the future to be sure that they have
+            # received all data.
+            stop_time_ns = time_ns()
+            run_duration = last_timestamp - recorded_run_start_time_ns
+            streamer_start_time = stop_time_ns - run_duration
+            start_time_delta_ns = streamer_start_time - recorded_run_start_time_ns
 
-            (
-                recorded_run_start_time_ns,
-                run_start_ds_path,
-            ) = get_recorded_run_start_time_ns(args.filename)
-
-            # start_time_delta_ns = time difference between starting to stream with
-            # NeXus Streamer and the run start time which was recorded in the NeXus
-            # file, used as an offset for all timestamps so that output appears as
-            # if the data is being produced live by the beamline.
-            if args.slow:
-                streamer_start_time = time_ns()
-                start_time_delta_ns = streamer_start_time - recorded_run_start_time_ns
-                stop_time_ns = last_timestamp + start_time_delta_ns
-                run_duration = stop_time_ns - streamer_start_time
-            else:
-                # If we are publishing data into Kafka as fast as we can then we
-                # must pretend the run has already happened. Make the current wall
-                # clock time the run stop time. Otherwise consumers such as scippneutron
-                # must wait until a run stop time in the future to be sure that they have
-                # received all data.
-                stop_time_ns = time_ns()
-                run_duration = last_timestamp - recorded_run_start_time_ns
-                streamer_start_time = stop_time_ns - run_duration
-                start_time_delta_ns = streamer_start_time - recorded_run_start_time_ns
-
-            logger.info(
-                f"Run:\n"
-                f"start: {ns_since_epoch_to_iso8601(streamer_start_time)}\n"
-                f"stop: {ns_since_epoch_to_iso8601(stop_time_ns)}\n"
-                f"duration: {run_duration/1e9} seconds"
-            )
+        clock = PlaybackClock(
+            start_time_delta_ns,
+            args.speed if args.slow else 1.0,
+            recorded_run_start_time_ns,
+        )
 
-            log_data_topic = f"{args.instrument}_sampleEnv"
-            event_data_topic = f"{args.instrument}_events"
-            if args.json_description:
-                with open(args.json_description, "r") as json_file:
-                    nexus_structure = json_file.read()
-                    nexus_structure = replace_placeholder_topic_names(
-                        nexus_structure, log_data_topic, event_data_topic
-                    )
-            else:
-                nexus_structure = nexus_file_to_json_description(
-                    args.filename,
-                    event_data_topic,
-                    log_data_topic,
-                    streamer_start_time,
-                    run_start_ds_path,
-                )
+        logger.info(
+            f"Run:\n"
+            f"file: {run.filename}\n"
+            f"start: {ns_since_epoch_to_iso8601(streamer_start_time)}\n"
+            f"stop: {ns_since_epoch_to_iso8601(stop_time_ns)}\n"
+            f"duration: {run_duration/1e9} seconds"
+        )
 
-            streamers.extend(
-                [
-                    LogSourceToStream(
-                        source,
-                        producer,
-                        log_data_topic,
-                        start_time_delta_ns,
-                        slow_mode=args.slow,
-                    )
-                    for source in log_data_sources
-                ]
-            )
+        nexus_structure = run.get_nexus_structure(streamer_start_time)
+
+        streamers.extend(
+            [
+                LogSourceToStream(
+                    source,
+                    producer,
+                    run.log_data_topic,
+                    clock,
+                    prefetch_depth=args.prefetch_depth,
+                    payload_cache=_get_source_cache(
+                        payload_cache, run.filename, source
+                    ),
+                )
+                for source in log_data_sources
+            ]
+        )
+        event_shards: List[List[EventShard]] = []
+        if worker_pool is None:
             streamers.extend(
                 [
                     EventSourceToStream(
                         source,
                         producer,
-                        event_data_topic,
-                        start_time_delta_ns,
-                        slow_mode=args.slow,
-                        isis_data_source=isis_data_source,
+                        run.event_data_topic,
+                        clock,
+                        isis_data_source=run.isis_data_source,
+                        prefetch_depth=args.prefetch_depth,
+                        payload_cache=_get_source_cache(
+                            payload_cache, run.filename, source
+                        ),
+                        partitioning=run.get_partitioning(source.path),
+                        partition_target=args.event_partition_target,
                     )
                     for source in event_data_sources
                 ]
             )
+        else:
+            event_shards = _assign_event_shards(run, args, worker_pool)
 
-            map_det_ids = None
-            map_spec_nums = None
-            if args.det_spec_map is not None:
-                map_det_ids, map_spec_nums = read_map(args.det_spec_map)
-            publish_run_start_message(
-                args.instrument,
-                run_id,
-                args.broker,
-                nexus_structure,
-                producer,
-                f"{args.instrument}_runInfo",
-                map_det_ids,
-                map_spec_nums,
-                streamer_start_time,
-                stop_time_ns,
-            )
-
-            logger.info(
-                f"Publishing log data sources: {[source.name for source in log_data_sources]}"
-            )
-            logger.info(
-                f"Publishing event data sources: {[source.name for source in event_data_sources]}"
-            )
-            for streamer in streamers:
-                streamer.start()
+        map_det_ids = None
+        map_spec_nums = None
+        if detector_spectrum_map is not None:
+            map_det_ids, map_spec_nums = detector_spectrum_map
+        elif args.det_spec_map is not None:
+            map_det_ids, map_spec_nums = read_map(args.det_spec_map)
+        publish_run_start_message(
+            args.instrument,
+            run_id,
+            args.broker,
+            nexus_structure,
+            producer,
+            f"{args.instrument}_runInfo",
+            map_det_ids,
+            map_spec_nums,
+            streamer_start_time,
+            stop_time_ns,
+        )
+        # The run start message comes before any data, including data published by
+        # worker processes with their own producers
+        producer.flush()
 
-            while not all([streamer.done for streamer in streamers]):
-                await asyncio.sleep(1.0)
+        logger.info(
+            f"Publishing log data sources: {[source.name for source in log_data_sources]}"
+        )
+        logger.info(
+            f"Publishing event data sources: {[source.name for source in event_data_sources]}"
+        )
+        scheduler = MergeScheduler(streamers, args.slow, clock.speed)
+        try:
+            if worker_pool is None:
+                await scheduler.run()
+            else:
+                _, undelivered = await asyncio.gather(
+                    scheduler.run(),
+                    worker_pool.publish(
+                        run.filename,
+                        event_shards,
+                        clock,
+                        get_event_source_memory_budget(
+                            len(event_data_sources),
+                            args.source_memory_budget_mb * 1_000_000,
+                            None
+                            if args.memory_budget_mb is None
+                            else args.memory_budget_mb * 1_000_000,
+                        ),
+                    ),
+                )
+                if undelivered:
+                    logger.error(
+                        f"{undelivered} messages from worker processes were not delivered"
+                    )
+                logger.info("Worker processes finished publishing event data")
+        finally:
+            # Streamers may be reading from the file in background threads,
+            # so they must be stopped before the file is closed
+            scheduler.stop()
+        # The run stop time is in the run start message, so all data of the run is
+        # delivered before the next run starts
+        producer.flush()
 
-            logger.info("Reached end of data sources")
+        logger.info("Reached end of data sources")
 
     except KeyboardInterrupt:
         logger.info("%% Aborted by user")
     finally:
         for streamer in streamers:
             streamer.stop()
-        producer.close()
+        if prepared_run is None:
+            run.close()
+
+
+def _get_playlist_order(filenames: List[str], single_run: bool) -> Iterator[str]:
+    """
+    Each file is streamed once in single run mode, otherwise the playlist is repeated
+    """
+    if single_run or not filenames:
+        return iter(filenames)
+    return cycle(filenames)
+
+
+def _prepare_run(filename: str, args, logger) -> Optional[PreparedRun]:
+    try:
+        return PreparedRun(filename, args)
+    except Exception as error:
+        logger.error(
+            f"Failed to prepare run from {filename}, it will be skipped: {error}"
+        )
+        return None
+
+
+class StreamingSession:
+    def __init__(self, args, logger):
+        """
+        State kept for every run streamed by the process: the Kafka producer or other sink,
+        worker processes, payload cache and detector-spectrum map. The prepared run of the current
+        file is kept open, and streamed again without reopening the file or creating its
+        data sources again if the same file is next in the playlist.
+        :param args: command line arguments
+        """
+        self._args = args
+        self._logger = logger
+        self._worker_pool = None
+        if args.worker_processes > 0:
+            self._worker_pool = WorkerPool(args.worker_processes, args)
+        self._producer = create_sink(args)
+        self._payload_cache = None
+        if not args.single_run and (
+            args.payload_cache_mb is not None or args.payload_cache_file is not None
+        ):
+            self._payload_cache = PayloadCache(
+                None
+                if args.payload_cache_mb is None
+                else args.payload_cache_mb * 1_000_000,
+                args.payload_cache_file,
+            )
+        self._detector_spectrum_map = None
+        if args.det_spec_map is not None:
+            self._detector_spectrum_map = read_map(args.det_spec_map)
+        # The next run is prepared in the background while the current one is streamed
+        self._preparation = ThreadPoolExecutor(max_workers=1)
+        self._current_run: Optional[PreparedRun] = None
+        self._next_run: Optional[Future] = None
+
+    def _get_run(self, filename: str) -> Future:
+        if self._current_run is not None and self._current_run.filename == filename:
+            reused_run: Future = Future()
+            reused_run.set_result(self._current_run)
+            return reused_run
+        return self._preparation.submit(
+            _prepare_run, filename, self._args, self._logger
+        )
+
+    def _set_current_run(self, run: Optional[PreparedRun]):
+        if self._current_run is not None and self._current_run is not run:
+            self._current_run.close()
+        self._current_run = run
 
+    async def stream(self, filenames: List[str]):
+        """
+        Streams runs from the files in order, see _get_playlist_order
+        """
+        playlist = _get_playlist_order(filenames, self._args.single_run)
+        filename = next(playlist, None)
+        if filename is not None:
+            self._next_run = self._get_run(filename)
+        run_number = 0
+        consecutive_failures = 0
+        while self._next_run is not None:
+            prepared_run = await asyncio.wrap_future(self._next_run)
+            self._next_run = None
+            self._set_current_run(prepared_run)
+            filename = next(playlist, None)
+            if filename is not None:
+                self._next_run = self._get_run(filename)
+            if prepared_run is None:
+                consecutive_failures += 1
+                if consecutive_failures >= len(filenames):
+                    self._logger.critical(
+                        "Failed to prepare a run from any file, aborting"
+                    )
+                    break
+                continue
+            consecutive_failures = 0
+            await publish_run(
+                self._producer,
+                run_number,
+                self._args,
+                self._logger,
+                self._payload_cache,
+                self._worker_pool,
+                prepared_run,
+                self._detector_spectrum_map,
+            )
+            self._logger.info(f"Streamed run {run_number}")
+            run_number += 1
 
-def replace_placeholder_topic_names(nexus_structure, log_data_topic, event_data_topic):
-    for topic in (
-        ("SAMPLE_ENV_TOPIC", log_data_topic),
-        ("EVENT_DATA_TOPIC", event_data_topic),
-    ):
-        nexus_structure = nexus_structure.replace(topic[0], topic[1])
-    return nexus_structure
+    def close(self):
+        if self._next_run is not None:
+            # Wait for preparation to finish, so that the file can be closed
+            self._set_current_run(self._next_run.result())
+        self._set_current_run(None)
+        self._preparation.shutdown()
+        self._producer.close()
+        if self._payload_cache is not None:
+            self._payload_cache.close()
+        if self._worker_pool is not None:
+            self._worker_pool.close()
 
 
 def launch_streamer():
@@ -182,20 +383,18 @@ def launch_streamer():
             "events may not be mapped to the correct detector pixel by consumer applications"
         )
 
-    producer_config = {
-        "bootstrap.servers": args.broker,
-        "message.max.bytes": 200000000,
-    }
-    kafka_producer = KafkaProducer(producer_config)
-    run_number = 0
-    if args.single_run:
-        asyncio.run(publish_run(kafka_producer, run_number, args, logger))
-        logger.info(f"Completed streaming run {run_number}")
-    else:
-        while True:
-            asyncio.run(publish_run(kafka_producer, run_number, args, logger))
-            logger.info(f"Streamed run {run_number}")
-            run_number += 1
+    if args.speed != 1.0 and not args.slow:
+        logger.warning("--speed has no effect unless --slow is also used")
+
+    metrics_reporter = MetricsReporter(args.metrics_port, args.metrics_log_interval_s)
+    filenames = get_playlist(args.playlist) if args.playlist else [args.filename]
+    session = StreamingSession(args, logger)
+    try:
+        # A single event loop is used for every run
+        asyncio.run(session.stream(filenames))
+    finally:
+        session.close()
+        metrics_reporter.stop()
 
 
 if __name__ == "__main__":
@@ -10,6 +10,10 @@ from .source_error import BadSource
 from .convert_units import iso8601_to_ns_since_epoch
 
 
+# Maximum size of log values read from the file at once
+DEFAULT_LOG_BLOCK_BYTES = 1_000_000
+
+
 def _get_time_offset_in_ns(time_dataset: h5py.Group) -> int:
     """
     Gives an offset which, when added to data times, results in time relative to unix epoch
@@ -33,7 +37,7 @@ class LogDataSource:
         if self._has_missing_fields():
             raise BadSource()
         try:
-            self._convert_time = self._get_time_unit_converter()
+            convert_time = self._get_time_unit_converter()
         except UndefinedUnitError:
             self._logger.error(
                 f"Unable to publish data from NXlog at {self._group.name} due to unrecognised "
@@ -41,81 +45,53 @@ class LogDataSource:
             )
             raise BadSource()
 
-        try:
-            self._value_index_reached = -1
-            self._value_dataset = self._group["value"]
-
-            self._time_index_reached = -1
-            self._time_dataset = self._group["time"]
-
-            self._time_offset_ns = _get_time_offset_in_ns(self._time_dataset)
-            self._data_are_chunked = True
-            try:
-                self._value_chunk_iter = self._value_dataset.iter_chunks()
-                self._time_chunk_iter = self._time_dataset.iter_chunks()
-            except TypeError:
-                self._data_are_chunked = False
-                return
-
-            self._current_value_slice = next(self._value_chunk_iter)
-            self._value_buffer = self._value_dataset[self._current_value_slice]
-
-            self._current_time_slice = next(self._time_chunk_iter)
-            self._time_buffer = self._time_dataset[self._current_time_slice]
-        except (StopIteration, ValueError):
-            self._logger.warn(
+        self._value_dataset = self._group["value"]
+        # All times are converted at once, to int64 nanoseconds since unix epoch
+        time_dataset = self._group["time"]
+        self._times_ns = convert_time(time_dataset[...]) + _get_time_offset_in_ns(
+            time_dataset
+        )
+        # Samples without both a time and a value are not published
+        self._number_of_samples = min(self._times_ns.size, self._value_dataset.len())
+        if self._number_of_samples == 0:
+            self._logger.warning(
                 f"Unable to publish data from NXlog at {self._group.name} due to empty value or time field"
             )
             raise BadSource()
 
     @property
     def final_timestamp(self) -> int:
-        return self._convert_time(self._time_dataset[-1]) + self._time_offset_ns
+        return int(self._times_ns[-1])
 
     def get_data(self) -> Generator[Tuple[Optional[np.ndarray], int], None, None]:
         """
         Returns None instead of data when there are no more data
         """
-        while True:
-            if self._data_are_chunked:
-                self._value_index_reached += 1
-                if self._value_index_reached == self._current_value_slice[0].stop:
-                    self._value_index_reached = -1
-                    # read next chunk
-                    try:
-                        self._current_value_slice = next(self._value_chunk_iter)
-                    except StopIteration:
-                        break
-                    self._value_buffer = self._value_dataset[self._current_value_slice]
-
-                self._time_index_reached += 1
-                if self._time_index_reached == self._current_time_slice[0].stop:
-                    self._time_index_reached = -1
-                    # read next chunk
-                    try:
-                        self._current_time_slice = next(self._time_chunk_iter)
-                    except StopIteration:
-                        break
-                    self._time_buffer = self._time_dataset[self._current_time_slice]
-
-                yield self._value_buffer[self._value_index_reached], self._convert_time(
-                    self._time_buffer[self._value_index_reached]
-                ) + self._time_offset_ns
-            else:
-                self._value_index_reached += 1
-                if (
-                    self._value_index_reached == self._value_dataset.size
-                    or self._value_index_reached == self._time_dataset.size
-                ):
-                    break
-                yield self._value_dataset[
-                    self._value_index_reached
-                ], self._convert_time(
-                    self._time_dataset[self._value_index_reached]
-                ) + self._time_offset_ns
-
+        for values, times_ns in self.get_data_blocks():
+            for value, time_ns in zip(values, times_ns.tolist()):
+                yield value, time_ns
         yield None, 0
 
+    def get_data_blocks(
+        self, max_block_bytes: int = DEFAULT_LOG_BLOCK_BYTES
+    ) -> Generator[Tuple[np.ndarray, np.ndarray], None, None]:
+        """
+        Yields values and their times in nanoseconds for many samples at once.
+        Values are read in large hyperslabs regardless of how the datasets are chunked.
+        :param max_block_bytes: limits the size of the values read at once, for logs of large arrays
+        """
+        bytes_per_sample = max(
+            self._value_dataset.dtype.itemsize
+            * int(np.prod(self._value_dataset.shape[1:])),
+            1,
+        )
+        samples_per_block = max(max_block_bytes // bytes_per_sample, 1)
+        for first_sample in range(0, self._number_of_samples, samples_per_block):
+            end_sample = min(first_sample + samples_per_block, self._number_of_samples)
+            yield self._value_dataset[first_sample:end_sample], self._times_ns[
+                first_sample:end_sample
+            ]
+
     def _has_missing_fields(self) -> bool:
         missing_field = False
         required_fields = (
@@ -145,3 +121,7 @@ class LogDataSource:
         if group_name != "value_log":
             return group_name
         return self._group.name.split("/")[-2]
+
+    @property
+    def path(self) -> str:
+        return self._group.name
@@ -0,0 +1,173 @@
+import asyncio
+import heapq
+from time import time_ns
+from typing import AsyncGenerator, List, Optional, Tuple
+
+from .application_logger import get_logger
+from .metrics import get_metrics
+from .payload_cache import Payload
+from .source_to_stream import SourceToStream
+
+# In fast mode control is handed back to the event loop after this many
+# messages, so that other tasks are not starved while messages are ready
+_MESSAGES_BETWEEN_YIELDS = 1000
+_REPORT_INTERVAL_NS = 10_000_000_000
+# Lag behind the schedule in slow mode which is reported as a warning
+_LAG_WARNING_NS = 1_000_000_000
+
+
+class _PublishStatistics:
+    def __init__(self, slow_mode: bool, speed: float):
+        """
+        Achieved publish rate and, in slow mode, lag behind the schedule
+        """
+        self._slow_mode = slow_mode
+        self._speed = speed
+        self._logger = get_logger()
+        self._start_ns = time_ns()
+        self._first_timestamp_ns: Optional[int] = None
+        self._last_timestamp_ns = 0
+        self._first_publish_time_ns = 0
+        self._last_publish_time_ns = 0
+        self._total_messages = 0
+        self._total_bytes = 0
+        self._interval_start_ns = self._start_ns
+        self._interval_messages = 0
+        self._interval_bytes = 0
+        self._interval_max_lag_ns = 0
+        self._interval_total_lag_ns = 0
+
+    def record(self, payload_size: int, timestamp_ns: int, publish_time_ns: int):
+        if self._first_timestamp_ns is None:
+            self._first_timestamp_ns = timestamp_ns
+            self._first_publish_time_ns = publish_time_ns
+        self._last_timestamp_ns = max(self._last_timestamp_ns, timestamp_ns)
+        self._last_publish_time_ns = publish_time_ns
+        self._total_messages += 1
+        self._total_bytes += payload_size
+        self._interval_messages += 1
+        self._interval_bytes += payload_size
+        lag_ns = publish_time_ns - timestamp_ns
+        self._interval_max_lag_ns = max(self._interval_max_lag_ns, lag_ns)
+        self._interval_total_lag_ns += lag_ns
+        if publish_time_ns - self._interval_start_ns >= _REPORT_INTERVAL_NS:
+            self._report_interval(publish_time_ns)
+
+    def _report_interval(self, now_ns: int):
+        interval_s = (now_ns - self._interval_start_ns) * 1e-9
+        message = (
+            f"Published {self._interval_messages / interval_s:.1f} messages/s, "
+            f"{self._interval_bytes / interval_s / 1e6:.2f} MB/s"
+        )
+        if self._slow_mode:
+            mean_lag_ms = self._interval_total_lag_ns / self._interval_messages * 1e-6
+            message += (
+                f", lag behind schedule mean {mean_lag_ms:.1f} ms, "
+                f"max {self._interval_max_lag_ns * 1e-6:.1f} ms"
+            )
+        if self._slow_mode and self._interval_max_lag_ns > _LAG_WARNING_NS:
+            self._logger.warning(f"{message}, streamer is not keeping up")
+        else:
+            self._logger.info(message)
+        self._interval_start_ns = now_ns
+        self._interval_messages = 0
+        self._interval_bytes = 0
+        self._interval_max_lag_ns = 0
+        self._interval_total_lag_ns = 0
+
+    def report_summary(self):
+        elapsed_s = max((time_ns() - self._start_ns) * 1e-9, 1e-9)
+        message = (
+            f"Published {self._total_messages} messages, {self._total_bytes / 1e6:.1f} MB "
+            f"in {elapsed_s:.1f} s, {self._total_messages / elapsed_s:.1f} messages/s, "
+            f"{self._total_bytes / elapsed_s / 1e6:.2f} MB/s"
+        )
+        if self._slow_mode and self._first_timestamp_ns is not None:
+            # Timestamps are already scaled by the playback speed
+            published_span_s = (
+                self._last_timestamp_ns - self._first_timestamp_ns
+            ) * 1e-9
+            publishing_s = max(
+                (self._last_publish_time_ns - self._first_publish_time_ns) * 1e-9, 1e-9
+            )
+            achieved_speed = self._speed * published_span_s / publishing_s
+            message += (
+                f", achieved speed {achieved_speed:.2f}x of requested {self._speed:g}x"
+            )
+        self._logger.info(message)
+
+
+class MergeScheduler:
+    def __init__(
+        self,
+        streamers: List[SourceToStream],
+        slow_mode: bool = False,
+        speed: float = 1.0,
+    ):
+        """
+        Publishes messages from all data sources in a single task, in order of timestamp,
+        by merging the messages from each source with a heap
+        :param slow_mode: if True each message is published when the wall clock reaches
+          its timestamp, otherwise messages are published as fast as possible
+        :param speed: playback speed the message timestamps were scaled by, used to report the achieved speed
+        """
+        self._streamers = streamers
+        self._slow_mode = slow_mode
+        self._speed = speed
+        self._schedule_lag = get_metrics().schedule_lag.labels()
+        self._message_generators: List[AsyncGenerator[Tuple[Payload, int], None]] = []
+        # Earliest unpublished message from each source which has not finished,
+        # (timestamp_ns, streamer_number, payload)
+        self._next_messages: List[Tuple[int, int, Payload]] = []
+
+    async def _get_next_message(self, streamer_number: int):
+        try:
+            payload, timestamp_ns = await self._message_generators[
+                streamer_number
+            ].__anext__()
+        except StopAsyncIteration:
+            return
+        heapq.heappush(self._next_messages, (timestamp_ns, streamer_number, payload))
+
+    async def run(self):
+        """
+        Returns when all messages from all sources have been published
+        """
+        self._message_generators = [
+            streamer.get_messages() for streamer in self._streamers
+        ]
+        for streamer_number in range(len(self._streamers)):
+            await self._get_next_message(streamer_number)
+
+        statistics = _PublishStatistics(self._slow_mode, self._speed)
+        messages_published = 0
+        while self._next_messages:
+            timestamp_ns, streamer_number, payload = self._next_messages[0]
+            if self._slow_mode:
+                wait_ns = timestamp_ns - time_ns()
+                if wait_ns > 0:
+                    # Another source cannot get an earlier message while we wait,
+                    # as the next message of every source is already in the heap
+                    await asyncio.sleep(wait_ns * 1e-9)
+            heapq.heappop(self._next_messages)
+            await self._streamers[streamer_number].publish(payload, timestamp_ns)
+            publish_time_ns = time_ns()
+            statistics.record(len(payload), timestamp_ns, publish_time_ns)
+            if self._slow_mode:
+                self._schedule_lag.observe((publish_time_ns - timestamp_ns) * 1e-9)
+            await self._get_next_message(streamer_number)
+
+            messages_published += 1
+            if (
+                not self._slow_mode
+                and messages_published % _MESSAGES_BETWEEN_YIELDS == 0
+            ):
+                await asyncio.sleep(0)
+        statistics.report_summary()
+
+    def stop(self):
+        """
+        Stops reading from all sources, must be called before the file is closed
+        """
+        for streamer in self._streamers:
+            streamer.stop()
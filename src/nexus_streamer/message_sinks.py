@@ -0,0 +1,300 @@
+import asyncio
+import mmap
+import os
+import select
+import socket
+import struct
+from typing import Iterator, NamedTuple, Optional, Union
+
+from .application_logger import get_logger
+from .kafka_producer import KafkaProducer, create_producer_config
+from .payload_cache import Payload
+
+KAFKA_SINK = "kafka"
+NULL_SINK = "null"
+FILE_SINK = "file"
+SOCKET_SINK = "socket"
+
+# Start of a message file, followed by the format version
+_FILE_MAGIC = b"NXSMSGS\0"
+_FILE_VERSION = 1
+_FILE_HEADER = struct.Struct("<8sI4x")
+# Each message is a header with the payload size, topic size, partition (-1 if none) and
+# timestamp in nanoseconds (-1 if none), followed by the topic and the flatbuffer payload,
+# each padded to a multiple of 8 bytes so that payloads in a memory-mapped file are aligned
+_MESSAGE_HEADER = struct.Struct("<IHhq")
+_ALIGNMENT = 8
+# Messages are buffered and written in batches of about this size
+_FILE_WRITE_BATCH_BYTES = 4_000_000
+
+
+def _padding(size: int) -> bytes:
+    return bytes(-size % _ALIGNMENT)
+
+
+def _encode_message(
+    topic: str, payload: Payload, timestamp_ns: Optional[int], partition: Optional[int]
+) -> bytearray:
+    encoded_topic = topic.encode("utf8")
+    message = bytearray(
+        _MESSAGE_HEADER.pack(
+            len(payload),
+            len(encoded_topic),
+            -1 if partition is None else partition,
+            -1 if timestamp_ns is None else timestamp_ns,
+        )
+    )
+    message += encoded_topic
+    message += _padding(len(encoded_topic))
+    message += payload
+    message += _padding(len(payload))
+    return message
+
+
+class SinkMessage(NamedTuple):
+    topic: str
+    partition: Optional[int]
+    timestamp_ns: Optional[int]
+    payload: memoryview
+
+
+def read_message_file(filename: str) -> Iterator[SinkMessage]:
+    """
+    Messages written by FileSink, in the order they were written. Payloads are views of the
+    memory-mapped file, so they are only valid while the iterator is in use.
+    """
+    with open(filename, "rb") as message_file:
+        if os.fstat(message_file.fileno()).st_size == 0:
+            return
+        with mmap.mmap(message_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            view = memoryview(mapped)
+            try:
+                magic, version = _FILE_HEADER.unpack_from(view)
+                if magic != _FILE_MAGIC or version != _FILE_VERSION:
+                    raise ValueError(f"{filename} is not a message file version 1")
+                offset = _FILE_HEADER.size
+                while offset + _MESSAGE_HEADER.size <= len(view):
+                    (
+                        payload_size,
+                        topic_size,
+                        partition,
+                        timestamp_ns,
+                    ) = _MESSAGE_HEADER.unpack_from(view, offset)
+                    offset += _MESSAGE_HEADER.size
+                    topic = str(view[offset : offset + topic_size], "utf8")
+                    offset += topic_size + len(_padding(topic_size))
+                    payload = view[offset : offset + payload_size]
+                    offset += payload_size + len(_padding(payload_size))
+                    yield SinkMessage(
+                        topic,
+                        None if partition == -1 else partition,
+                        None if timestamp_ns == -1 else timestamp_ns,
+                        payload,
+                    )
+                    payload.release()
+            finally:
+                view.release()
+
+
+class NullSink:
+    def __init__(self):
+        """
+        Discards messages, counting them, to measure the throughput of reading and
+        serialising without a broker
+        """
+        self.number_of_messages = 0
+        self.number_of_bytes = 0
+
+    def produce(
+        self,
+        topic: str,
+        payload: Payload,
+        timestamp_ns: Optional[int] = None,
+        partition: Optional[int] = None,
+    ):
+        self.number_of_messages += 1
+        self.number_of_bytes += len(payload)
+
+    async def produce_when_queue_has_space(
+        self,
+        topic: str,
+        payload: Payload,
+        timestamp_ns: Optional[int] = None,
+        partition: Optional[int] = None,
+    ):
+        self.produce(topic, payload, timestamp_ns, partition)
+
+    def flush(self):
+        pass
+
+    def close(self) -> int:
+        """
+        :return: number of messages which were not delivered, always 0
+        """
+        get_logger().info(
+            f"Discarded {self.number_of_messages} messages, "
+            f"{self.number_of_bytes} bytes"
+        )
+        return 0
+
+
+class FileSink:
+    def __init__(
+        self,
+        filename: str,
+        append: bool = False,
+        write_batch_bytes: int = _FILE_WRITE_BATCH_BYTES,
+    ):
+        """
+        Writes length-prefixed messages to a file, which can be read with read_message_file
+        :param append: append to the file written by another process, rather than
+          truncating it. Each batch of messages is written in a single write to the file
+          opened with O_APPEND, so messages from several processes are not interleaved.
+        :param write_batch_bytes: messages are buffered until there are this many bytes,
+          0 writes each message as it is published
+        """
+        self._filename = filename
+        self._write_batch_bytes = write_batch_bytes
+        flags = os.O_WRONLY | os.O_CREAT | os.O_APPEND
+        if not append:
+            flags |= os.O_TRUNC
+        self._file_descriptor = os.open(filename, flags, 0o644)
+        self._buffer = bytearray()
+        if not append:
+            self._buffer += _FILE_HEADER.pack(_FILE_MAGIC, _FILE_VERSION)
+            self._write_buffer()
+
+    def _write_buffer(self):
+        written = 0
+        while written < len(self._buffer):
+            written += os.write(self._file_descriptor, self._buffer[written:])
+        self._buffer.clear()
+
+    def produce(
+        self,
+        topic: str,
+        payload: Payload,
+        timestamp_ns: Optional[int] = None,
+        partition: Optional[int] = None,
+    ):
+        self._buffer += _encode_message(topic, payload, timestamp_ns, partition)
+        if len(self._buffer) >= self._write_batch_bytes:
+            self._write_buffer()
+
+    async def produce_when_queue_has_space(
+        self,
+        topic: str,
+        payload: Payload,
+        timestamp_ns: Optional[int] = None,
+        partition: Optional[int] = None,
+    ):
+        self.produce(topic, payload, timestamp_ns, partition)
+
+    def flush(self):
+        """
+        Writes buffered messages to the file
+        """
+        self._write_buffer()
+
+    def close(self) -> int:
+        """
+        :return: number of messages which were not written, always 0 as failures raise
+        """
+        try:
+            self._write_buffer()
+        finally:
+            os.close(self._file_descriptor)
+        return 0
+
+
+def _connect(address: str) -> socket.socket:
+    """
+    :param address: <host:port> for TCP, otherwise path of a Unix socket
+    """
+    host, separator, port = address.rpartition(":")
+    if separator and port.isdigit():
+        return socket.create_connection((host, int(port)))
+    unix_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        unix_socket.connect(address)
+    except OSError:
+        unix_socket.close()
+        raise
+    return unix_socket
+
+
+class SocketSink:
+    def __init__(self, address: str):
+        """
+        Sends messages, in the same format as FileSink without the file header, to a TCP or
+        Unix socket. Publishing waits while the receiver is not keeping up.
+        :param address: <host:port> for TCP, otherwise path of a Unix socket
+        """
+        self._socket = _connect(address)
+        self._socket.setblocking(False)
+
+    def produce(
+        self,
+        topic: str,
+        payload: Payload,
+        timestamp_ns: Optional[int] = None,
+        partition: Optional[int] = None,
+    ):
+        """
+        Blocks while the socket's send buffer is full
+        """
+        message = memoryview(_encode_message(topic, payload, timestamp_ns, partition))
+        while message:
+            try:
+                message = message[self._socket.send(message) :]
+            except BlockingIOError:
+                select.select([], [self._socket], [])
+
+    async def produce_when_queue_has_space(
+        self,
+        topic: str,
+        payload: Payload,
+        timestamp_ns: Optional[int] = None,
+        partition: Optional[int] = None,
+    ):
+        """
+        Waits for space in the socket's send buffer without blocking the event loop
+        """
+        await asyncio.get_running_loop().sock_sendall(
+            self._socket, _encode_message(topic, payload, timestamp_ns, partition)
+        )
+
+    def flush(self):
+        # Messages are not buffered
+        pass
+
+    def close(self) -> int:
+        """
+        :return: number of messages which were not sent, always 0 as failures raise
+        """
+        self._socket.close()
+        return 0
+
+
+MessageSink = Union[KafkaProducer, NullSink, FileSink, SocketSink]
+
+
+def create_sink(args, append_to_file: bool = False) -> MessageSink:
+    """
+    :param append_to_file: append to the file of a file sink, used by worker processes
+    """
+    if args.sink == NULL_SINK:
+        return NullSink()
+    if args.sink == FILE_SINK:
+        # Messages from worker processes are written as they are published, rather than
+        # in batches, so that the file stays close to the order they were published in
+        return FileSink(
+            args.sink_address,
+            append_to_file,
+            0 if args.worker_processes > 0 else _FILE_WRITE_BATCH_BYTES,
+        )
+    if args.sink == SOCKET_SINK:
+        return SocketSink(args.sink_address)
+    return KafkaProducer(
+        create_producer_config(args), flush_timeout_s=args.flush_timeout_s
+    )
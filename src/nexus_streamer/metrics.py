@@ -0,0 +1,361 @@
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Event, Lock, Thread
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .application_logger import get_logger
+
+_PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+LATENCY_BUCKETS_S = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _format_labels(label_names: Tuple[str, ...], label_values: LabelValues) -> str:
+    if not label_names:
+        return ""
+    labels = ",".join(
+        f'{name}="{value}"' for name, value in zip(label_names, label_values)
+    )
+    return f"{{{labels}}}"
+
+
+class _Value:
+    def __init__(self):
+        """
+        Value of a counter or gauge for one set of label values.
+        Each is only updated from a single thread, so no lock is needed.
+        """
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+    def set(self, value: float):
+        self.value = value
+
+
+class _HistogramValue:
+    def __init__(self, buckets: Tuple[float, ...]):
+        self._buckets = buckets
+        # Observations may come from several threads, for example Kafka delivery callbacks
+        self._lock = Lock()
+        self.bucket_counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        bucket = bisect_left(self._buckets, value)
+        with self._lock:
+            self.bucket_counts[bucket] += 1
+            self.sum += value
+            self.count += 1
+
+    def merge(self, bucket_counts: List[int], total: float, count: int):
+        with self._lock:
+            for bucket, bucket_count in enumerate(bucket_counts):
+                self.bucket_counts[bucket] += bucket_count
+            self.sum += total
+            self.count += count
+
+
+class _Metric:
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        metric_type: str,
+        label_names: Tuple[str, ...] = (),
+    ):
+        self.name = name
+        self.description = description
+        self.metric_type = metric_type
+        self.label_names = label_names
+        self._lock = Lock()
+        # _Value, or _HistogramValue for histograms
+        self._values: Dict[LabelValues, Any] = {}
+
+    def _create_value(self):
+        return _Value()
+
+    def labels(self, *label_values: str):
+        """
+        Get the value for these labels, keep a reference to it in code which updates it often
+        """
+        with self._lock:
+            if label_values not in self._values:
+                self._values[label_values] = self._create_value()
+            return self._values[label_values]
+
+    def items(self) -> List[Tuple[LabelValues, Any]]:
+        with self._lock:
+            return list(self._values.items())
+
+    def export(self) -> List[Tuple[LabelValues, Any]]:
+        """
+        Values which can be sent to another process and merged into its metrics
+        """
+        return [(label_values, value.value) for label_values, value in self.items()]
+
+    def merge(self, exported: List[Tuple[LabelValues, Any]]):
+        for label_values, value in exported:
+            self.labels(*label_values).inc(value)
+
+    def to_prometheus(self) -> List[str]:
+        lines = [
+            f"# HELP {self.name} {self.description}",
+            f"# TYPE {self.name} {self.metric_type}",
+        ]
+        for label_values, value in self.items():
+            lines.append(
+                f"{self.name}{_format_labels(self.label_names, label_values)} {value.value}"
+            )
+        return lines
+
+
+class Counter(_Metric):
+    def __init__(self, name: str, description: str, label_names: Tuple[str, ...] = ()):
+        super().__init__(name, description, "counter", label_names)
+
+
+class Gauge(_Metric):
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        label_names: Tuple[str, ...] = (),
+        get_value: Optional[Callable[[], float]] = None,
+    ):
+        """
+        :param get_value: if provided, the gauge has no labels and is set from this when collected
+        """
+        super().__init__(name, description, "gauge", label_names)
+        self._get_value = get_value
+
+    def items(self) -> List[Tuple[LabelValues, Any]]:
+        if self._get_value is not None:
+            self.labels().set(self._get_value())
+        return super().items()
+
+    def export(self) -> List[Tuple[LabelValues, Any]]:
+        # Gauges describe the current state of this process, they are not merged
+        return []
+
+
+class Histogram(_Metric):
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        label_names: Tuple[str, ...] = (),
+        buckets: Tuple[float, ...] = LATENCY_BUCKETS_S,
+    ):
+        super().__init__(name, description, "histogram", label_names)
+        self._buckets = buckets
+
+    def _create_value(self):
+        return _HistogramValue(self._buckets)
+
+    def export(self) -> List[Tuple[LabelValues, Any]]:
+        return [
+            (label_values, (list(value.bucket_counts), value.sum, value.count))
+            for label_values, value in self.items()
+        ]
+
+    def merge(self, exported: List[Tuple[LabelValues, Any]]):
+        for label_values, (bucket_counts, total, count) in exported:
+            self.labels(*label_values).merge(bucket_counts, total, count)
+
+    def to_prometheus(self) -> List[str]:
+        lines = [
+            f"# HELP {self.name} {self.description}",
+            f"# TYPE {self.name} {self.metric_type}",
+        ]
+        for label_values, value in self.items():
+            cumulative_count = 0
+            for upper_bound, bucket_count in zip(
+                self._buckets + (float("inf"),), value.bucket_counts
+            ):
+                cumulative_count += bucket_count
+                bucket_labels = _format_labels(
+                    self.label_names + ("le",),
+                    label_values
+                    + ("+Inf" if upper_bound == float("inf") else str(upper_bound),),
+                )
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative_count}")
+            labels = _format_labels(self.label_names, label_values)
+            lines.append(f"{self.name}_sum{labels} {value.sum}")
+            lines.append(f"{self.name}_count{labels} {value.count}")
+        return lines
+
+
+class Metrics:
+    def __init__(self):
+        """
+        All metrics of the streamer. They are always collected, as updating them is cheap,
+        and are exposed if a metrics port or log interval is configured.
+        """
+        source_labels = ("source", "topic")
+        self.messages = Counter(
+            "nexus_streamer_messages_total", "Messages published", source_labels
+        )
+        self.bytes = Counter(
+            "nexus_streamer_bytes_total", "Bytes of messages published", source_labels
+        )
+        self.events = Counter(
+            "nexus_streamer_events_total",
+            "Events in event data messages published",
+            source_labels,
+        )
+        self.read_seconds = Counter(
+            "nexus_streamer_read_seconds_total",
+            "Time spent reading and decompressing data from the file",
+            ("source",),
+        )
+        self.serialise_seconds = Counter(
+            "nexus_streamer_serialise_seconds_total",
+            "Time spent serialising messages",
+            ("source",),
+        )
+        self.delivery_latency = Histogram(
+            "nexus_streamer_delivery_latency_seconds",
+            "Time from producing a message to its delivery report",
+            ("topic",),
+        )
+        self.schedule_lag = Histogram(
+            "nexus_streamer_schedule_lag_seconds",
+            "Time messages are published after their timestamp in --slow mode",
+        )
+        self.producer_queue_full_waits = Counter(
+            "nexus_streamer_producer_queue_full_waits_total",
+            "Times publishing waited for space in the producer queue",
+        )
+        self._metrics: List[_Metric] = [
+            self.messages,
+            self.bytes,
+            self.events,
+            self.read_seconds,
+            self.serialise_seconds,
+            self.delivery_latency,
+            self.schedule_lag,
+            self.producer_queue_full_waits,
+        ]
+
+    def add_gauge(self, name: str, description: str, get_value: Callable[[], float]):
+        """
+        Gauge which is read when metrics are collected, for example producer queue depth
+        """
+        self._metrics.append(Gauge(name, description, get_value=get_value))
+
+    def to_prometheus(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.to_prometheus())
+        return "\n".join(lines) + "\n"
+
+    def export(self) -> Dict[str, List[Tuple[LabelValues, Any]]]:
+        """
+        Metrics collected in a worker process, to be merged into the metrics of the main process
+        """
+        return {metric.name: metric.export() for metric in self._metrics}
+
+    def merge(self, exported: Dict[str, List[Tuple[LabelValues, Any]]]):
+        for metric in self._metrics:
+            metric.merge(exported.get(metric.name, []))
+
+    def get_totals(self) -> Dict[str, float]:
+        """
+        Counter and gauge values summed over labels, histograms as their mean
+        """
+        totals: Dict[str, float] = {}
+        for metric in self._metrics:
+            items = metric.items()
+            if isinstance(metric, Histogram):
+                count = sum(value.count for _, value in items)
+                if count:
+                    total = sum(value.sum for _, value in items)
+                    totals[f"{metric.name}_mean"] = total / count
+            else:
+                totals[metric.name] = sum(value.value for _, value in items)
+        return totals
+
+
+_metrics = Metrics()
+
+
+def get_metrics() -> Metrics:
+    return _metrics
+
+
+def reset_metrics():
+    """
+    Start collecting metrics from zero, for example in a worker process before each run
+    """
+    global _metrics
+    _metrics = Metrics()
+
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = get_metrics().to_prometheus().encode("utf8")
+        self.send_response(200)
+        self.send_header("Content-Type", _PROMETHEUS_CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Do not log every scrape
+        pass
+
+
+class MetricsReporter:
+    def __init__(self, port: Optional[int], log_interval_s: Optional[float]):
+        """
+        Serves metrics in Prometheus text format over HTTP and/or logs rates periodically
+        :param port: serve metrics on this port, None to not serve them
+        :param log_interval_s: log rates at this interval, None to not log them
+        """
+        self._server: Optional[ThreadingHTTPServer] = None
+        self._stop = Event()
+        self._threads: List[Thread] = []
+        if port is not None:
+            self._server = ThreadingHTTPServer(("", port), _MetricsRequestHandler)
+            self._threads.append(Thread(target=self._server.serve_forever, daemon=True))
+            get_logger().info(f"Serving metrics on port {port}")
+        if log_interval_s is not None and log_interval_s > 0:
+            self._threads.append(
+                Thread(target=self._log_loop, args=(log_interval_s,), daemon=True)
+            )
+        for thread in self._threads:
+            thread.start()
+
+    def _log_loop(self, interval_s: float):
+        logger = get_logger()
+        previous_totals = get_metrics().get_totals()
+        while not self._stop.wait(interval_s):
+            totals = get_metrics().get_totals()
+            rates = {
+                f"{name}_per_s": (value - previous_totals.get(name, 0.0)) / interval_s
+                for name, value in totals.items()
+                if name.endswith("_total")
+            }
+            other_values = {
+                name: value
+                for name, value in totals.items()
+                if not name.endswith("_total")
+            }
+            previous_totals = totals
+            record = {**rates, **other_values}
+            # Values are also passed as extra fields, so they are structured in Graylog
+            logger.info(
+                "Metrics: "
+                + ", ".join(f"{name}={value:.6g}" for name, value in record.items()),
+                extra=record,
+            )
+
+    def stop(self):
+        self._stop.set()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
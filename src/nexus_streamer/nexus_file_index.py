@@ -0,0 +1,103 @@
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import h5py
+import numpy as np
+
+NX_ENTRY = "NXentry"
+
+
+def _decode(value) -> str:
+    if isinstance(value, np.ndarray) and value.size == 1:
+        value = value.item()
+    if isinstance(value, bytes):
+        return value.decode("utf8")
+    return str(value)
+
+
+def _read_attribute(object_id, name: bytes) -> Optional[str]:
+    """
+    Attribute read with the low level API, which avoids creating an h5py object
+    for each object in the file
+    """
+    if not h5py.h5a.exists(object_id, name):
+        return None
+    attribute_id = h5py.h5a.open(object_id, name)
+    value = np.empty(attribute_id.shape, dtype=attribute_id.dtype)
+    attribute_id.read(value)
+    return _decode(value)
+
+
+class DatasetInfo(NamedTuple):
+    shape: Tuple[int, ...]
+    dtype: np.dtype
+    chunks: Optional[Tuple[int, ...]]
+    compression: Optional[str]
+    units: Optional[str]
+
+
+class NexusFileIndex:
+    def __init__(self, nexus_file: h5py.File):
+        """
+        Structure of the file gathered in a single pass, so that each stage of preparing
+        a run does not walk the file again. Objects are visited in name order, as by
+        h5py's visititems, and links other than hard links are not followed.
+        """
+        self._nexus_file = nexus_file
+        # NX_class of each group which has one, by path
+        self.nx_classes: Dict[str, str] = {}
+        self._groups_by_nx_class: Dict[str, List[str]] = {}
+        self._dataset_paths: List[str] = []
+        # Opening every dataset would cost as much as the rest of the pass,
+        # so their metadata is read when it is first requested
+        self._dataset_info: Dict[str, DatasetInfo] = {}
+        h5py.h5o.visit(nexus_file.id, self._index_object, info=True)
+
+        # start_time dataset of each NXentry, the standard way of recording the run start
+        self.start_times: Dict[str, str] = {}
+        for entry_path in self.get_group_paths(NX_ENTRY):
+            # Looked up rather than taken from the index, as it may be a soft link
+            start_time = nexus_file[entry_path].get("start_time")
+            if isinstance(start_time, h5py.Dataset):
+                self.start_times[start_time.name] = _decode(start_time[()])
+
+    def _index_object(self, name: bytes, info: h5py.h5o.ObjInfo):
+        if name == b".":
+            return None
+        path = f"/{name.decode('utf8')}"
+        if info.type == h5py.h5o.TYPE_GROUP:
+            if info.num_attrs:
+                nx_class = _read_attribute(
+                    h5py.h5o.open(self._nexus_file.id, name), b"NX_class"
+                )
+                if nx_class is not None:
+                    self.nx_classes[path] = nx_class
+                    self._groups_by_nx_class.setdefault(nx_class, []).append(path)
+        elif info.type == h5py.h5o.TYPE_DATASET:
+            self._dataset_paths.append(path)
+        return None
+
+    @property
+    def dataset_paths(self) -> List[str]:
+        return self._dataset_paths
+
+    def get_dataset_info(self, path: str) -> DatasetInfo:
+        """
+        :param path: absolute path of the dataset
+        """
+        if path not in self._dataset_info:
+            dataset = self._nexus_file[path]
+            units = dataset.attrs.get("units")
+            self._dataset_info[path] = DatasetInfo(
+                dataset.shape,
+                dataset.dtype,
+                dataset.chunks,
+                dataset.compression,
+                None if units is None else _decode(units),
+            )
+        return self._dataset_info[path]
+
+    def get_group_paths(self, nx_class: str) -> List[str]:
+        return self._groups_by_nx_class.get(nx_class, [])
+
+    def get_groups(self, nx_class: str) -> List[h5py.Group]:
+        return [self._nexus_file[path] for path in self.get_group_paths(nx_class)]
@@ -1,5 +1,15 @@
 import logging
 import configargparse
+from .prefetch import DEFAULT_PREFETCH_DEPTH
+from .kafka_producer import DEFAULT_FLUSH_TIMEOUT_S
+from .chunk_decompression import THREAD_POOL, PROCESS_POOL
+from .detector_partitioning import PARTITION_TARGET, TOPIC_TARGET
+from .message_sinks import KAFKA_SINK, NULL_SINK, FILE_SINK, SOCKET_SINK
+from .event_data_source import (
+    DEFAULT_SOURCE_MEMORY_BUDGET_BYTES,
+    UNIFORM_DISTRIBUTION,
+    FILE_DISTRIBUTION,
+)
 
 
 def parse_args():
@@ -38,19 +48,44 @@ def parse_args():
         default="Error",
         env_var="VERBOSITY",
     )
-    parser.add_argument(
+    input_files = parser.add_mutually_exclusive_group(required=True)
+    input_files.add_argument(
         "-f",
         "--filename",
-        required=True,
         help="NeXus file to stream data from",
         env_var="FILENAME",
     )
+    input_files.add_argument(
+        "--playlist",
+        help="Directory of NeXus files, text file listing one NeXus file per line, or glob "
+        "pattern. Files are streamed as runs back to back, in order, the next run is "
+        "prepared while the current one is streamed",
+        type=str,
+        env_var="PLAYLIST",
+    )
     parser.add_argument(
         "--json-description",
         required=False,
         help="If provided use this JSON template instead of generating one from the NeXus file",
         env_var="JSON_FILENAME",
     )
+    parser.add_argument(
+        "--json-description-cache-dir",
+        required=False,
+        help="Keep JSON descriptions generated from NeXus files in this directory, "
+        "so that they are not generated again when the streamer is restarted",
+        env_var="JSON_DESCRIPTION_CACHE_DIR",
+    )
+    parser.add_argument(
+        "--json-description-max-mb",
+        required=False,
+        help="If the JSON description generated from the NeXus file is larger than this, "
+        "large datasets in it are truncated to keep the run start message below the "
+        "maximum message size",
+        type=int,
+        default=100,
+        env_var="JSON_DESCRIPTION_MAX_MB",
+    )
     parser.add_argument(
         "-b",
         "--broker",
@@ -74,6 +109,14 @@ def parse_args():
         help="Stream data into Kafka at approx realistic rate (uses timestamps from file)",
         env_var="SLOW",
     )
+    parser.add_argument(
+        "--speed",
+        help="Playback speed relative to the recorded run when used with --slow, "
+        "for example 2 publishes the run in half of its recorded duration",
+        type=float,
+        default=1.0,
+        env_var="SPEED",
+    )
     parser.add_argument(
         "-z",
         "--single-run",
@@ -96,13 +139,208 @@ def parse_args():
         type=int,
         env_var="FAKE_EVENTS",
     )
+    parser.add_argument(
+        "--fake-events-distribution",
+        help="Draw fake detector ids and time-of-flight uniformly, or from the "
+        "distributions of the real event data in the file",
+        choices=(UNIFORM_DISTRIBUTION, FILE_DISTRIBUTION),
+        default=UNIFORM_DISTRIBUTION,
+        env_var="FAKE_EVENTS_DISTRIBUTION",
+    )
+    parser.add_argument(
+        "--fake-events-poisson",
+        action="store_true",
+        help="Vary the number of fake events in each pulse, Poisson distributed "
+        "with mean --fake-events-per-pulse",
+        env_var="FAKE_EVENTS_POISSON",
+    )
     parser.add_argument(
         "-d",
         "--det-spec-map",
         help="Full path of a detector-spectrum map file which may be required for files from ISIS",
         env_var="DET_SPEC_MAP",
     )
+    parser.add_argument(
+        "--prefetch-depth",
+        help="Number of blocks of data to read and decompress ahead of publishing, "
+        "in a background thread for each data source. 0 reads data in the main thread",
+        type=int,
+        default=DEFAULT_PREFETCH_DEPTH,
+        env_var="PREFETCH_DEPTH",
+    )
+    parser.add_argument(
+        "--decompression-workers",
+        help="Number of workers to decompress chunks of event data in parallel, "
+        "0 lets HDF5 decompress chunks as they are read",
+        type=int,
+        default=0,
+        env_var="DECOMPRESSION_WORKERS",
+    )
+    parser.add_argument(
+        "--decompression-pool",
+        help="Use threads or processes for --decompression-workers, "
+        "processes are only worthwhile for LZF compressed files",
+        choices=(THREAD_POOL, PROCESS_POOL),
+        default=THREAD_POOL,
+        env_var="DECOMPRESSION_POOL",
+    )
+    parser.add_argument(
+        "--payload-cache-mb",
+        help="Keep serialised messages from the first run, up to this many megabytes, "
+        "and republish them with updated timestamps in later runs",
+        type=int,
+        env_var="PAYLOAD_CACHE_MB",
+    )
+    parser.add_argument(
+        "--payload-cache-file",
+        help="Keep the payload cache in this file instead of in memory, "
+        "there is no size limit unless --payload-cache-mb is also given",
+        env_var="PAYLOAD_CACHE_FILE",
+    )
+    parser.add_argument(
+        "--source-memory-budget-mb",
+        help="Memory each event data source may use for event data, "
+        "larger contiguous datasets are read in windows",
+        type=int,
+        default=DEFAULT_SOURCE_MEMORY_BUDGET_BYTES // 1_000_000,
+        env_var="SOURCE_MEMORY_BUDGET_MB",
+    )
+    parser.add_argument(
+        "--memory-budget-mb",
+        help="Memory all event data sources together may use for event data",
+        type=int,
+        env_var="MEMORY_BUDGET_MB",
+    )
+    parser.add_argument(
+        "--pulse-index-cache-dir",
+        required=False,
+        help="Keep pulse times and event index of each NXevent_data in this directory, "
+        "so that they are memory-mapped instead of read from the NeXus file in later runs",
+        env_var="PULSE_INDEX_CACHE_DIR",
+    )
+
+    parser.add_argument(
+        "--kafka-linger-ms",
+        help="Time librdkafka waits for more messages to batch together before sending "
+        "(linger.ms)",
+        type=float,
+        env_var="KAFKA_LINGER_MS",
+    )
+    parser.add_argument(
+        "--kafka-batch-num-messages",
+        help="Maximum number of messages batched in one request (batch.num.messages)",
+        type=int,
+        env_var="KAFKA_BATCH_NUM_MESSAGES",
+    )
+    parser.add_argument(
+        "--kafka-queue-max-messages",
+        help="Maximum number of messages in the producer queue before publishing waits "
+        "for space (queue.buffering.max.messages)",
+        type=int,
+        env_var="KAFKA_QUEUE_MAX_MESSAGES",
+    )
+    parser.add_argument(
+        "--kafka-queue-max-kbytes",
+        help="Maximum size of the producer queue in kilobytes before publishing waits "
+        "for space (queue.buffering.max.kbytes)",
+        type=int,
+        env_var="KAFKA_QUEUE_MAX_KBYTES",
+    )
+    parser.add_argument(
+        "--kafka-compression",
+        help="Compression of message batches (compression.codec)",
+        choices=("none", "gzip", "snappy", "lz4", "zstd"),
+        env_var="KAFKA_COMPRESSION",
+    )
+    parser.add_argument(
+        "--flush-timeout-s",
+        help="Maximum time to wait for queued messages to be delivered when exiting, "
+        "messages not delivered are reported",
+        type=float,
+        default=DEFAULT_FLUSH_TIMEOUT_S,
+        env_var="FLUSH_TIMEOUT_S",
+    )
+    parser.add_argument(
+        "--event-partitions",
+        help="Split the events of each pulse into this many detector id ranges, "
+        "containing similar numbers of pixels from detector_number, and publish each "
+        "range as a separate message",
+        type=int,
+        env_var="EVENT_PARTITIONS",
+    )
+    parser.add_argument(
+        "--event-partition-starts",
+        help="First detector id of each range to split the events of each pulse into, "
+        "instead of deriving ranges from detector_number",
+        type=int,
+        nargs="+",
+        env_var="EVENT_PARTITION_STARTS",
+    )
+    parser.add_argument(
+        "--event-partition-target",
+        help="Publish each detector id range to a partition of the event data topic, "
+        "or to its own topic named <instrument>_events_<range number>",
+        choices=(PARTITION_TARGET, TOPIC_TARGET),
+        default=PARTITION_TARGET,
+        env_var="EVENT_PARTITION_TARGET",
+    )
+    parser.add_argument(
+        "--worker-processes",
+        help="Publish event data from worker processes, each with its own file handle "
+        "and Kafka producer. Event data sources, or their detector id ranges if there "
+        "are fewer sources than workers, are shared between the workers. Each worker "
+        "with ranges of a source reads and decompresses all of its events. 0 publishes "
+        "everything from this process",
+        type=int,
+        default=0,
+        env_var="WORKER_PROCESSES",
+    )
+    parser.add_argument(
+        "--sink",
+        help="Where to publish messages: the Kafka broker, nowhere (null, counting "
+        "messages and bytes to measure throughput), a file of length-prefixed messages "
+        "or a TCP or Unix socket, see --sink-address",
+        choices=(KAFKA_SINK, NULL_SINK, FILE_SINK, SOCKET_SINK),
+        default=KAFKA_SINK,
+        env_var="SINK",
+    )
+    parser.add_argument(
+        "--sink-address",
+        help="File to write messages to with --sink file, <host:port> or path of a Unix "
+        "socket to send messages to with --sink socket",
+        type=str,
+        env_var="SINK_ADDRESS",
+    )
+    parser.add_argument(
+        "--metrics-port",
+        help="Serve throughput and latency metrics in Prometheus text format on this port",
+        type=int,
+        env_var="METRICS_PORT",
+    )
+    parser.add_argument(
+        "--metrics-log-interval-s",
+        help="Log throughput and latency metrics at this interval",
+        type=float,
+        env_var="METRICS_LOG_INTERVAL_S",
+    )
 
     optargs = parser.parse_args()
+    if optargs.speed <= 0:
+        parser.error("--speed must be greater than 0")
+    if optargs.json_description_max_mb <= 0:
+        parser.error("--json-description-max-mb must be greater than 0")
+    if optargs.worker_processes < 0:
+        parser.error("--worker-processes must not be negative")
+    if optargs.event_partitions is not None and optargs.event_partitions < 1:
+        parser.error("--event-partitions must be at least 1")
+    if optargs.event_partition_starts is not None and any(
+        later <= earlier
+        for earlier, later in zip(
+            optargs.event_partition_starts, optargs.event_partition_starts[1:]
+        )
+    ):
+        parser.error("--event-partition-starts must be in increasing order")
+    if optargs.sink in (FILE_SINK, SOCKET_SINK) and optargs.sink_address is None:
+        parser.error(f"--sink-address is required with --sink {optargs.sink}")
     optargs.verbosity = log_choice_to_enum[optargs.verbosity]
     return optargs
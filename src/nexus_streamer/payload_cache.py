@@ -0,0 +1,246 @@
+import mmap
+import struct
+from typing import BinaryIO, Dict, Generator, List, Optional, Tuple, Union
+
+from .application_logger import get_logger
+
+# Position of timestamp fields in the vtable of the root table of each schema
+EV42_PULSE_TIME_VTABLE_SLOT = 8
+EV42_DETECTOR_ID_VTABLE_SLOT = 12
+F142_TIMESTAMP_VTABLE_SLOT = 10
+
+_TIMESTAMP_FORMAT = "<q"
+# Serialised message, messages replayed from the cache are views of the cached payloads
+Payload = Union[bytes, memoryview]
+
+# Vectors in flatbuffers are preceded by their length
+_VECTOR_LENGTH_SIZE = struct.calcsize("<I")
+
+
+def find_field_position(payload: Payload, vtable_slot: int) -> Optional[int]:
+    """
+    Gives the byte offset in a serialised flatbuffer of a scalar field of the root table
+    :return: None if the field is not present in the buffer
+    """
+    table_position = struct.unpack_from("<I", payload, 0)[0]
+    vtable_position = (
+        table_position - struct.unpack_from("<i", payload, table_position)[0]
+    )
+    vtable_size = struct.unpack_from("<H", payload, vtable_position)[0]
+    if vtable_slot >= vtable_size:
+        return None
+    field_offset = struct.unpack_from("<H", payload, vtable_position + vtable_slot)[0]
+    if field_offset == 0:
+        return None
+    return table_position + field_offset
+
+
+def find_vector(payload: Payload, vtable_slot: int) -> Tuple[int, int]:
+    """
+    Locates a vector field of the root table of a serialised flatbuffer
+    :return: byte offset of the first element and number of elements, 0 elements if the field is not present
+    """
+    field_position = find_field_position(payload, vtable_slot)
+    if field_position is None:
+        return 0, 0
+    vector_position = (
+        field_position + struct.unpack_from("<I", payload, field_position)[0]
+    )
+    return (
+        vector_position + _VECTOR_LENGTH_SIZE,
+        struct.unpack_from("<I", payload, vector_position)[0],
+    )
+
+
+def find_vector_length(payload: Payload, vtable_slot: int) -> int:
+    """
+    Gives the number of elements in a vector field of the root table of a serialised flatbuffer
+    :return: 0 if the field is not present in the buffer
+    """
+    return find_vector(payload, vtable_slot)[1]
+
+
+class SourcePayloadCache:
+    def __init__(self, cache: "PayloadCache", source_key: str):
+        """
+        Serialised messages from a single data source, recorded during the first run
+        and replayed with patched timestamps in later runs
+        """
+        self._cache = cache
+        self._source_key = source_key
+        self._locations: List[Tuple[int, int]] = []
+        self._payloads: List[bytearray] = []
+        self._timestamps_ns: List[int] = []
+        self._timestamp_positions: List[int] = []
+        self._recorded_start_time_delta_ns = 0
+        self._bytes = 0
+        self.is_complete = False
+        self.is_disabled = False
+
+    def start_recording(self, start_time_delta_ns: int):
+        # Discard anything left from a run which was interrupted
+        self._cache.release(self._bytes)
+        if self._locations:
+            self._cache.discard_from_file(sum(size for _, size in self._locations))
+        self._locations.clear()
+        self._payloads.clear()
+        self._timestamps_ns.clear()
+        self._timestamp_positions.clear()
+        self._bytes = 0
+        self._recorded_start_time_delta_ns = start_time_delta_ns
+
+    def record(self, payload: bytes, timestamp_ns: int, vtable_slot: int):
+        """
+        :param timestamp_ns: timestamp as published, including the start time delta
+        :param vtable_slot: which field of the flatbuffer contains the timestamp
+        """
+        if self.is_disabled:
+            return
+        timestamp_position = find_field_position(payload, vtable_slot)
+        if timestamp_position is None or not self._cache.reserve(len(payload)):
+            self._disable()
+            return
+        self._bytes += len(payload)
+        if self._cache.is_spilled_to_file:
+            try:
+                self._locations.append(self._cache.write(payload))
+            except OSError as error:
+                get_logger().warning(f"Failed to write to payload cache file: {error}")
+                self._disable()
+                return
+        else:
+            # Timestamps are patched in place when the payloads are replayed
+            self._payloads.append(bytearray(payload))
+        self._timestamps_ns.append(timestamp_ns)
+        self._timestamp_positions.append(timestamp_position)
+
+    def finish_recording(self):
+        if not self.is_disabled:
+            self.is_complete = True
+
+    def _disable(self):
+        get_logger().warning(
+            f"Payload cache budget exceeded or message not supported, "
+            f"{self._source_key} will be read from file in every run"
+        )
+        self.start_recording(0)
+        self.is_disabled = True
+
+    def _get_payload(self, message_number: int) -> memoryview:
+        if self._cache.is_spilled_to_file:
+            return self._cache.read(*self._locations[message_number])
+        return memoryview(self._payloads[message_number])
+
+    def replay(
+        self, start_time_delta_ns: int
+    ) -> Generator[Tuple[memoryview, int], None, None]:
+        """
+        Yields payloads and their timestamps, with the timestamps moved to the new start time delta.
+        The timestamp is patched in the cached payload, which is not copied.
+        """
+        time_shift_ns = start_time_delta_ns - self._recorded_start_time_delta_ns
+        for message_number, recorded_timestamp_ns in enumerate(self._timestamps_ns):
+            payload = self._get_payload(message_number)
+            timestamp_ns = recorded_timestamp_ns + time_shift_ns
+            struct.pack_into(
+                _TIMESTAMP_FORMAT,
+                payload,
+                self._timestamp_positions[message_number],
+                timestamp_ns,
+            )
+            yield payload, timestamp_ns
+
+
+class PayloadCache:
+    def __init__(self, max_bytes: Optional[int], spill_filename: Optional[str] = None):
+        """
+        Holds serialised messages for every data source so that repeated runs
+        do not have to read, decompress and serialise the data again
+        :param max_bytes: budget for cached payloads, None for no limit
+        :param spill_filename: if provided, payloads are kept in this file rather than in memory
+        """
+        self._max_bytes = max_bytes
+        self._bytes = 0
+        self._sources: Dict[str, SourcePayloadCache] = {}
+        self._file: Optional[BinaryIO] = None
+        self._file_size = 0
+        # Bytes in the spill file of payloads which are still cached
+        self._file_cached_bytes = 0
+        self._mapped_file: Optional[mmap.mmap] = None
+        if spill_filename is not None:
+            self._file = open(spill_filename, "w+b")
+
+    @property
+    def is_spilled_to_file(self) -> bool:
+        return self._file is not None
+
+    def get_source_cache(self, source_key: str) -> SourcePayloadCache:
+        """
+        :param source_key: identifies the data source, for example its path in the NeXus file
+        """
+        if source_key not in self._sources:
+            self._sources[source_key] = SourcePayloadCache(self, source_key)
+        return self._sources[source_key]
+
+    def reserve(self, number_of_bytes: int) -> bool:
+        if (
+            self._max_bytes is not None
+            and self._bytes + number_of_bytes > self._max_bytes
+        ):
+            return False
+        self._bytes += number_of_bytes
+        return True
+
+    def release(self, number_of_bytes: int):
+        self._bytes -= number_of_bytes
+
+    def write(self, payload: bytes) -> Tuple[int, int]:
+        """
+        Append payload to the spill file
+        :return: location of the payload in the file, (offset, size)
+        """
+        assert self._file is not None
+        offset = self._file_size
+        try:
+            self._file.write(payload)
+        except OSError:
+            # Remove anything partly written, so that later payloads are at their offsets
+            self._file.seek(offset)
+            self._file.truncate()
+            raise
+        self._file_size += len(payload)
+        self._file_cached_bytes += len(payload)
+        return offset, len(payload)
+
+    def discard_from_file(self, number_of_bytes: int):
+        """
+        Payloads written to the spill file are no longer cached, for example those of a
+        recording which was interrupted. The file is truncated once no cached payloads are
+        left in it, so that it does not grow with every interrupted recording.
+        """
+        assert self._file is not None
+        self._file_cached_bytes -= number_of_bytes
+        if self._file_cached_bytes == 0:
+            # Nothing is replayed from the mapping, it is released when the last view is
+            self._mapped_file = None
+            self._file.seek(0)
+            self._file.truncate()
+            self._file_size = 0
+
+    def read(self, offset: int, size: int) -> memoryview:
+        assert self._file is not None
+        if self._mapped_file is None or offset + size > len(self._mapped_file):
+            self._file.flush()
+            # The previous mapping is not closed explicitly as payloads being
+            # published may still reference it, it is released when they are.
+            # Payloads are writable so that their timestamps can be patched in place.
+            self._mapped_file = mmap.mmap(
+                self._file.fileno(), self._file_size, access=mmap.ACCESS_WRITE
+            )
+        return memoryview(self._mapped_file)[offset : offset + size]
+
+    def close(self):
+        if self._mapped_file is not None:
+            self._mapped_file.close()
+        if self._file is not None:
+            self._file.close()
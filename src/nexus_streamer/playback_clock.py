@@ -0,0 +1,32 @@
+import numpy as np
+
+
+class PlaybackClock:
+    def __init__(
+        self,
+        start_time_delta_ns: int,
+        speed: float = 1.0,
+        recorded_run_start_ns: int = 0,
+    ):
+        """
+        Maps times recorded in the NeXus file to the timestamps they are published with
+        :param start_time_delta_ns: diff between time publishing started and start time of the run in the file
+        :param speed: playback speed relative to the recorded run, 2.0 publishes the run in half the time
+        :param recorded_run_start_ns: run start time in the file, time intervals are scaled relative to this
+        """
+        self.start_time_delta_ns = start_time_delta_ns
+        self.speed = speed
+        self._recorded_run_start_ns = recorded_run_start_ns
+
+    def to_publish_times(self, recorded_times_ns: np.ndarray) -> np.ndarray:
+        if self.speed == 1.0:
+            return recorded_times_ns + self.start_time_delta_ns
+        # Scale time since the run start rather than the absolute time, which would lose precision in float64
+        scaled_times_since_run_start_ns = np.rint(
+            (recorded_times_ns - self._recorded_run_start_ns) / self.speed
+        ).astype(np.int64)
+        return (
+            scaled_times_since_run_start_ns
+            + self._recorded_run_start_ns
+            + self.start_time_delta_ns
+        )
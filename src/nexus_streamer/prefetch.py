@@ -0,0 +1,108 @@
+import asyncio
+from threading import Thread, Semaphore, Event
+from typing import Any, Iterator, Union
+
+# Number of items read ahead of the publish loop,
+# 2 gives double buffering: one item being published while the next is ready
+DEFAULT_PREFETCH_DEPTH = 2
+
+
+class _EndOfData:
+    pass
+
+
+class _ReadFailed:
+    def __init__(self, error: Exception):
+        self.error = error
+
+
+class Prefetcher:
+    def __init__(self, data_iterator: Iterator, prefetch_depth: int):
+        """
+        Consumes data_iterator on a worker thread, so that file reads and decompression
+        overlap with serialisation and publishing in the asyncio event loop.
+        Must be created from within a running event loop.
+        :param data_iterator: for example generator of blocks from a data source
+        :param prefetch_depth: maximum number of items which are ready and waiting to be picked up
+        """
+        self._loop = asyncio.get_running_loop()
+        self._ready: asyncio.Queue = asyncio.Queue()
+        self._free_slots = Semaphore(prefetch_depth)
+        self._stopped = Event()
+        self._thread = Thread(
+            target=self._read_loop, args=(data_iterator,), daemon=True
+        )
+        self._thread.start()
+
+    def _put(self, item: Any):
+        self._loop.call_soon_threadsafe(self._ready.put_nowait, item)
+
+    def _read_loop(self, data_iterator: Iterator):
+        try:
+            while True:
+                # A slot is taken before the next item is read, so that no more than
+                # prefetch_depth items are read ahead of the consumer
+                self._free_slots.acquire()
+                if self._stopped.is_set():
+                    return
+                try:
+                    item = next(data_iterator)
+                except StopIteration:
+                    break
+                self._put(item)
+        except Exception as error:
+            self._put(_ReadFailed(error))
+            return
+        self._put(_EndOfData())
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> Any:
+        item = await self._ready.get()
+        if isinstance(item, _EndOfData):
+            raise StopAsyncIteration
+        if isinstance(item, _ReadFailed):
+            raise item.error
+        self._free_slots.release()
+        return item
+
+    def close(self):
+        """
+        Stop the worker thread, must be called before the file being read from is closed
+        """
+        self._stopped.set()
+        self._free_slots.release()
+        self._thread.join()
+
+
+class _SynchronousReader:
+    def __init__(self, data_iterator: Iterator):
+        """
+        Same interface as Prefetcher, but reads in the event loop thread when the next item is requested
+        """
+        self._data_iterator = data_iterator
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> Any:
+        try:
+            return next(self._data_iterator)
+        except StopIteration:
+            raise StopAsyncIteration
+
+    def close(self):
+        pass
+
+
+DataReader = Union[Prefetcher, _SynchronousReader]
+
+
+def create_reader(data_iterator: Iterator, prefetch_depth: int) -> DataReader:
+    """
+    :param prefetch_depth: if 0 then data are read synchronously in the event loop
+    """
+    if prefetch_depth > 0:
+        return Prefetcher(data_iterator, prefetch_depth)
+    return _SynchronousReader(data_iterator)
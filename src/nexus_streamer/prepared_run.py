@@ -0,0 +1,177 @@
+import glob
+import os
+from typing import Dict, List, Optional
+
+import h5py
+
+from .application_logger import get_logger
+from .chunk_decompression import create_decompression_pool
+from .create_data_sources_from_nexus import (
+    create_data_sources_from_nexus_file,
+    get_recorded_run_start_time_ns,
+)
+from .detector_partitioning import DetectorIdPartitioning, create_partitioning
+from .generate_json_description import (
+    fill_description_template,
+    get_json_tree,
+    json_tree_to_description_template,
+)
+from .isis_data_source import IsisDataSource
+from .nexus_file_index import NexusFileIndex
+from .pulse_index_cache import create_pulse_index_cache
+
+# Files in a playlist directory with these extensions are streamed
+_NEXUS_FILE_EXTENSIONS = (".nxs", ".nx5", ".h5", ".hdf5", ".hdf")
+
+
+def replace_placeholder_topic_names(nexus_structure, log_data_topic, event_data_topic):
+    for topic in (
+        ("SAMPLE_ENV_TOPIC", log_data_topic),
+        ("EVENT_DATA_TOPIC", event_data_topic),
+    ):
+        nexus_structure = nexus_structure.replace(topic[0], topic[1])
+    return nexus_structure
+
+
+class PreparedRun:
+    def __init__(self, filename: str, args):
+        """
+        Everything needed to stream a run from a file which does not depend on when the run
+        starts, so that the next run can be prepared while the current one is streaming.
+        Opens the file, indexes it, creates the data sources and generates the JSON description.
+        The same prepared run can be streamed repeatedly, data sources start from the beginning
+        each time they are read.
+        :param args: command line arguments
+        """
+        self.filename = filename
+        self._args = args
+        self._partitionings: Dict[str, Optional[DetectorIdPartitioning]] = {}
+        self.log_data_topic = f"{args.instrument}_sampleEnv"
+        self.event_data_topic = f"{args.instrument}_events"
+        self.decompression_pool = None
+        self.nexus_file = h5py.File(filename, "r")
+        try:
+            # Metadata is gathered in a single pass and used by each of the following stages
+            self.nexus_file_index = NexusFileIndex(self.nexus_file)
+            self.decompression_pool = create_decompression_pool(
+                args.decompression_workers, args.decompression_pool
+            )
+            (
+                self.log_data_sources,
+                self.event_data_sources,
+            ) = create_data_sources_from_nexus_file(
+                self.nexus_file,
+                args.fake_events_per_pulse,
+                self.decompression_pool,
+                args.source_memory_budget_mb * 1_000_000,
+                None
+                if args.memory_budget_mb is None
+                else args.memory_budget_mb * 1_000_000,
+                args.fake_events_distribution,
+                args.fake_events_poisson,
+                self.nexus_file_index,
+                create_pulse_index_cache(args.pulse_index_cache_dir, filename),
+            )
+            self.isis_data_source = None
+            if args.isis_file:
+                self.isis_data_source = IsisDataSource(self.nexus_file)
+            (
+                self.recorded_run_start_time_ns,
+                self._run_start_dataset_path,
+            ) = get_recorded_run_start_time_ns(self.nexus_file_index)
+
+            self._nexus_structure: Optional[str] = None
+            self._description_template: Optional[str] = None
+            if args.json_description:
+                with open(args.json_description, "r") as json_file:
+                    self._nexus_structure = replace_placeholder_topic_names(
+                        json_file.read(), self.log_data_topic, self.event_data_topic
+                    )
+            elif self.has_data_sources:
+                # Serialised once, only the run start time is filled in for each run
+                self._description_template = json_tree_to_description_template(
+                    get_json_tree(
+                        filename,
+                        self.event_data_topic,
+                        self.log_data_topic,
+                        args.json_description_cache_dir,
+                        args.json_description_max_mb * 1_000_000,
+                        self.nexus_file,
+                    ),
+                    self._run_start_dataset_path,
+                )
+        except BaseException:
+            self.close()
+            raise
+
+    @property
+    def has_data_sources(self) -> bool:
+        return bool(self.log_data_sources or self.event_data_sources)
+
+    @property
+    def last_timestamp(self) -> int:
+        return max(
+            source.final_timestamp
+            for source in self.event_data_sources + self.log_data_sources  # type: ignore
+        )
+
+    def get_nexus_structure(self, run_start_time_ns: int) -> str:
+        """
+        JSON description for the run start message
+        """
+        if self._nexus_structure is not None:
+            return self._nexus_structure
+        assert self._description_template is not None
+        return fill_description_template(self._description_template, run_start_time_ns)
+
+    def get_partitioning(self, source_path: str) -> Optional[DetectorIdPartitioning]:
+        """
+        Detector id ranges of an event data source, see create_partitioning,
+        detector_number is only read the first time
+        """
+        if source_path not in self._partitionings:
+            self._partitionings[source_path] = create_partitioning(
+                self.nexus_file,
+                source_path,
+                self._args.event_partitions,
+                self._args.event_partition_starts,
+            )
+        return self._partitionings[source_path]
+
+    def close(self):
+        """
+        Data sources must not be read from after this is called
+        """
+        self.nexus_file.close()
+        if self.decompression_pool is not None:
+            self.decompression_pool.shutdown()
+
+
+def get_playlist(playlist: str) -> List[str]:
+    """
+    Files to stream runs from, in order
+    :param playlist: a directory of NeXus files, a text file listing one NeXus file per
+      line (relative paths are relative to the list file) or a glob pattern
+    """
+    if os.path.isdir(playlist):
+        filenames = sorted(
+            os.path.join(playlist, filename)
+            for filename in os.listdir(playlist)
+            if filename.lower().endswith(_NEXUS_FILE_EXTENSIONS)
+            and os.path.isfile(os.path.join(playlist, filename))
+        )
+    elif os.path.isfile(playlist):
+        if h5py.is_hdf5(playlist):
+            return [playlist]
+        list_directory = os.path.dirname(playlist)
+        with open(playlist, "r") as list_file:
+            filenames = [
+                os.path.join(list_directory, line.strip())
+                for line in list_file
+                if line.strip() and not line.strip().startswith("#")
+            ]
+    else:
+        filenames = sorted(glob.glob(playlist))
+    if not filenames:
+        get_logger().error(f"No files found for playlist {playlist}")
+    return filenames
@@ -1,6 +1,6 @@
 from streaming_data_types.run_start_pl72 import serialise_pl72, DetectorSpectrumMap
 from uuid import uuid4
-from .kafka_producer import KafkaProducer
+from .message_sinks import MessageSink
 from typing import Optional
 import numpy as np
 
@@ -10,7 +10,7 @@ def publish_run_start_message(
     run_number: int,
     broker: str,
     nexus_structure: str,
-    producer: KafkaProducer,
+    producer: MessageSink,
     topic: str,
     map_det_ids: Optional[np.ndarray],
     map_spec_nums: Optional[np.ndarray],
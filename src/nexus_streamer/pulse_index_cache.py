@@ -0,0 +1,89 @@
+import hashlib
+import os
+import tempfile
+from typing import Optional
+
+import numpy as np
+
+from .application_logger import get_logger
+
+# Part of the key of cached arrays, increment it if what is saved for a source changes
+# so that arrays saved by an older version are not used
+_PULSE_INDEX_CACHE_VERSION = 1
+
+# Names of the arrays saved for each NXevent_data group
+PULSE_TIMES = "pulse_times"
+EVENT_INDEX = "event_index"
+
+
+class PulseIndexCache:
+    def __init__(self, cache_directory: str, filename: str):
+        """
+        Arrays derived from the pulse datasets of each NXevent_data group in a file, such as
+        pulse times converted to nanoseconds, saved in .npy files in the cache directory.
+        When the file is streamed again they are memory-mapped instead of being read from the
+        file and converted. Arrays are saved again if the file is modified.
+        :param filename: NeXus file which the arrays are derived from
+        """
+        self._cache_directory = cache_directory
+        self._basename = os.path.basename(filename)
+        file_status = os.stat(filename)
+        self._file_key = (
+            f"{_PULSE_INDEX_CACHE_VERSION}:{os.path.abspath(filename)}:"
+            f"{file_status.st_size}:{file_status.st_mtime_ns}"
+        )
+
+    def _get_cache_filename(self, source_path: str, array_name: str) -> str:
+        key = hashlib.sha1(f"{self._file_key}:{source_path}".encode("utf8")).hexdigest()
+        return os.path.join(
+            self._cache_directory, f"{self._basename}.{key}.{array_name}.npy"
+        )
+
+    def load(self, source_path: str, array_name: str) -> Optional[np.ndarray]:
+        """
+        :param source_path: path of the NXevent_data group in the file
+        :return: read-only memory-mapped array, None if it has not been saved
+        """
+        cache_filename = self._get_cache_filename(source_path, array_name)
+        try:
+            return np.load(cache_filename, mmap_mode="r")
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as error:
+            get_logger().warning(
+                f"Failed to read cached {array_name} {cache_filename}, "
+                f"it will be read from the NeXus file: {error}"
+            )
+            return None
+
+    def save(self, source_path: str, array_name: str, array: np.ndarray):
+        cache_filename = self._get_cache_filename(source_path, array_name)
+        try:
+            os.makedirs(self._cache_directory, exist_ok=True)
+            # Written to a temporary file and renamed, so that other streamers sharing
+            # the directory, or worker processes, never read a partially written file
+            file_descriptor, temporary_filename = tempfile.mkstemp(
+                dir=self._cache_directory, suffix=".tmp"
+            )
+            try:
+                with os.fdopen(file_descriptor, "wb") as cache_file:
+                    np.save(cache_file, array)
+                os.replace(temporary_filename, cache_filename)
+            except BaseException:
+                os.remove(temporary_filename)
+                raise
+        except OSError as error:
+            get_logger().warning(
+                f"Failed to save {array_name} to {cache_filename}: {error}"
+            )
+
+
+def create_pulse_index_cache(
+    cache_directory: Optional[str], filename: str
+) -> Optional[PulseIndexCache]:
+    """
+    :return: None if no cache directory is configured
+    """
+    if cache_directory is None:
+        return None
+    return PulseIndexCache(cache_directory, filename)
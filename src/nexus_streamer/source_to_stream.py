@@ -1,166 +1,380 @@
-from time import time_ns
-import asyncio
 from .data_source import (
     EventDataSource,
     LogDataSource,
     FakeEventDataSource,
     IsisDataSource,
 )
-from typing import Optional, Any, Union
-from .kafka_producer import KafkaProducer
+from typing import (
+    Optional,
+    Union,
+    Tuple,
+    AsyncGenerator,
+    Iterator,
+    Sequence,
+)
+from .message_sinks import MessageSink
 from streaming_data_types.logdata_f142 import serialise_f142
 from streaming_data_types.eventdata_ev42 import serialise_ev42
 import numpy as np
+from .playback_clock import PlaybackClock
+from .prefetch import create_reader, DataReader, DEFAULT_PREFETCH_DEPTH
+from .payload_cache import (
+    Payload,
+    SourcePayloadCache,
+    EV42_DETECTOR_ID_VTABLE_SLOT,
+    EV42_PULSE_TIME_VTABLE_SLOT,
+    F142_TIMESTAMP_VTABLE_SLOT,
+    find_vector,
+)
+from .detector_partitioning import (
+    DetectorIdPartitioning,
+    PARTITION_TARGET,
+    get_range_topics,
+)
+from .metrics import get_metrics
+from time import perf_counter
+import struct
+import abc
+
+
+class _Destination:
+    def __init__(self, source_path: str, topic: str, partition: Optional[int] = None):
+        """
+        Where messages are published to
+        :param source_path: path of the data source in the file, which labels its metrics
+        :param partition: if None the partition is chosen by the producer
+        """
+        self.topic = topic
+        self.partition = partition
+        metrics = get_metrics()
+        self.messages_published = metrics.messages.labels(source_path, topic)
+        self.bytes_published = metrics.bytes.labels(source_path, topic)
+
 
+class _SourceToStream(abc.ABC):
+    # Field of the serialised flatbuffer containing the message timestamp
+    _timestamp_vtable_slot: int
+
+    def __init__(
+        self,
+        source_name: str,
+        source_path: str,
+        producer: MessageSink,
+        output_topic: str,
+        clock: PlaybackClock,
+        prefetch_depth: int,
+        payload_cache: Optional[SourcePayloadCache],
+    ):
+        """
+        :param source_path: path of the data source in the file. Metrics are labelled with it
+          rather than the source name, which is not unique if for example several detector
+          banks have an NXevent_data group called "events"
+        """
+        self._source_name = source_name
+        self._source_path = source_path
+        self._producer = producer
+        self._topic = output_topic
+        self._clock = clock
+        self._prefetch_depth = prefetch_depth
+        self._reader: Optional[DataReader] = None
+        self._payload_cache = payload_cache
+
+        self._destinations = [_Destination(source_path, output_topic)]
+
+        metrics = get_metrics()
+        self._read_seconds = metrics.read_seconds.labels(source_path)
+        self._serialise_seconds = metrics.serialise_seconds.labels(source_path)
+
+    def stop(self):
+        """
+        Stop reading from the data source, must be called before the file is closed
+        """
+        if self._reader is not None:
+            self._reader.close()
+
+    async def publish(self, payload: Payload, timestamp_ns: int):
+        await self._publish_to(self._destinations[0], payload, timestamp_ns)
+
+    async def _publish_to(
+        self, destination: _Destination, payload: Payload, timestamp_ns: int
+    ):
+        await self._producer.produce_when_queue_has_space(
+            destination.topic, payload, timestamp_ns, destination.partition
+        )
+        destination.messages_published.inc()
+        destination.bytes_published.inc(len(payload))
+
+    def _time_reads(self, data_iterator: Iterator) -> Iterator:
+        while True:
+            start_time = perf_counter()
+            try:
+                item = next(data_iterator)
+            except StopIteration:
+                return
+            finally:
+                self._read_seconds.inc(perf_counter() - start_time)
+            yield item
+
+    @abc.abstractmethod
+    def _read_data(self) -> Iterator:
+        """
+        Data from the source, this is consumed in a worker thread if prefetching is enabled
+        """
+
+    @abc.abstractmethod
+    def _serialise_messages(
+        self, reader: DataReader
+    ) -> AsyncGenerator[Tuple[bytes, int], None]:
+        """
+        Yields serialised messages and their timestamps
+        """
+
+    async def get_messages(self) -> AsyncGenerator[Tuple[Payload, int], None]:
+        """
+        Yields serialised messages and their timestamps, including the start time delta,
+        in the order they are in the data source
+        """
+        cache = self._payload_cache
+        if cache is not None and cache.is_complete:
+            for message in cache.replay(self._clock.start_time_delta_ns):
+                yield message
+            return
+
+        if cache is not None:
+            cache.start_recording(self._clock.start_time_delta_ns)
+        self._reader = create_reader(
+            self._time_reads(self._read_data()), self._prefetch_depth
+        )
+        try:
+            async for payload, timestamp_ns in self._serialise_messages(self._reader):
+                if cache is not None:
+                    cache.record(payload, timestamp_ns, self._timestamp_vtable_slot)
+                yield payload, timestamp_ns
+        finally:
+            self._reader.close()
+        if cache is not None:
+            cache.finish_recording()
+
+
+class LogSourceToStream(_SourceToStream):
+    _timestamp_vtable_slot = F142_TIMESTAMP_VTABLE_SLOT
 
-class LogSourceToStream:
     def __init__(
         self,
         source: LogDataSource,
-        producer: KafkaProducer,
+        producer: MessageSink,
         output_topic: str,
-        start_time_delta_ns: int,
-        interval_s: float = 0.2,
-        slow_mode: bool = False,
+        clock: PlaybackClock,
+        prefetch_depth: int = DEFAULT_PREFETCH_DEPTH,
+        payload_cache: Optional[SourcePayloadCache] = None,
     ):
         """
         :param source: log data source
-        :param producer: Kafka producer to use to publish data
+        :param producer: Kafka producer, or other sink, to use to publish data
         :param output_topic: Kafka topic to publish data to
-        :param start_time_delta_ns: diff between time publishing started and start time of the run in the data source
-        :param interval_s: idle time between publishing data to allow other async tasks to run
+        :param clock: maps times in the data source to the timestamps they are published with
+        :param prefetch_depth: number of reads to do ahead in a worker thread, 0 to read in the event loop
+        :param payload_cache: if provided, messages are recorded in the first run and replayed in later runs
         """
-        self._source_name = source.name
+        super().__init__(
+            source.name,
+            source.path,
+            producer,
+            output_topic,
+            clock,
+            prefetch_depth,
+            payload_cache,
+        )
         self._data_source = source
-        self._producer = producer
-        self._topic = output_topic
-        self._interval = interval_s
-        self._start_time_delta_ns = start_time_delta_ns
-        self._cancelled = False
-        self._publish_data: Optional[asyncio.Task[Any]] = None
-        self._slow_mode = slow_mode
 
-    def start(self):
-        self._cancelled = False
-        self._publish_data = asyncio.create_task(self._publish_loop())
+    def _read_data(self) -> Iterator:
+        return self._data_source.get_data_blocks()
+
+    async def _serialise_messages(
+        self, reader: DataReader
+    ) -> AsyncGenerator[Tuple[bytes, int], None]:
+        async for values, times_ns in reader:
+            for value, data_timestamp_ns, timestamp_ns in zip(
+                values,
+                times_ns.tolist(),
+                self._clock.to_publish_times(times_ns).tolist(),
+            ):
+                if data_timestamp_ns < 0:
+                    continue
+                start_time = perf_counter()
+                payload = serialise_f142(
+                    value,
+                    self._source_name,
+                    timestamp_ns,
+                )
+                self._serialise_seconds.inc(perf_counter() - start_time)
+                yield payload, timestamp_ns
 
-    def stop(self):
-        if not self._cancelled:
-            self._cancelled = True
-            if self._publish_data is not None:
-                self._publish_data.cancel()
-
-    @property
-    def done(self):
-        return self._cancelled
-
-    async def _publish_loop(self):
-        last_timestamp_ns = 0
-        get_data = self._data_source.get_data()
-        current_run_time_ns = np.iinfo(np.int64).max
-        while not self._cancelled:
-            if self._slow_mode:
-                current_run_time_ns = time_ns()
-            while last_timestamp_ns < current_run_time_ns:
-                value, data_timestamp_ns = next(get_data)
-                if value is not None:
-                    if data_timestamp_ns < 0:
-                        continue
-                    last_timestamp_ns = data_timestamp_ns + self._start_time_delta_ns
-                    payload = serialise_f142(
-                        value,
-                        self._source_name,
-                        last_timestamp_ns,
-                    )
-                    self._producer.produce(
-                        self._topic,
-                        payload,
-                        last_timestamp_ns,
-                    )
-                else:
-                    self._cancelled = True
-                    break
-            await asyncio.sleep(self._interval)
 
+class EventSourceToStream(_SourceToStream):
+    _timestamp_vtable_slot = EV42_PULSE_TIME_VTABLE_SLOT
 
-class EventSourceToStream:
     def __init__(
         self,
         source: Union[EventDataSource, FakeEventDataSource],
-        producer: KafkaProducer,
+        producer: MessageSink,
         output_topic: str,
-        start_time_delta_ns: int,
-        interval_s: float = 0.2,
-        slow_mode: bool = False,
+        clock: PlaybackClock,
         isis_data_source: Optional[IsisDataSource] = None,
+        prefetch_depth: int = DEFAULT_PREFETCH_DEPTH,
+        payload_cache: Optional[SourcePayloadCache] = None,
+        partitioning: Optional[DetectorIdPartitioning] = None,
+        partition_target: str = PARTITION_TARGET,
+        published_ranges: Optional[Sequence[int]] = None,
     ):
         """
         :param source: event data source
-        :param producer: Kafka producer to use to publish data
+        :param producer: Kafka producer, or other sink, to use to publish data
         :param output_topic: Kafka topic to publish data to
-        :param start_time_delta_ns: diff between time publishing started and start time of the run in the data source
-        :param interval_s: idle time between publishing data to allow other async tasks to run
+        :param clock: maps times in the data source to the timestamps they are published with
+        :param prefetch_depth: number of reads to do ahead in a worker thread, 0 to read in the event loop
+        :param payload_cache: if provided, messages are recorded in the first run and replayed in later runs
+        :param partitioning: if provided, the events of each pulse are split by detector id range
+          and each range is published as a separate message
+        :param partition_target: publish each range to a partition of output_topic, or to its own topic
+        :param published_ranges: if provided, only these detector id ranges are published,
+          for example when ranges of one source are shared between processes
         """
-        self._source_name = source.name
+        super().__init__(
+            source.name,
+            source.path,
+            producer,
+            output_topic,
+            clock,
+            prefetch_depth,
+            payload_cache,
+        )
         self._data_source = source
-        self._producer = producer
-        self._topic = output_topic
-        self._interval = interval_s
-        self._start_time_delta_ns = start_time_delta_ns
-        self._cancelled = False
-        self._publish_data: Optional[asyncio.Task[Any]] = None
         self._message_id = 0
-        self._slow_mode = slow_mode
         self._isis_data_source = isis_data_source
+        self._partitioning = partitioning
+        self._published_ranges = (
+            None if published_ranges is None else frozenset(published_ranges)
+        )
+        if partitioning is not None:
+            if partition_target == PARTITION_TARGET:
+                self._destinations = [
+                    _Destination(source.path, output_topic, partition)
+                    for partition in range(partitioning.number_of_ranges)
+                ]
+            else:
+                self._destinations = [
+                    _Destination(source.path, topic)
+                    for topic in get_range_topics(
+                        output_topic, partitioning.number_of_ranges
+                    )
+                ]
+        metrics = get_metrics()
+        self._events_published = [
+            metrics.events.labels(source.path, destination.topic)
+            for destination in self._destinations
+        ]
 
-    def start(self):
-        self._cancelled = False
-        self._publish_data = asyncio.create_task(self._publish_loop())
+    async def publish(self, payload: Payload, timestamp_ns: int):
+        # The destination and number of events are read from the message, so that
+        # messages replayed from the payload cache are treated the same way
+        vector_position, number_of_events = find_vector(
+            payload, EV42_DETECTOR_ID_VTABLE_SLOT
+        )
+        range_number = 0
+        if self._partitioning is not None and number_of_events > 0:
+            range_number = self._partitioning.get_range(
+                struct.unpack_from("<I", payload, vector_position)[0]
+            )
+        await self._publish_to(self._destinations[range_number], payload, timestamp_ns)
+        self._events_published[range_number].inc(number_of_events)
 
-    def stop(self):
-        if not self._cancelled:
-            self._cancelled = True
-            if self._publish_data is not None:
-                self._publish_data.cancel()
-
-    @property
-    def done(self):
-        return self._cancelled
-
-    async def _publish_loop(self):
-        last_timestamp_ns = 0
-        get_data = self._data_source.get_data()
+    def _read_data(self) -> Iterator:
+        if self._partitioning is None:
+            return self._data_source.get_data_blocks()
+        return self._split_blocks(self._partitioning)
+
+    def _split_blocks(self, partitioning: DetectorIdPartitioning) -> Iterator:
+        for block in self._data_source.get_data_blocks():
+            yield None if block is None else partitioning.split_block(block)
+
+    async def _get_pulses(
+        self, reader: DataReader
+    ) -> AsyncGenerator[Tuple[np.ndarray, np.ndarray, int, int], None]:
+        """
+        Yields views of the event data for each pulse, or for each detector id range of each pulse
+        if partitioning is used, with pulse times already mapped to publish times, and the
+        index of the pulse in the run.
+        Ranges without events are skipped, unless the whole pulse has no events.
+        """
+        number_of_ranges = (
+            1 if self._partitioning is None else self._partitioning.number_of_ranges
+        )
+        first_pulse_in_block = 0
+        async for block in reader:
+            if block is None:
+                break
+            pulse_times = self._clock.to_publish_times(block.pulse_times).tolist()
+            offsets = block.event_offsets.tolist()
+            for pulse_number, pulse_time in enumerate(pulse_times):
+                first_range = pulse_number * number_of_ranges
+                end_range = first_range + number_of_ranges
+                pulse_has_events = offsets[first_range] != offsets[end_range]
+                if not pulse_has_events:
+                    # Consumers still get the pulse time of a pulse without events
+                    end_range = first_range + 1
+                for range_number, (start_event, end_event) in enumerate(
+                    zip(
+                        offsets[first_range:end_range],
+                        offsets[first_range + 1 : end_range + 1],
+                    )
+                ):
+                    if start_event == end_event and pulse_has_events:
+                        continue
+                    if (
+                        self._published_ranges is not None
+                        and range_number not in self._published_ranges
+                    ):
+                        continue
+                    yield (
+                        block.time_of_flight[start_event:end_event],
+                        block.detector_id[start_event:end_event],
+                        pulse_time,
+                        first_pulse_in_block + pulse_number,
+                    )
+            first_pulse_in_block += len(pulse_times)
+
+    async def _serialise_messages(
+        self, reader: DataReader
+    ) -> AsyncGenerator[Tuple[bytes, int], None]:
         if self._isis_data_source is not None:
             get_isis_data = self._isis_data_source.get_data()
-        current_run_time_ns = np.iinfo(np.int64).max
         isis_data = None
-        while not self._cancelled:
-            if self._slow_mode:
-                current_run_time_ns = time_ns()
-            while last_timestamp_ns < current_run_time_ns:
-                time_of_flight, detector_id, data_timestamp_ns = next(get_data)
-                if self._isis_data_source is not None:
+        # Index of the pulse isis_data is for, the ISIS data advances once per pulse, not
+        # for each detector id range, and also past pulses whose ranges are not published
+        isis_pulse_index = -1
+        async for (
+            time_of_flight,
+            detector_id,
+            pulse_time_ns,
+            pulse_index,
+        ) in self._get_pulses(reader):
+            if self._isis_data_source is not None:
+                while isis_pulse_index < pulse_index:
                     isis_data = next(get_isis_data)
-                if time_of_flight is not None:
-                    last_timestamp_ns = data_timestamp_ns + self._start_time_delta_ns
-                    payload = serialise_ev42(
-                        self._source_name,
-                        self._message_id,
-                        last_timestamp_ns,
-                        time_of_flight,
-                        detector_id,
-                        isis_specific=isis_data,
-                    )
-                    self._producer.produce(
-                        self._topic,
-                        payload,
-                        last_timestamp_ns,
-                    )
-                    self._message_id += 1
-                else:
-                    self._cancelled = True
-                    break
-            await asyncio.sleep(self._interval)
+                    isis_pulse_index += 1
+            start_time = perf_counter()
+            payload = serialise_ev42(
+                self._source_name,
+                self._message_id,
+                pulse_time_ns,
+                time_of_flight,
+                detector_id,
+                isis_specific=isis_data,
+            )
+            self._serialise_seconds.inc(perf_counter() - start_time)
+            self._message_id += 1
+            yield payload, pulse_time_ns
 
 
 SourceToStream = Union[LogSourceToStream, EventSourceToStream]
@@ -0,0 +1,265 @@
+import asyncio
+import multiprocessing
+import signal
+from functools import partial
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+import h5py
+
+from .application_logger import get_logger, setup_logger
+from .chunk_decompression import create_decompression_pool
+from .create_data_sources_from_nexus import create_event_data_source
+from .detector_partitioning import create_partitioning
+from .isis_data_source import IsisDataSource
+from .merge_scheduler import MergeScheduler
+from .message_sinks import MessageSink, create_sink
+from .metrics import get_metrics, reset_metrics
+from .playback_clock import PlaybackClock
+from .pulse_index_cache import create_pulse_index_cache
+from .source_error import BadSource
+from .source_to_stream import EventSourceToStream, SourceToStream
+
+
+class EventShard(NamedTuple):
+    """
+    Event data published by one worker process
+    :param source_path: path of the NXevent_data group in the file
+    :param ranges: detector id ranges of the source to publish, None to publish all of its events
+    """
+
+    source_path: str
+    ranges: Optional[Tuple[int, ...]] = None
+
+
+class WorkerResult(NamedTuple):
+    """
+    :param metrics: metrics collected by the worker during the run, see Metrics.export
+    :param undelivered: number of messages which were not delivered
+    """
+
+    metrics: Dict[str, List[Tuple[Tuple[str, ...], Any]]]
+    undelivered: int
+
+
+def assign_event_shards(
+    source_sizes: Dict[str, int],
+    number_of_ranges: Dict[str, int],
+    number_of_workers: int,
+) -> List[List[EventShard]]:
+    """
+    Shares event data sources between workers, the largest are given first to the
+    worker with the fewest events. If there are fewer sources than workers, then the
+    detector id ranges of sources which are split by detector id are shared out instead.
+    Every worker given ranges of a source still reads, decompresses and splits all of its
+    events, so this only shares out the serialising and publishing of the source.
+    :param source_sizes: number of events in each source, by path
+    :param number_of_ranges: number of detector id ranges of each source which is split by detector id
+    :return: shards for each worker, some workers have none if there is not enough to share out
+    """
+    split_sources = len(source_sizes) < number_of_workers
+    # (number of events, source path, range number or None for the whole source)
+    units: List[Tuple[float, str, Optional[int]]] = []
+    for source_path, number_of_events in source_sizes.items():
+        ranges_in_source = number_of_ranges.get(source_path, 1)
+        if split_sources and ranges_in_source > 1:
+            units.extend(
+                (number_of_events / ranges_in_source, source_path, range_number)
+                for range_number in range(ranges_in_source)
+            )
+        else:
+            units.append((number_of_events, source_path, None))
+    units.sort(key=lambda unit: unit[0], reverse=True)
+
+    worker_events = [0.0] * number_of_workers
+    whole_sources: List[List[str]] = [[] for _ in range(number_of_workers)]
+    source_ranges: List[Dict[str, List[int]]] = [{} for _ in range(number_of_workers)]
+    for unit_events, source_path, range_number in units:
+        worker = worker_events.index(min(worker_events))
+        worker_events[worker] += unit_events
+        if range_number is None:
+            whole_sources[worker].append(source_path)
+        else:
+            source_ranges[worker].setdefault(source_path, []).append(range_number)
+
+    return [
+        [EventShard(source_path) for source_path in whole_sources[worker]]
+        + [
+            EventShard(source_path, tuple(sorted(ranges)))
+            for source_path, ranges in source_ranges[worker].items()
+        ]
+        for worker in range(number_of_workers)
+    ]
+
+
+def _initialise_worker(args):
+    setup_logger(
+        level=args.verbosity,
+        log_file_name=args.log_file,
+        graylog_logger_address=args.graylog_logger_address,
+    )
+    # Interrupts are handled by the main process, which terminates the workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+async def _publish_shards(
+    producer: MessageSink,
+    args,
+    filename: str,
+    shards: List[EventShard],
+    clock: PlaybackClock,
+    memory_budget_bytes: int,
+):
+    streamers: List[SourceToStream] = []
+    decompression_pool = create_decompression_pool(
+        args.decompression_workers, args.decompression_pool
+    )
+    try:
+        with h5py.File(filename, "r") as nexus_file:
+            isis_data_source = None
+            if args.isis_file:
+                isis_data_source = IsisDataSource(nexus_file)
+            # The main process has already saved pulse times and event index to the cache
+            pulse_index_cache = create_pulse_index_cache(
+                args.pulse_index_cache_dir, filename
+            )
+            for shard in shards:
+                try:
+                    source = create_event_data_source(
+                        nexus_file[shard.source_path],
+                        args.fake_events_per_pulse,
+                        decompression_pool,
+                        memory_budget_bytes,
+                        args.fake_events_distribution,
+                        args.fake_events_poisson,
+                        pulse_index_cache,
+                    )
+                except BadSource:
+                    # Reason for error is logged in source init
+                    continue
+                streamers.append(
+                    EventSourceToStream(
+                        source,
+                        producer,
+                        f"{args.instrument}_events",
+                        clock,
+                        isis_data_source=isis_data_source,
+                        prefetch_depth=args.prefetch_depth,
+                        partitioning=create_partitioning(
+                            nexus_file,
+                            shard.source_path,
+                            args.event_partitions,
+                            args.event_partition_starts,
+                        ),
+                        partition_target=args.event_partition_target,
+                        published_ranges=shard.ranges,
+                    )
+                )
+            scheduler = MergeScheduler(streamers, args.slow, clock.speed)
+            try:
+                await scheduler.run()
+            finally:
+                # Streamers may be reading from the file in background threads,
+                # so they must be stopped before the file is closed
+                scheduler.stop()
+    finally:
+        if decompression_pool is not None:
+            decompression_pool.shutdown()
+
+
+def _publish_shards_in_worker(
+    args,
+    filename: str,
+    shards: List[EventShard],
+    clock: PlaybackClock,
+    memory_budget_bytes: int,
+) -> WorkerResult:
+    """
+    Runs in a worker process, with its own file handle and producer
+    """
+    reset_metrics()
+    # The main process has already created the file of a file sink
+    producer = create_sink(args, append_to_file=True)
+    try:
+        asyncio.run(
+            _publish_shards(
+                producer, args, filename, shards, clock, memory_budget_bytes
+            )
+        )
+    finally:
+        undelivered = producer.close()
+    return WorkerResult(get_metrics().export(), undelivered)
+
+
+def _set_future_result(future: asyncio.Future, result: Any):
+    if not future.done():
+        future.set_result(result)
+
+
+def _set_future_exception(future: asyncio.Future, exception: BaseException):
+    if not future.done():
+        future.set_exception(exception)
+
+
+def _call_in_loop(
+    loop: asyncio.AbstractEventLoop,
+    set_outcome: Callable[[asyncio.Future, Any], None],
+    future: asyncio.Future,
+    outcome: Any,
+):
+    loop.call_soon_threadsafe(set_outcome, future, outcome)
+
+
+class WorkerPool:
+    def __init__(self, number_of_workers: int, args):
+        """
+        Processes which publish event data, started once and used for every run.
+        Processes are spawned rather than forked, as the main process has Kafka and metrics threads.
+        :param args: command line arguments, the same options are used in the workers
+        """
+        self.number_of_workers = number_of_workers
+        self._args = args
+        self._pool = multiprocessing.get_context("spawn").Pool(
+            number_of_workers, _initialise_worker, (args,)
+        )
+
+    async def publish(
+        self,
+        filename: str,
+        shards: List[List[EventShard]],
+        clock: PlaybackClock,
+        memory_budget_bytes: int,
+    ) -> int:
+        """
+        Returns when every worker has published its shards
+        :param filename: file of the run, each worker opens it separately
+        :param shards: shards for each worker, see assign_event_shards
+        :param clock: the same clock as the main process, so that all timestamps agree
+        :return: number of messages which were not delivered
+        """
+        loop = asyncio.get_running_loop()
+        results: List[asyncio.Future] = []
+        for worker_shards in shards:
+            if not worker_shards:
+                continue
+            result = loop.create_future()
+            # Callbacks are called in a thread of the pool
+            self._pool.apply_async(
+                _publish_shards_in_worker,
+                (self._args, filename, worker_shards, clock, memory_budget_bytes),
+                callback=partial(_call_in_loop, loop, _set_future_result, result),
+                error_callback=partial(
+                    _call_in_loop, loop, _set_future_exception, result
+                ),
+            )
+            results.append(result)
+
+        undelivered = 0
+        for worker_result in await asyncio.gather(*results):
+            get_metrics().merge(worker_result.metrics)
+            undelivered += worker_result.undelivered
+        return undelivered
+
+    def close(self):
+        get_logger().info("Stopping worker processes")
+        self._pool.terminate()
+        self._pool.join()
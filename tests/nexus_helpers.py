@@ -0,0 +1,87 @@
+"""
+Helpers shared by the unit tests, which write small NeXus files with h5py
+"""
+from typing import List, Optional, Tuple
+
+import h5py
+import numpy as np
+
+START_TIME = "2021-06-01T12:00:00Z"
+
+
+def create_event_data(
+    parent: h5py.Group,
+    event_id: np.ndarray,
+    event_time_offset: np.ndarray,
+    event_index: np.ndarray,
+    event_time_zero: np.ndarray,
+    name: str = "events",
+    chunk_length: Optional[int] = None,
+    compression: Optional[str] = None,
+) -> h5py.Group:
+    """
+    :param event_time_offset: in nanoseconds
+    :param event_time_zero: in nanoseconds after START_TIME
+    :param chunk_length: None for contiguous event_id and event_time_offset
+    """
+    dataset_options = {}
+    if chunk_length is not None:
+        dataset_options = {"chunks": (chunk_length,), "compression": compression}
+    events = parent.create_group(name)
+    events.attrs["NX_class"] = "NXevent_data"
+    events.create_dataset(
+        "event_id", data=np.asarray(event_id, dtype=np.uint32), **dataset_options
+    )
+    time_offset = events.create_dataset(
+        "event_time_offset",
+        data=np.asarray(event_time_offset, dtype=np.uint32),
+        **dataset_options,
+    )
+    time_offset.attrs["units"] = "ns"
+    events["event_index"] = np.asarray(event_index, dtype=np.uint64)
+    time_zero = events.create_dataset(
+        "event_time_zero", data=np.asarray(event_time_zero, dtype=np.int64)
+    )
+    time_zero.attrs["units"] = "ns"
+    time_zero.attrs["offset"] = START_TIME
+    return events
+
+
+def create_entry(nexus_file: h5py.File) -> h5py.Group:
+    entry = nexus_file.create_group("entry")
+    entry.attrs["NX_class"] = "NXentry"
+    entry["start_time"] = START_TIME
+    return entry
+
+
+class RecordingProducer:
+    """
+    Keeps what would be published to Kafka
+    """
+
+    def __init__(self):
+        self.messages: List[Tuple[str, bytes, Optional[int], Optional[int]]] = []
+
+    def produce(
+        self,
+        topic: str,
+        payload: bytes,
+        timestamp_ns: Optional[int] = None,
+        partition: Optional[int] = None,
+    ):
+        self.messages.append((topic, bytes(payload), timestamp_ns, partition))
+
+    async def produce_when_queue_has_space(
+        self,
+        topic: str,
+        payload: bytes,
+        timestamp_ns: Optional[int] = None,
+        partition: Optional[int] = None,
+    ):
+        self.produce(topic, payload, timestamp_ns, partition)
+
+    def flush(self):
+        pass
+
+    def close(self) -> int:
+        return 0
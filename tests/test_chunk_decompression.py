@@ -0,0 +1,189 @@
+import zlib
+from typing import Iterator
+
+import h5py
+import numpy as np
+import pytest
+
+from nexus_streamer.chunk_decompression import (
+    DecompressionPool,
+    ParallelChunkReader,
+    _unshuffle,
+    can_read_chunks_directly,
+    decode_chunk,
+)
+
+CHUNK_LENGTH = 64
+# Not a multiple of the chunk length, so that the last chunk is short
+DATASET_LENGTH = 1000
+FILL_VALUE = -7
+
+
+@pytest.fixture
+def nexus_file(tmp_path) -> h5py.File:
+    with h5py.File(tmp_path / "chunks.nxs", "w") as nexus_file:
+        yield nexus_file
+
+
+@pytest.fixture
+def decompression_pool() -> Iterator[DecompressionPool]:
+    pool = DecompressionPool(2)
+    yield pool
+    pool.shutdown()
+
+
+def _values(dtype: str) -> np.ndarray:
+    # Large values so that every byte of each item is used
+    return (np.arange(DATASET_LENGTH) * 1_234_567 % 2**31).astype(dtype)
+
+
+def _read_with_pool(
+    dataset: h5py.Dataset, decompression_pool: DecompressionPool
+) -> np.ndarray:
+    reader = ParallelChunkReader(dataset, decompression_pool)
+    try:
+        chunks = list(reader)
+    finally:
+        reader.close()
+    assert all(len(chunk) <= CHUNK_LENGTH for chunk in chunks)
+    return np.concatenate(chunks)
+
+
+def _assert_same_as_h5py(dataset: h5py.Dataset, decompression_pool: DecompressionPool):
+    assert can_read_chunks_directly(dataset)
+    values = _read_with_pool(dataset, decompression_pool)
+    assert values.dtype == dataset.dtype
+    np.testing.assert_array_equal(values, dataset[...])
+
+
+@pytest.mark.parametrize("dtype", ("int32", "float64", "uint16"))
+@pytest.mark.parametrize(
+    "filters",
+    (
+        {},
+        {"compression": "gzip"},
+        {"compression": "gzip", "shuffle": True},
+        {"compression": "gzip", "shuffle": True, "fletcher32": True},
+        {"shuffle": True, "fletcher32": True},
+        {"compression": "lzf"},
+        {"compression": "lzf", "shuffle": True},
+    ),
+)
+def test_decoded_chunks_are_the_same_as_read_by_h5py(
+    nexus_file, decompression_pool, dtype, filters
+):
+    dataset = nexus_file.create_dataset(
+        "values", data=_values(dtype), chunks=(CHUNK_LENGTH,), **filters
+    )
+    _assert_same_as_h5py(dataset, decompression_pool)
+
+
+def test_unwritten_chunks_contain_the_fill_value(nexus_file, decompression_pool):
+    dataset = nexus_file.create_dataset(
+        "values",
+        shape=(DATASET_LENGTH,),
+        dtype="int32",
+        chunks=(CHUNK_LENGTH,),
+        compression="gzip",
+        fillvalue=FILL_VALUE,
+    )
+    # Leaves whole chunks unwritten, including the short last chunk
+    dataset[100:300] = np.arange(200)
+    dataset[600:700] = np.arange(100)
+    values = _read_with_pool(dataset, decompression_pool)
+    assert (values[:64] == FILL_VALUE).all()
+    assert (values[-(DATASET_LENGTH % CHUNK_LENGTH) :] == FILL_VALUE).all()
+    np.testing.assert_array_equal(values, dataset[...])
+
+
+def test_filters_are_undone_in_reverse_of_the_order_they_were_applied(
+    nexus_file, decompression_pool
+):
+    # h5py always shuffles before compressing, so the low level API is used to
+    # create a dataset which shuffles the compressed data
+    create_plist = h5py.h5p.create(h5py.h5p.DATASET_CREATE)
+    create_plist.set_chunk((CHUNK_LENGTH,))
+    create_plist.set_deflate(4)
+    create_plist.set_shuffle()
+    h5py.h5d.create(
+        nexus_file.id,
+        b"values",
+        h5py.h5t.py_create(np.dtype("int32")),
+        h5py.h5s.create_simple((DATASET_LENGTH,)),
+        dcpl=create_plist,
+    )
+    dataset = nexus_file["values"]
+    dataset[...] = _values("int32")
+    _assert_same_as_h5py(dataset, decompression_pool)
+
+
+def test_filters_skipped_by_the_filter_mask_are_not_undone(
+    nexus_file, decompression_pool
+):
+    values = _values("int64")
+    dataset = nexus_file.create_dataset(
+        "values",
+        shape=(DATASET_LENGTH,),
+        dtype="int64",
+        chunks=(CHUNK_LENGTH,),
+        compression="gzip",
+    )
+    for chunk_number, chunk_start in enumerate(range(0, DATASET_LENGTH, CHUNK_LENGTH)):
+        chunk = np.zeros(CHUNK_LENGTH, dtype="int64")
+        chunk_values = values[chunk_start : chunk_start + CHUNK_LENGTH]
+        chunk[: chunk_values.size] = chunk_values
+        if chunk_number % 2:
+            # Bit 0 of the mask means the first filter, deflate, was skipped
+            dataset.id.write_direct_chunk((chunk_start,), chunk.tobytes(), 1)
+        else:
+            dataset.id.write_direct_chunk(
+                (chunk_start,), zlib.compress(chunk.tobytes()), 0
+            )
+    _assert_same_as_h5py(dataset, decompression_pool)
+    np.testing.assert_array_equal(dataset[...], values)
+
+
+def test_shuffle_leaves_remainder_bytes_in_place():
+    values = np.arange(5, dtype=np.int32) * 100_000
+    shuffled = values.view(np.uint8).reshape(-1, 4).T.tobytes()
+    # HDF5 copies bytes after the last whole item without shuffling them
+    assert _unshuffle(shuffled + b"xy", 4) == values.tobytes() + b"xy"
+
+
+def test_decode_chunk_gives_the_requested_number_of_elements():
+    chunk = np.arange(CHUNK_LENGTH, dtype=np.float32)
+    decoded = decode_chunk(
+        zlib.compress(chunk.tobytes()),
+        (h5py.h5z.FILTER_DEFLATE,),
+        0,
+        chunk.dtype.str,
+        CHUNK_LENGTH,
+    )
+    np.testing.assert_array_equal(decoded, chunk)
+
+
+@pytest.mark.parametrize(
+    "options",
+    (
+        {"scaleoffset": 0, "dtype": "int32"},
+        {"compression": "gzip", "scaleoffset": 0, "dtype": "int32"},
+    ),
+)
+def test_chunks_cannot_be_read_directly_with_unsupported_filters(nexus_file, options):
+    dataset = nexus_file.create_dataset(
+        "values", shape=(DATASET_LENGTH,), chunks=(CHUNK_LENGTH,), **options
+    )
+    assert not can_read_chunks_directly(dataset)
+
+
+def test_chunks_cannot_be_read_directly_from_contiguous_or_multidimensional_datasets(
+    nexus_file,
+):
+    assert not can_read_chunks_directly(
+        nexus_file.create_dataset("contiguous", data=np.arange(10))
+    )
+    assert not can_read_chunks_directly(
+        nexus_file.create_dataset(
+            "two_dimensional", data=np.ones((10, 10)), chunks=(5, 5)
+        )
+    )
@@ -0,0 +1,81 @@
+from fractions import Fraction
+
+import numpy as np
+import pytest
+
+from nexus_streamer import convert_units
+from nexus_streamer.convert_units import (
+    convert_to_nanoseconds,
+    microseconds_to_nanoseconds,
+    seconds_to_nanoseconds,
+)
+
+# Times since the unix epoch, which are too large to scale to nanoseconds exactly
+# in a single float64 multiplication
+EPOCH_SECONDS = [1622548800.123, 1622548800.987654, 1622548800.5, -2.25]
+
+
+def _nearest_nanosecond(values, nanoseconds_per_unit: int):
+    """
+    Exact conversion of the float values, rounded to the nearest nanosecond
+    """
+    return [round(Fraction(float(value)) * nanoseconds_per_unit) for value in values]
+
+
+def test_large_float_times_are_converted_to_the_nearest_nanosecond():
+    converted = seconds_to_nanoseconds(np.array(EPOCH_SECONDS))
+    assert converted.dtype == np.int64
+    assert converted.tolist() == _nearest_nanosecond(EPOCH_SECONDS, 1_000_000_000)
+
+
+def test_float_times_in_microseconds_are_converted_to_the_nearest_nanosecond():
+    microseconds = np.array([1622548800123456.7, 70_999.9996, 0.0004])
+    assert microseconds_to_nanoseconds(microseconds).tolist() == _nearest_nanosecond(
+        microseconds, 1_000
+    )
+
+
+def test_integer_times_are_scaled_exactly():
+    seconds = np.array([1622548800, 0, -1], dtype=np.int32)
+    assert seconds_to_nanoseconds(seconds).tolist() == [
+        1622548800_000_000_000,
+        0,
+        -1_000_000_000,
+    ]
+
+
+@pytest.mark.parametrize("value", (1622548800.123, 1622548800))
+def test_scalar_times_are_converted(value):
+    assert (
+        int(seconds_to_nanoseconds(value))
+        == _nearest_nanosecond([value], 1_000_000_000)[0]
+    )
+
+
+@pytest.mark.parametrize("block_length", (2, 3, 65536))
+def test_float_times_are_converted_in_blocks_into_narrower_output(
+    monkeypatch, block_length
+):
+    monkeypatch.setattr(convert_units, "_CONVERSION_BLOCK_LENGTH", block_length)
+    microseconds = np.array(
+        [0.0, 0.0004, 0.0006, 1.5, 70_999.9996, 4_000_000.0], dtype=np.float32
+    )
+    out = np.full(microseconds.size, 7, dtype=np.uint32)
+    converted = convert_to_nanoseconds(microseconds, 1_000, out=out)
+    assert converted is out
+    assert out.tolist() == _nearest_nanosecond(microseconds, 1_000)
+
+
+@pytest.mark.parametrize("nanoseconds_per_unit", (1, 1_000))
+def test_integer_times_are_converted_into_narrower_output(nanoseconds_per_unit):
+    times = np.array([0, 1, 70_000, 4_000_000], dtype=np.int64)
+    out = np.empty(times.size, dtype=np.uint32)
+    convert_to_nanoseconds(times, nanoseconds_per_unit, out=out)
+    assert out.tolist() == (times * nanoseconds_per_unit).tolist()
+
+
+def test_conversion_without_output_array_gives_int64():
+    microseconds = np.array([1622548800123456.7, 1.5])
+    converted = convert_to_nanoseconds(microseconds, 1_000)
+    assert converted.dtype == np.int64
+    assert converted.tolist() == _nearest_nanosecond(microseconds, 1_000)
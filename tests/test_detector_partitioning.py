@@ -0,0 +1,137 @@
+import numpy as np
+import pytest
+
+from nexus_streamer.detector_partitioning import (
+    DetectorIdPartitioning,
+    create_partitioning_from_detector_numbers,
+)
+from nexus_streamer.event_data_source import EventPulseBlock
+
+RANGE_STARTS = [10, 20, 30]
+
+
+def _create_block(
+    detector_id: np.ndarray, event_offsets: np.ndarray, number_of_pulses: int
+) -> EventPulseBlock:
+    # Time-of-flight identifies the position of each event, to check it stays with its id
+    return EventPulseBlock(
+        np.arange(detector_id.size, dtype=np.uint32),
+        detector_id.astype(np.uint32),
+        event_offsets,
+        np.arange(number_of_pulses, dtype=np.int64) * 71_000_000,
+    )
+
+
+def _check_split_block(
+    partitioning: DetectorIdPartitioning,
+    block: EventPulseBlock,
+    split_block: EventPulseBlock,
+):
+    """
+    Events of each range of each pulse are those of the pulse with ids in the range,
+    in their original order
+    """
+    number_of_ranges = partitioning.number_of_ranges
+    assert split_block.event_offsets.size == (
+        block.number_of_pulses * number_of_ranges + 1
+    )
+    np.testing.assert_array_equal(split_block.pulse_times, block.pulse_times)
+    for pulse_number in range(block.number_of_pulses):
+        time_of_flight, detector_id, _ = block.get_pulse(pulse_number)
+        id_range = np.array(
+            [partitioning.get_range(int(event_id)) for event_id in detector_id]
+        )
+        for range_number in range(number_of_ranges):
+            split_range = slice(
+                split_block.event_offsets[
+                    pulse_number * number_of_ranges + range_number
+                ],
+                split_block.event_offsets[
+                    pulse_number * number_of_ranges + range_number + 1
+                ],
+            )
+            in_range = id_range == range_number
+            np.testing.assert_array_equal(
+                split_block.detector_id[split_range], detector_id[in_range]
+            )
+            np.testing.assert_array_equal(
+                split_block.time_of_flight[split_range], time_of_flight[in_range]
+            )
+
+
+def test_events_are_grouped_by_pulse_and_range_in_original_order():
+    partitioning = DetectorIdPartitioning(RANGE_STARTS)
+    detector_id = np.array([35, 1, 12, 10, 29, 31, 5, 20, 11, 12, 40, 19, 30, 9])
+    # The second pulse has no events, the last two have no events in the middle range
+    block = _create_block(detector_id, np.array([0, 9, 9, 11, 14]), 4)
+    split_block = partitioning.split_block(block)
+    _check_split_block(partitioning, block, split_block)
+    np.testing.assert_array_equal(
+        split_block.event_offsets,
+        [0, 5, 7, 9, 9, 9, 9, 10, 10, 11, 13, 13, 14],
+    )
+
+
+def test_events_outside_the_pulses_of_the_block_are_dropped():
+    partitioning = DetectorIdPartitioning(RANGE_STARTS)
+    detector_id = np.array([10, 20, 30, 11, 21, 31, 12])
+    block = _create_block(detector_id, np.array([1, 4, 6]), 2)
+    split_block = partitioning.split_block(block)
+    _check_split_block(partitioning, block, split_block)
+    assert split_block.detector_id.size == 5
+
+
+def test_blocks_with_more_keys_than_fit_in_16_bits_are_split():
+    partitioning = DetectorIdPartitioning(RANGE_STARTS)
+    number_of_pulses = 20_000
+    rng = np.random.default_rng(1)
+    detector_id = rng.integers(0, 40, number_of_pulses * 3)
+    block = _create_block(
+        detector_id, np.arange(number_of_pulses + 1) * 3, number_of_pulses
+    )
+    split_block = partitioning.split_block(block)
+    assert split_block.event_offsets.size == number_of_pulses * len(RANGE_STARTS) + 1
+    for pulse_number in (0, 1, number_of_pulses // 2, number_of_pulses - 1):
+        pulse_ids = detector_id[pulse_number * 3 : pulse_number * 3 + 3]
+        first_range = pulse_number * len(RANGE_STARTS)
+        split_ids = split_block.detector_id[
+            split_block.event_offsets[first_range] : split_block.event_offsets[
+                first_range + len(RANGE_STARTS)
+            ]
+        ]
+        np.testing.assert_array_equal(
+            split_ids,
+            pulse_ids[
+                np.argsort(np.digitize(pulse_ids, RANGE_STARTS[1:]), kind="stable")
+            ],
+        )
+
+
+def test_single_range_keeps_events_in_order():
+    partitioning = DetectorIdPartitioning([1])
+    detector_id = np.array([5, 3, 8, 1])
+    block = _create_block(detector_id, np.array([0, 2, 4]), 2)
+    split_block = partitioning.split_block(block)
+    np.testing.assert_array_equal(split_block.detector_id, detector_id)
+    np.testing.assert_array_equal(split_block.event_offsets, [0, 2, 4])
+
+
+def test_ids_are_in_the_range_which_starts_at_or_below_them():
+    partitioning = DetectorIdPartitioning(RANGE_STARTS)
+    assert [
+        partitioning.get_range(detector_id) for detector_id in (0, 10, 19, 20, 30, 99)
+    ] == [0, 0, 0, 1, 2, 2]
+
+
+@pytest.mark.parametrize("range_starts", ([], [10, 10], [20, 10]))
+def test_invalid_range_starts_are_rejected(range_starts):
+    with pytest.raises(ValueError):
+        DetectorIdPartitioning(range_starts)
+
+
+def test_ranges_from_detector_numbers_have_similar_numbers_of_pixels():
+    partitioning = create_partitioning_from_detector_numbers(np.arange(100, 0, -1), 4)
+    assert partitioning.range_starts == [1, 26, 51, 76]
+    assert create_partitioning_from_detector_numbers(
+        np.array([1, 2]), 4
+    ).range_starts == [1, 2]
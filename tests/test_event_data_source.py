@@ -0,0 +1,237 @@
+from functools import partial
+from typing import List, Sequence, Tuple
+
+import h5py
+import numpy as np
+import pytest
+from nexus_helpers import START_TIME, create_entry, create_event_data
+
+from nexus_streamer import event_data_source
+from nexus_streamer.chunk_decompression import DecompressionPool
+from nexus_streamer.convert_units import iso8601_to_ns_since_epoch
+from nexus_streamer.event_data_source import (
+    DEFAULT_SOURCE_MEMORY_BUDGET_BYTES,
+    EventDataSource,
+    _ChunkDataLoader,
+    _ContiguousDataLoader,
+    _get_event_index,
+    _ParallelChunkDataLoader,
+    _WindowedDataLoader,
+    _WindowedPulseColumn,
+)
+
+# Number of events in each pulse, including pulses without events
+PULSE_SIZES = [0, 1, 5, 2, 7, 0, 3, 11, 4]
+
+
+def _write_events(
+    filename: str, pulse_sizes: Sequence[int], **options
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Event data with ISIS style event_index, which has the start of the pulse after the
+    last one appended
+    :param options: passed to create_event_data, for example chunk_length
+    :return: event ids and the event_index written to the file
+    """
+    event_index = np.concatenate(([0], np.cumsum(pulse_sizes)))
+    number_of_events = int(event_index[-1])
+    event_id = np.arange(number_of_events) + 100
+    with h5py.File(filename, "w") as nexus_file:
+        create_event_data(
+            create_entry(nexus_file),
+            event_id=event_id,
+            event_time_offset=np.arange(number_of_events) * 10,
+            event_index=event_index,
+            event_time_zero=np.arange(len(pulse_sizes)) * 71_000_000,
+            **options,
+        )
+    return event_id, event_index
+
+
+# The last length is all events in a single chunk
+@pytest.mark.parametrize("chunk_length", (1, 3, 4, sum(PULSE_SIZES)))
+def test_chunk_loader_gives_events_of_pulses_which_span_chunks(tmp_path, chunk_length):
+    filename = str(tmp_path / "chunked.nxs")
+    event_id, event_index = _write_events(
+        filename, PULSE_SIZES, chunk_length=chunk_length
+    )
+    with h5py.File(filename, "r") as nexus_file:
+        loader = _ChunkDataLoader(nexus_file["entry/events/event_id"])
+        for start_event, end_event in zip(event_index[:-1], event_index[1:]):
+            np.testing.assert_array_equal(
+                loader.get_data_for_pulse(start_event, end_event),
+                event_id[start_event:end_event],
+            )
+
+
+def _get_pulses(source: EventDataSource, pulses_per_block: int) -> List[np.ndarray]:
+    """
+    Detector ids of each pulse, checking that blocks are consistent
+    """
+    pulses = []
+    blocks = source.get_data_blocks(pulses_per_block)
+    for block in blocks:
+        if block is None:
+            break
+        assert block.event_offsets.size == block.number_of_pulses + 1
+        assert block.time_of_flight.size == block.detector_id.size
+        assert np.all(np.diff(block.event_offsets) >= 0)
+        for pulse_number in range(block.number_of_pulses):
+            pulses.append(block.get_pulse(pulse_number)[1])
+    blocks.close()
+    return pulses
+
+
+@pytest.mark.parametrize("pulses_per_block", (1, 2, 4, len(PULSE_SIZES)))
+def test_blocks_have_the_events_of_each_pulse(tmp_path, pulses_per_block):
+    filename = str(tmp_path / "events.nxs")
+    event_id, event_index = _write_events(filename, PULSE_SIZES, chunk_length=3)
+    with h5py.File(filename, "r") as nexus_file:
+        pulses = _get_pulses(
+            EventDataSource(nexus_file["entry/events"]), pulses_per_block
+        )
+    assert len(pulses) == len(PULSE_SIZES)
+    for pulse, start_event, end_event in zip(pulses, event_index[:-1], event_index[1:]):
+        np.testing.assert_array_equal(pulse, event_id[start_event:end_event])
+
+
+def test_event_offsets_are_clamped_when_event_index_points_past_end_of_data(tmp_path):
+    with h5py.File(tmp_path / "truncated.nxs", "w") as nexus_file:
+        create_event_data(
+            create_entry(nexus_file),
+            event_id=np.arange(10),
+            event_time_offset=np.zeros(10),
+            # The second pulse is cut short and the third has no data at all
+            event_index=np.array([0, 4, 12, 14]),
+            event_time_zero=np.arange(3),
+        )
+    with h5py.File(tmp_path / "truncated.nxs", "r") as nexus_file:
+        source = EventDataSource(nexus_file["entry/events"])
+        block = next(source.get_data_blocks())
+    assert block is not None
+    assert block.number_of_pulses == 3
+    np.testing.assert_array_equal(block.event_offsets, [0, 4, 10, 10])
+    np.testing.assert_array_equal(block.get_pulse(1)[1], np.arange(4, 10))
+    assert block.get_pulse(2)[1].size == 0
+
+
+def _fixed_up_event_index(event_index: np.ndarray, number_of_events: int):
+    """
+    event_index with the last value fixed up as it was when the whole dataset was loaded
+    """
+    if event_index[-1] < number_of_events:
+        return np.append(event_index, number_of_events - 1)
+    event_index = event_index.copy()
+    event_index[-1] = number_of_events
+    return event_index
+
+
+@pytest.fixture(params=(1, 2, 3, 1_000), ids=lambda length: f"window{length}")
+def pulse_window_length(request, monkeypatch) -> int:
+    monkeypatch.setattr(
+        event_data_source,
+        "_WindowedPulseColumn",
+        partial(_WindowedPulseColumn, window_length=request.param),
+    )
+    return request.param
+
+
+@pytest.mark.parametrize("isis_index", (False, True), ids=("ess", "isis"))
+def test_windowed_event_index_has_the_fixed_up_last_value(
+    tmp_path, pulse_window_length, isis_index
+):
+    filename = str(tmp_path / "events.nxs")
+    _, event_index = _write_events(filename, PULSE_SIZES)
+    if not isis_index:
+        event_index = event_index[:-1]
+        with h5py.File(filename, "r+") as nexus_file:
+            del nexus_file["entry/events/event_index"]
+            nexus_file["entry/events/event_index"] = event_index
+    expected = _fixed_up_event_index(event_index, sum(PULSE_SIZES))
+
+    with h5py.File(filename, "r") as nexus_file:
+        column = _get_event_index(nexus_file["entry/events"])
+        assert column.size == expected.size
+        # Overlapping slices, as they are read by get_data_blocks
+        for start in range(expected.size):
+            for end in range(start, expected.size + 2):
+                np.testing.assert_array_equal(column[start:end], expected[start:end])
+        assert [column[index] for index in range(-expected.size, expected.size)] == (
+            expected.tolist() * 2
+        )
+
+
+def test_windowed_pulse_times_and_event_index_give_the_same_blocks(
+    tmp_path, pulse_window_length
+):
+    filename = str(tmp_path / "events.nxs")
+    event_id, event_index = _write_events(filename, PULSE_SIZES, chunk_length=3)
+    with h5py.File(filename, "r") as nexus_file:
+        source = EventDataSource(nexus_file["entry/events"])
+        pulse_times = []
+        pulses: List[np.ndarray] = []
+        for block in source.get_data_blocks(pulses_per_block=2):
+            if block is None:
+                break
+            pulse_times.extend(block.pulse_times.tolist())
+            pulses.extend(
+                block.get_pulse(pulse_number)[1]
+                for pulse_number in range(block.number_of_pulses)
+            )
+        assert source.final_timestamp == pulse_times[-1]
+
+    start_time_ns = iso8601_to_ns_since_epoch(START_TIME)
+    assert pulse_times == [
+        start_time_ns + pulse_number * 71_000_000
+        for pulse_number in range(len(PULSE_SIZES))
+    ]
+    for pulse, start_event, end_event in zip(pulses, event_index[:-1], event_index[1:]):
+        np.testing.assert_array_equal(pulse, event_id[start_event:end_event])
+
+
+@pytest.mark.parametrize(
+    "loader_type",
+    (
+        _ContiguousDataLoader,
+        _WindowedDataLoader,
+        _ChunkDataLoader,
+        _ParallelChunkDataLoader,
+    ),
+)
+def test_reading_again_starts_from_the_first_pulse(tmp_path, loader_type):
+    filename = str(tmp_path / "events.nxs")
+    options = {}
+    if loader_type in (_ChunkDataLoader, _ParallelChunkDataLoader):
+        options = {"chunk_length": 3, "compression": "gzip"}
+    event_id, event_index = _write_events(filename, PULSE_SIZES, **options)
+    expected_pulses = [
+        event_id[start_event:end_event]
+        for start_event, end_event in zip(event_index[:-1], event_index[1:])
+    ]
+    decompression_pool = (
+        DecompressionPool(2) if loader_type is _ParallelChunkDataLoader else None
+    )
+    # Windows of 5 events, smaller than the datasets
+    memory_budget_bytes = (
+        2 * 3 * 4 * 5
+        if loader_type is _WindowedDataLoader
+        else DEFAULT_SOURCE_MEMORY_BUDGET_BYTES
+    )
+    try:
+        with h5py.File(filename, "r") as nexus_file:
+            source = EventDataSource(
+                nexus_file["entry/events"], decompression_pool, memory_budget_bytes
+            )
+            assert type(source._id_loader) is loader_type
+            partial_read = source.get_data_blocks(pulses_per_block=2)
+            next(partial_read)
+            next(partial_read)
+            for _ in range(2):
+                pulses = _get_pulses(source, pulses_per_block=2)
+                assert len(pulses) == len(expected_pulses)
+                for pulse, expected_pulse in zip(pulses, expected_pulses):
+                    np.testing.assert_array_equal(pulse, expected_pulse)
+            partial_read.close()
+    finally:
+        if decompression_pool is not None:
+            decompression_pool.shutdown()
@@ -0,0 +1,287 @@
+import json
+import os
+from collections import OrderedDict
+from typing import List
+
+import h5py
+import numpy as np
+import pytest
+from nexus_helpers import START_TIME, create_entry, create_event_data
+
+from nexus_streamer import generate_json_description
+from nexus_streamer.generate_json_description import NexusToDictConverter, get_json_tree
+
+SPECTRA = np.arange(60).reshape(3, 20)
+
+
+@pytest.fixture
+def nexus_file(tmp_path) -> h5py.File:
+    with h5py.File(tmp_path / "description.nxs", "w") as nexus_file:
+        entry = create_entry(nexus_file)
+        entry["title"] = np.bytes_(b"Test run  ")
+        instrument = entry.create_group("instrument")
+        instrument.attrs["NX_class"] = "NXinstrument"
+        detector = instrument.create_group("detector")
+        detector.attrs["NX_class"] = "NXdetector"
+        detector["detector_number"] = np.arange(1, 5, dtype=np.int32)
+        distance = detector.create_dataset(
+            "distance", data=np.array([1.5, 2.5], dtype=np.float32)
+        )
+        distance.attrs["units"] = "m"
+        detector["counts"] = np.arange(20)
+        detector["spectra"] = SPECTRA
+        create_event_data(
+            detector, np.ones(3), np.zeros(3), np.array([0]), np.array([0])
+        )
+        log = entry.create_group("temperature")
+        log.attrs["NX_class"] = "NXlog"
+        log.attrs["units"] = "K"
+        log["time"] = np.arange(3.0)
+        log["value"] = np.arange(3.0)
+        vms_compat = entry.create_group("isis_vms_compat")
+        vms_compat.attrs["NX_class"] = "IXvms"
+        vms_compat["IRPB"] = np.arange(3)
+    nexus_file = h5py.File(tmp_path / "description.nxs", "r")
+    yield nexus_file
+    nexus_file.close()
+
+
+def _nx_class(nx_class: str) -> list:
+    return [{"name": "NX_class", "values": nx_class}]
+
+
+def _dataset(name: str, dtype: str, values, size=None) -> dict:
+    dataset: dict = {"type": dtype}
+    if size is not None:
+        dataset["size"] = list(size)
+    return {"type": "dataset", "name": name, "dataset": dataset, "values": values}
+
+
+def _expected_tree(counts: list, spectra: list, detector_number: list) -> dict:
+    """
+    The tree which was generated for the test file when it was loaded with nexusformat
+    """
+    distance = _dataset("distance", "float", [1.5, 2.5], (2,))
+    distance["attributes"] = [{"name": "units", "values": "m", "type": "string"}]
+    detector = {
+        "type": "group",
+        "name": "detector",
+        "children": [
+            _dataset("counts", "int64", counts, (20,)),
+            _dataset("detector_number", "int32", detector_number, (4,)),
+            distance,
+            {
+                "type": "group",
+                "name": "events",
+                "children": [
+                    {
+                        "type": "stream",
+                        "stream": {
+                            "writer_module": "ev42",
+                            "topic": "TEST_events",
+                            "source": "NeXus-Streamer",
+                        },
+                    }
+                ],
+                "attributes": _nx_class("NXevent_data"),
+            },
+            _dataset("spectra", "int64", spectra, SPECTRA.shape),
+        ],
+        "attributes": _nx_class("NXdetector"),
+    }
+    temperature = {
+        "type": "group",
+        "name": "temperature",
+        "children": [
+            {
+                "type": "stream",
+                "stream": {
+                    "writer_module": "f142",
+                    "source": "temperature",
+                    "topic": "TEST_sampleEnv",
+                    "dtype": "double",
+                    "unit": "K",
+                },
+            }
+        ],
+        # Other attributes replace the NX_class attribute, as they did with nexusformat
+        "attributes": [{"name": "units", "values": "K", "type": "string"}],
+    }
+    return {
+        "children": [
+            {
+                "type": "group",
+                "name": "entry",
+                "children": [
+                    {
+                        "type": "group",
+                        "name": "instrument",
+                        "children": [detector],
+                        "attributes": _nx_class("NXinstrument"),
+                    },
+                    # Children of ISIS specific groups are left out
+                    {
+                        "type": "group",
+                        "name": "isis_vms_compat",
+                        "children": [],
+                        "attributes": _nx_class("IXvms"),
+                    },
+                    _dataset("start_time", "string", START_TIME),
+                    temperature,
+                    # Fixed length strings are stripped
+                    _dataset("title", "string", "Test run"),
+                ],
+                "attributes": _nx_class("NXentry"),
+            }
+        ]
+    }
+
+
+def _convert(nexus_file: h5py.File, **options) -> dict:
+    tree = NexusToDictConverter(
+        event_data_topic="TEST_events", log_data_topic="TEST_sampleEnv", **options
+    ).convert(nexus_file)
+    # Compared as it is published, for example with tuples as lists
+    return json.loads(json.dumps(tree))
+
+
+def test_tree_is_the_same_as_generated_with_nexusformat(nexus_file):
+    assert _convert(nexus_file) == _expected_tree(
+        counts=list(range(10)),
+        spectra=SPECTRA.tolist(),
+        detector_number=[1, 2, 3, 4],
+    )
+
+
+def test_large_datasets_are_truncated_to_their_first_elements(nexus_file):
+    assert _convert(nexus_file, truncate_large_datasets=True) == _expected_tree(
+        counts=list(range(10)),
+        spectra=np.arange(30).reshape(3, 10).tolist(),
+        detector_number=[1, 2, 3, 4],
+    )
+    assert _convert(nexus_file, truncate_large_datasets=True, large=2) == (
+        _expected_tree(
+            counts=[0, 1],
+            spectra=[[0, 1], [2, 3]],
+            detector_number=[1, 2],
+        )
+    )
+
+
+@pytest.fixture
+def generated_files(monkeypatch) -> List[str]:
+    """
+    Empties the in-memory cache of JSON trees and records the file each time
+    a tree is generated
+    """
+    monkeypatch.setattr(generate_json_description, "_json_tree_cache", OrderedDict())
+    generated: List[str] = []
+    generate = generate_json_description.nexus_file_to_json_tree
+
+    def record_generated(filename: str, *args, **kwargs) -> dict:
+        generated.append(filename)
+        return generate(filename, *args, **kwargs)
+
+    monkeypatch.setattr(
+        generate_json_description, "nexus_file_to_json_tree", record_generated
+    )
+    return generated
+
+
+def _write_file(filename: str, title: str = "Test run"):
+    with h5py.File(filename, "w") as nexus_file:
+        entry = create_entry(nexus_file)
+        entry["title"] = title
+        entry["detector_number"] = np.arange(100)
+
+
+def _get_tree(filename: str, **options) -> dict:
+    return get_json_tree(filename, "TEST_events", "TEST_sampleEnv", **options)
+
+
+def _title(tree: dict) -> str:
+    (entry,) = tree["children"]
+    return next(
+        child["values"] for child in entry["children"] if child["name"] == "title"
+    )
+
+
+def test_cached_tree_is_reused_for_an_unchanged_file(tmp_path, generated_files):
+    filename = str(tmp_path / "run.nxs")
+    _write_file(filename)
+    tree = _get_tree(filename)
+    assert _get_tree(filename) is tree
+    assert generated_files == [filename]
+
+
+def test_tree_is_generated_again_when_the_file_changes(tmp_path, generated_files):
+    filename = str(tmp_path / "run.nxs")
+    _write_file(filename)
+    assert _title(_get_tree(filename)) == "Test run"
+    _write_file(filename, "Another run with a longer title")
+    assert _title(_get_tree(filename)) == "Another run with a longer title"
+    assert generated_files == [filename, filename]
+
+
+def test_tree_is_generated_again_when_only_the_modification_time_changes(
+    tmp_path, generated_files
+):
+    filename = str(tmp_path / "run.nxs")
+    _write_file(filename)
+    _get_tree(filename)
+    file_status = os.stat(filename)
+    os.utime(filename, ns=(file_status.st_atime_ns, file_status.st_mtime_ns + 1000))
+    _get_tree(filename)
+    assert generated_files == [filename, filename]
+
+
+def test_tree_is_generated_again_when_the_description_limit_changes(
+    tmp_path, generated_files
+):
+    filename = str(tmp_path / "run.nxs")
+    _write_file(filename)
+    full_tree = _get_tree(filename)
+    truncated_tree = _get_tree(filename, max_description_bytes=100)
+    assert truncated_tree != full_tree
+    assert _get_tree(filename, max_description_bytes=100) is truncated_tree
+    assert _get_tree(filename) is full_tree
+    assert generated_files == [filename, filename]
+
+
+def test_least_recently_used_tree_is_dropped_from_memory(
+    monkeypatch, tmp_path, generated_files
+):
+    monkeypatch.setattr(generate_json_description, "_MAX_CACHED_JSON_TREES", 2)
+    filenames = [str(tmp_path / f"run_{number}.nxs") for number in range(3)]
+    for filename in filenames:
+        _write_file(filename)
+    _get_tree(filenames[0])
+    _get_tree(filenames[1])
+    _get_tree(filenames[0])
+    # Drops the tree of run_1, which was used less recently than run_0
+    _get_tree(filenames[2])
+    _get_tree(filenames[0])
+    _get_tree(filenames[1])
+    assert generated_files == [filenames[0], filenames[1], filenames[2], filenames[1]]
+
+
+def test_tree_cached_in_a_file_is_reused_after_a_restart(tmp_path, generated_files):
+    filename = str(tmp_path / "run.nxs")
+    cache_directory = str(tmp_path / "cache")
+    _write_file(filename)
+    tree = _get_tree(filename, cache_directory=cache_directory)
+    (cache_filename,) = os.listdir(cache_directory)
+    assert cache_filename.startswith("run.nxs.")
+
+    # As if the streamer was restarted
+    generate_json_description._json_tree_cache.clear()
+    # Tuples in the tree are lists after it is loaded from the file
+    assert _get_tree(filename, cache_directory=cache_directory) == json.loads(
+        json.dumps(tree)
+    )
+    assert generated_files == [filename]
+
+    generate_json_description._json_tree_cache.clear()
+    _write_file(filename, "Another run")
+    assert _title(_get_tree(filename, cache_directory=cache_directory)) == "Another run"
+    assert generated_files == [filename, filename]
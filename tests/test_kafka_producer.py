@@ -0,0 +1,160 @@
+import asyncio
+import time
+from argparse import Namespace
+from threading import Lock
+from typing import List, Optional, Tuple
+
+import pytest
+
+from nexus_streamer import kafka_producer
+from nexus_streamer.kafka_producer import KafkaProducer, create_producer_config
+from nexus_streamer.metrics import get_metrics, reset_metrics
+
+TOPIC = "TEST_events"
+
+
+class _StubMessage:
+    def __init__(self, topic: str):
+        self._topic = topic
+
+    def topic(self) -> str:
+        return self._topic
+
+
+class _StubProducer:
+    # Set by each test before a KafkaProducer is created
+    queue_full_count = 0
+    delivery_errors: List[Optional[str]] = []
+    not_flushed = 0
+    instances: List["_StubProducer"] = []
+
+    def __init__(self, configs: dict):
+        """
+        Raises BufferError for the first queue_full_count calls to produce, then accepts
+        messages and reports delivery with the next of delivery_errors when polled
+        """
+        self.configs = configs
+        self.produce_calls = 0
+        self.produced: List[Tuple[str, bytes, dict]] = []
+        self._lock = Lock()
+        self._pending: List = []
+        self._queue_full_remaining = self.queue_full_count
+        self._delivery_errors = list(self.delivery_errors)
+        self.instances.append(self)
+
+    def produce(self, topic: str, payload: bytes, on_delivery, **options):
+        self.produce_calls += 1
+        if self._queue_full_remaining > 0:
+            self._queue_full_remaining -= 1
+            raise BufferError("Local: Queue full")
+        assert isinstance(payload, bytes)
+        self.produced.append((topic, payload, options))
+        with self._lock:
+            self._pending.append((on_delivery, topic))
+
+    def poll(self, timeout: float):
+        with self._lock:
+            pending, self._pending = self._pending, []
+        for on_delivery, topic in pending:
+            error = self._delivery_errors.pop(0) if self._delivery_errors else None
+            on_delivery(error, _StubMessage(topic))
+        if not pending:
+            time.sleep(min(timeout, 0.001))
+        return len(pending)
+
+    def flush(self, timeout: float) -> int:
+        self.poll(0)
+        return self.not_flushed
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+
+@pytest.fixture
+def stub_producer(monkeypatch):
+    reset_metrics()
+    monkeypatch.setattr(_StubProducer, "instances", [])
+    monkeypatch.setattr(kafka_producer.confluent_kafka, "Producer", _StubProducer)
+    return _StubProducer
+
+
+def _queue_full_waits() -> float:
+    return dict(get_metrics().producer_queue_full_waits.export()).get((), 0)
+
+
+@pytest.mark.parametrize("queue_full_count", (0, 1, 3))
+def test_message_is_produced_once_when_queue_has_space(
+    monkeypatch, stub_producer, queue_full_count
+):
+    monkeypatch.setattr(stub_producer, "queue_full_count", queue_full_count)
+    producer = KafkaProducer({"bootstrap.servers": "localhost:9092"})
+    try:
+        asyncio.run(
+            producer.produce_when_queue_has_space(
+                TOPIC, memoryview(b"message"), timestamp_ns=1_500_000_000, partition=2
+            )
+        )
+    finally:
+        assert producer.close() == 0
+
+    (stub,) = stub_producer.instances
+    assert stub.produce_calls == queue_full_count + 1
+    assert stub.produced == [(TOPIC, b"message", {"timestamp": 1500, "partition": 2})]
+    assert _queue_full_waits() == queue_full_count
+
+
+def test_blocking_produce_retries_until_queue_has_space(monkeypatch, stub_producer):
+    monkeypatch.setattr(stub_producer, "queue_full_count", 2)
+    producer = KafkaProducer({})
+    try:
+        producer.produce(TOPIC, b"message")
+    finally:
+        producer.close()
+
+    (stub,) = stub_producer.instances
+    assert stub.produced == [(TOPIC, b"message", {})]
+    assert _queue_full_waits() == 2
+
+
+def test_close_returns_messages_not_flushed_and_failed_deliveries(
+    monkeypatch, stub_producer
+):
+    monkeypatch.setattr(stub_producer, "delivery_errors", ["broker down", None, "lost"])
+    monkeypatch.setattr(stub_producer, "not_flushed", 4)
+    producer = KafkaProducer({})
+    for _ in range(3):
+        producer.produce(TOPIC, b"message")
+    assert producer.close() == 4 + 2
+    assert producer.failed_deliveries == 2
+
+
+def test_producer_config_only_has_kafka_options_which_were_set():
+    args = Namespace(
+        broker="localhost:9092",
+        kafka_linger_ms=5,
+        kafka_batch_num_messages=None,
+        kafka_queue_max_messages=None,
+        kafka_queue_max_kbytes=2048,
+        kafka_compression=None,
+    )
+    assert create_producer_config(args) == {
+        "bootstrap.servers": "localhost:9092",
+        "message.max.bytes": 200000000,
+        "linger.ms": 5,
+        "queue.buffering.max.kbytes": 2048,
+    }
+
+
+def test_producer_config_has_no_kafka_options_when_none_were_set():
+    args = Namespace(
+        broker="localhost:9092",
+        kafka_linger_ms=None,
+        kafka_batch_num_messages=None,
+        kafka_queue_max_messages=None,
+        kafka_queue_max_kbytes=None,
+        kafka_compression=None,
+    )
+    assert create_producer_config(args) == {
+        "bootstrap.servers": "localhost:9092",
+        "message.max.bytes": 200000000,
+    }
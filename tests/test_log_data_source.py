@@ -0,0 +1,81 @@
+import h5py
+import numpy as np
+import pytest
+from nexus_helpers import START_TIME, create_entry
+
+from nexus_streamer.convert_units import iso8601_to_ns_since_epoch
+from nexus_streamer.log_data_source import LogDataSource
+
+NUMBER_OF_SAMPLES = 50
+
+
+def _create_log(
+    parent: h5py.Group, name: str, times: np.ndarray, values: np.ndarray
+) -> h5py.Group:
+    log = parent.create_group(name)
+    log.attrs["NX_class"] = "NXlog"
+    # Time and value datasets with different chunk sizes
+    time = log.create_dataset("time", data=times, chunks=(7,))
+    time.attrs["units"] = "s"
+    time.attrs["start"] = START_TIME
+    log.create_dataset("value", data=values, chunks=(4,) + values.shape[1:])
+    return log
+
+
+@pytest.fixture
+def log_file(tmp_path) -> h5py.File:
+    with h5py.File(tmp_path / "logs.nxs", "w") as nexus_file:
+        entry = create_entry(nexus_file)
+        _create_log(
+            entry,
+            "temperature",
+            np.arange(NUMBER_OF_SAMPLES) * 0.5,
+            np.arange(NUMBER_OF_SAMPLES, dtype=np.float64) + 300.0,
+        )
+        _create_log(
+            entry,
+            "spectrum",
+            np.arange(NUMBER_OF_SAMPLES) * 0.5,
+            np.arange(NUMBER_OF_SAMPLES * 3, dtype=np.int32).reshape(-1, 3),
+        )
+        # One more time than there are values
+        _create_log(
+            entry,
+            "pressure",
+            np.arange(NUMBER_OF_SAMPLES + 1) * 0.5,
+            np.ones(NUMBER_OF_SAMPLES),
+        )
+    nexus_file = h5py.File(tmp_path / "logs.nxs", "r")
+    yield nexus_file
+    nexus_file.close()
+
+
+@pytest.mark.parametrize("log_name", ("temperature", "spectrum", "pressure"))
+@pytest.mark.parametrize("max_block_bytes", (1, 24, 100, 1_000_000))
+def test_blocks_have_every_sample_of_the_log(log_file, log_name, max_block_bytes):
+    source = LogDataSource(log_file[f"entry/{log_name}"])
+    blocks = list(source.get_data_blocks(max_block_bytes))
+
+    for values, times_ns in blocks:
+        assert len(values) == times_ns.size
+        assert values.nbytes <= max_block_bytes or len(values) == 1
+    values = np.concatenate([values for values, _ in blocks])
+    times_ns = np.concatenate([times_ns for _, times_ns in blocks])
+    np.testing.assert_array_equal(
+        values, log_file[f"entry/{log_name}/value"][:NUMBER_OF_SAMPLES]
+    )
+    np.testing.assert_array_equal(
+        times_ns,
+        np.arange(NUMBER_OF_SAMPLES) * 500_000_000
+        + iso8601_to_ns_since_epoch(START_TIME),
+    )
+
+
+def test_get_data_yields_each_sample_then_none(log_file):
+    source = LogDataSource(log_file["entry/temperature"])
+    samples = list(source.get_data())
+    assert samples[-1] == (None, 0)
+    assert [value for value, _ in samples[:-1]] == list(
+        np.arange(NUMBER_OF_SAMPLES) + 300.0
+    )
+    assert source.final_timestamp == samples[-2][1]
@@ -0,0 +1,115 @@
+import asyncio
+from typing import List, Sequence, Tuple
+
+from nexus_streamer import merge_scheduler
+from nexus_streamer.merge_scheduler import MergeScheduler
+
+
+class _StubStreamer:
+    def __init__(
+        self,
+        number: int,
+        timestamps: Sequence[int],
+        published: List[Tuple[int, int]],
+    ):
+        """
+        Yields a message for each timestamp, and records the streamer number and
+        timestamp of each message it publishes
+        """
+        self._number = number
+        self._timestamps = timestamps
+        self._published = published
+        self.stopped = False
+
+    async def get_messages(self):
+        for timestamp_ns in self._timestamps:
+            yield b"payload", timestamp_ns
+
+    async def publish(self, payload: bytes, timestamp_ns: int):
+        self._published.append((self._number, timestamp_ns))
+
+    def stop(self):
+        self.stopped = True
+
+
+def _run(
+    source_timestamps: Sequence[Sequence[int]], slow_mode: bool = False
+) -> Tuple[List[Tuple[int, int]], List[_StubStreamer]]:
+    """
+    :return: (streamer number, timestamp) of each published message, in order, and the streamers
+    """
+    published: List[Tuple[int, int]] = []
+    streamers = [
+        _StubStreamer(number, timestamps, published)
+        for number, timestamps in enumerate(source_timestamps)
+    ]
+    scheduler = MergeScheduler(streamers, slow_mode=slow_mode)  # type: ignore
+    try:
+        asyncio.run(scheduler.run())
+    finally:
+        scheduler.stop()
+    return published, streamers
+
+
+def test_messages_from_all_sources_are_published_in_timestamp_order():
+    published, streamers = _run([[1, 4, 7, 8], [2, 3, 9], [5, 6]])
+    assert published == [
+        (0, 1),
+        (1, 2),
+        (1, 3),
+        (0, 4),
+        (2, 5),
+        (2, 6),
+        (0, 7),
+        (0, 8),
+        (1, 9),
+    ]
+    assert all(streamer.stopped for streamer in streamers)
+
+
+def test_messages_with_equal_timestamps_are_published_lowest_streamer_first():
+    published, _ = _run([[5, 5, 10], [0, 5, 10], [5]])
+    assert published == [(1, 0), (0, 5), (0, 5), (1, 5), (2, 5), (0, 10), (1, 10)]
+
+
+def test_exhausted_sources_drop_out_of_the_merge():
+    published, _ = _run([[], [1, 2, 3, 4], [2], []])
+    assert published == [(1, 1), (1, 2), (2, 2), (1, 3), (1, 4)]
+
+
+def test_no_sources_publishes_nothing():
+    published, _ = _run([])
+    assert published == []
+
+
+def test_slow_mode_publishes_each_message_when_the_clock_reaches_its_timestamp(
+    monkeypatch,
+):
+    clock_ns = [1_000]
+    sleeps_ns: List[int] = []
+
+    def fake_time_ns() -> int:
+        return clock_ns[0]
+
+    async def fake_sleep(seconds: float):
+        sleeps_ns.append(round(seconds * 1e9))
+        clock_ns[0] += round(seconds * 1e9)
+
+    monkeypatch.setattr(merge_scheduler, "time_ns", fake_time_ns)
+    monkeypatch.setattr(merge_scheduler.asyncio, "sleep", fake_sleep)
+
+    publish_times_ns: List[int] = []
+    original_publish = _StubStreamer.publish
+
+    async def publish(self, payload: bytes, timestamp_ns: int):
+        publish_times_ns.append(clock_ns[0])
+        await original_publish(self, payload, timestamp_ns)
+
+    monkeypatch.setattr(_StubStreamer, "publish", publish)
+
+    # The first message is already due when publishing starts
+    published, _ = _run([[500, 3_000, 9_000], [2_000, 3_000]], slow_mode=True)
+    assert published == [(0, 500), (1, 2_000), (0, 3_000), (1, 3_000), (0, 9_000)]
+    assert publish_times_ns == [1_000, 2_000, 3_000, 3_000, 9_000]
+    # Sleeps only for messages which are not yet due
+    assert sleeps_ns == [1_000, 1_000, 6_000]
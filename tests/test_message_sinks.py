@@ -0,0 +1,122 @@
+import socket
+from typing import List, Optional, Tuple
+
+import numpy as np
+import pytest
+
+from nexus_streamer.message_sinks import (
+    FileSink,
+    NullSink,
+    SocketSink,
+    read_message_file,
+)
+
+# Topics and payloads of different lengths, so that each needs different padding,
+# with and without a partition and timestamp
+Message = Tuple[str, Optional[int], Optional[int], bytes]
+MESSAGES: List[Message] = [
+    ("TEST_runInfo", None, 1_622_548_800_000_000_000, b"run start"),
+    ("T", 0, None, b"\x01"),
+    ("TEST_events_12", 11, 2**62, bytes(range(256)) * 3),
+    ("TEST_sampleEnv", None, None, b""),
+    ("TEST_events", -1, -1, b"12345678"),
+]
+
+
+def _read_messages(filename: str) -> List[Message]:
+    messages = []
+    for topic, partition, timestamp_ns, payload in read_message_file(filename):
+        # Payloads are views of the memory-mapped file, which is page aligned
+        assert np.frombuffer(payload, dtype=np.uint8).ctypes.data % 8 == 0
+        messages.append((topic, partition, timestamp_ns, bytes(payload)))
+    return messages
+
+
+def _produce(sink, messages: List[Message]):
+    for topic, partition, timestamp_ns, payload in messages:
+        sink.produce(topic, payload, timestamp_ns, partition)
+
+
+@pytest.mark.parametrize("write_batch_bytes", (0, 100, 1_000_000))
+def test_messages_written_to_file_are_read_back(tmp_path, write_batch_bytes):
+    filename = str(tmp_path / "messages.bin")
+    sink = FileSink(filename, write_batch_bytes=write_batch_bytes)
+    _produce(sink, MESSAGES[:2])
+    # Payloads are published as bytes, or as views of cached payloads
+    sink.produce("TEST_events", memoryview(b"view of payload"), 3, 1)
+    _produce(sink, MESSAGES[2:])
+    assert sink.close() == 0
+
+    assert _read_messages(filename) == (
+        MESSAGES[:2]
+        + [("TEST_events", 1, 3, b"view of payload")]
+        + MESSAGES[2:4]
+        # -1 means no partition or timestamp in the file, so is read as None
+        + [("TEST_events", None, None, b"12345678")]
+    )
+
+
+def test_flushed_messages_are_in_the_file(tmp_path):
+    filename = str(tmp_path / "messages.bin")
+    sink = FileSink(filename)
+    _produce(sink, MESSAGES[:1])
+    sink.flush()
+    assert _read_messages(filename) == MESSAGES[:1]
+    _produce(sink, MESSAGES[1:3])
+    sink.close()
+    assert _read_messages(filename) == MESSAGES[:3]
+
+
+def test_messages_are_appended_to_file(tmp_path):
+    filename = str(tmp_path / "messages.bin")
+    sink = FileSink(filename)
+    _produce(sink, MESSAGES[:1])
+    sink.flush()
+    append_sink = FileSink(filename, append=True, write_batch_bytes=0)
+    _produce(append_sink, MESSAGES[1:3])
+    append_sink.close()
+    sink.close()
+    assert _read_messages(filename) == MESSAGES[:3]
+
+
+def test_file_which_is_not_a_message_file_is_rejected(tmp_path):
+    filename = str(tmp_path / "messages.bin")
+    with open(filename, "wb") as message_file:
+        message_file.write(b"NXSMSGS\0\x02\0\0\0\0\0\0\0")
+    with pytest.raises(ValueError):
+        list(read_message_file(filename))
+
+
+def test_empty_file_has_no_messages(tmp_path):
+    filename = str(tmp_path / "messages.bin")
+    open(filename, "wb").close()
+    assert list(read_message_file(filename)) == []
+
+
+def test_messages_sent_to_socket_are_in_file_format(tmp_path):
+    address = str(tmp_path / "sink.sock")
+    filename = str(tmp_path / "messages.bin")
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as server:
+        server.bind(address)
+        server.listen(1)
+        sink = SocketSink(address)
+        connection, _ = server.accept()
+        _produce(sink, MESSAGES[:3])
+        sink.close()
+        # The socket stream is a message file without the file header
+        FileSink(filename).close()
+        with connection, open(filename, "ab") as message_file:
+            while True:
+                received = connection.recv(65536)
+                if not received:
+                    break
+                message_file.write(received)
+    assert _read_messages(filename) == MESSAGES[:3]
+
+
+def test_null_sink_counts_messages():
+    sink = NullSink()
+    _produce(sink, MESSAGES)
+    assert sink.number_of_messages == len(MESSAGES)
+    assert sink.number_of_bytes == sum(len(payload) for *_, payload in MESSAGES)
+    assert sink.close() == 0
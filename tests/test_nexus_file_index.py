@@ -0,0 +1,132 @@
+from typing import Dict, List
+
+import h5py
+import numpy as np
+import pytest
+from nexus_helpers import START_TIME, create_entry, create_event_data
+
+from nexus_streamer.nexus_file_index import DatasetInfo, NexusFileIndex
+
+
+@pytest.fixture
+def nexus_file(tmp_path) -> h5py.File:
+    with h5py.File(tmp_path / "index.nxs", "w") as nexus_file:
+        entry = create_entry(nexus_file)
+        create_event_data(
+            entry,
+            event_id=np.arange(30) % 4,
+            event_time_offset=np.arange(30),
+            event_index=np.array([0, 10, 20]),
+            event_time_zero=np.array([0, 71_000_000, 142_000_000]),
+            chunk_length=8,
+            compression="gzip",
+        )
+        instrument = entry.create_group("instrument")
+        instrument.attrs["NX_class"] = np.bytes_(b"NXinstrument")
+        detector = instrument.create_group("detector_1")
+        # NX_class stored as a fixed length string in a one element array
+        detector.attrs["NX_class"] = np.array([b"NXdetector"])
+        detector["detector_number"] = np.arange(1, 5, dtype=np.int32)
+        create_event_data(
+            detector,
+            event_id=np.ones(4),
+            event_time_offset=np.zeros(4),
+            event_index=np.array([0, 2]),
+            event_time_zero=np.array([0, 71_000_000]),
+            chunk_length=2,
+            compression="lzf",
+        )
+        log = entry.create_group("temperature")
+        log.attrs["NX_class"] = "NXlog"
+        log.attrs["units"] = "K"
+        time = log.create_dataset("time", data=np.arange(3.0), chunks=(2,))
+        time.attrs["units"] = np.bytes_(b"s")
+        time.attrs["start"] = START_TIME
+        log.create_dataset("value", data=np.arange(3, dtype=np.float32))
+        # Groups without an NX_class, or with other attributes
+        entry.create_group("plain_group").attrs["description"] = "no NX_class"
+        entry.create_group("empty_group")["scalar"] = 1.5
+        entry["title"] = np.bytes_(b"Index test  ")
+        # Links are not followed, as by visititems
+        entry["detector_link"] = h5py.SoftLink("/entry/instrument/detector_1")
+        entry["hard_link"] = detector["detector_number"]
+        entry["external"] = h5py.ExternalLink("missing.nxs", "/entry")
+        second_entry = nexus_file.create_group("entry_2")
+        second_entry.attrs["NX_class"] = "NXentry"
+        second_entry["start_time"] = h5py.SoftLink("/entry/start_time")
+    nexus_file = h5py.File(tmp_path / "index.nxs", "r")
+    yield nexus_file
+    nexus_file.close()
+
+
+def _decode(value) -> str:
+    if isinstance(value, np.ndarray):
+        value = value.item()
+    if isinstance(value, bytes):
+        return value.decode("utf8")
+    return str(value)
+
+
+def _walk(nexus_file: h5py.File):
+    """
+    NX_class of each group and info of each dataset, found with visititems
+    """
+    nx_classes: Dict[str, str] = {}
+    dataset_info: Dict[str, DatasetInfo] = {}
+
+    def visit(name: str, h5_object):
+        path = f"/{name}"
+        if isinstance(h5_object, h5py.Group):
+            if "NX_class" in h5_object.attrs:
+                nx_classes[path] = _decode(h5_object.attrs["NX_class"])
+        else:
+            units = h5_object.attrs.get("units")
+            dataset_info[path] = DatasetInfo(
+                h5_object.shape,
+                h5_object.dtype,
+                h5_object.chunks,
+                h5_object.compression,
+                None if units is None else _decode(units),
+            )
+
+    nexus_file.visititems(visit)
+    return nx_classes, dataset_info
+
+
+def test_index_finds_the_same_groups_as_visititems(nexus_file):
+    nx_classes, _ = _walk(nexus_file)
+    index = NexusFileIndex(nexus_file)
+    assert index.nx_classes == nx_classes
+    assert list(index.nx_classes) == list(nx_classes)
+
+    groups_by_nx_class: Dict[str, List[str]] = {}
+    for path, nx_class in nx_classes.items():
+        groups_by_nx_class.setdefault(nx_class, []).append(path)
+    for nx_class, paths in groups_by_nx_class.items():
+        assert index.get_group_paths(nx_class) == paths
+        assert [group.name for group in index.get_groups(nx_class)] == paths
+    assert index.get_group_paths("NXmissing") == []
+
+
+def test_index_finds_the_same_datasets_as_visititems(nexus_file):
+    _, dataset_info = _walk(nexus_file)
+    index = NexusFileIndex(nexus_file)
+    assert index.dataset_paths == list(dataset_info)
+    for path, info in dataset_info.items():
+        assert index.get_dataset_info(path) == info
+    # Checks that the test file has the variety of datasets intended
+    assert {info.compression for info in dataset_info.values()} == {
+        None,
+        "gzip",
+        "lzf",
+    }
+    assert {info.units for info in dataset_info.values()} >= {None, "ns", "s"}
+
+
+def test_start_time_of_each_entry_is_found(nexus_file):
+    index = NexusFileIndex(nexus_file)
+    # Found through the soft link in entry_2, under the path of the link
+    assert index.start_times == {
+        "/entry/start_time": START_TIME,
+        "/entry_2/start_time": START_TIME,
+    }
@@ -0,0 +1,50 @@
+import os
+
+import pytest
+from streaming_data_types.logdata_f142 import deserialise_f142, serialise_f142
+
+from nexus_streamer.payload_cache import F142_TIMESTAMP_VTABLE_SLOT, PayloadCache
+
+TIMESTAMPS_NS = [1_000, 2_000, 3_000]
+
+
+def _record(cache: PayloadCache, start_time_delta_ns: int):
+    source_cache = cache.get_source_cache("log")
+    source_cache.start_recording(start_time_delta_ns)
+    for value, timestamp_ns in enumerate(TIMESTAMPS_NS):
+        source_cache.record(
+            serialise_f142(float(value), "log", timestamp_ns),
+            timestamp_ns,
+            F142_TIMESTAMP_VTABLE_SLOT,
+        )
+    return source_cache
+
+
+@pytest.mark.parametrize("spill", (False, True), ids=("memory", "file"))
+def test_replay_moves_timestamps_to_new_start_time(tmp_path, spill):
+    cache = PayloadCache(None, str(tmp_path / "spill") if spill else None)
+    source_cache = _record(cache, 0)
+    source_cache.finish_recording()
+
+    for start_time_delta_ns in (500, 700):
+        replayed = [
+            (deserialise_f142(bytes(payload)), timestamp_ns)
+            for payload, timestamp_ns in source_cache.replay(start_time_delta_ns)
+        ]
+        assert [timestamp_ns for _, timestamp_ns in replayed] == [
+            timestamp_ns + start_time_delta_ns for timestamp_ns in TIMESTAMPS_NS
+        ]
+        assert [message.timestamp_unix_ns for message, _ in replayed] == [
+            timestamp_ns for _, timestamp_ns in replayed
+        ]
+        assert [message.value for message, _ in replayed] == [0.0, 1.0, 2.0]
+    cache.close()
+
+
+def test_interrupted_recording_is_removed_from_spill_file(tmp_path):
+    spill_filename = str(tmp_path / "spill")
+    cache = PayloadCache(None, spill_filename)
+    _record(cache, 0)
+    cache.get_source_cache("log").start_recording(0)
+    cache.close()
+    assert os.path.getsize(spill_filename) == 0
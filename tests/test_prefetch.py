@@ -0,0 +1,100 @@
+import asyncio
+import time
+from typing import Callable, Iterator
+
+import pytest
+
+from nexus_streamer.prefetch import Prefetcher, create_reader
+
+# Longest time to wait for the worker thread to reach a state
+_TIMEOUT_S = 5.0
+# Time the worker thread is given to read further than it should
+_SETTLE_S = 0.2
+
+
+class _CountingIterator:
+    def __init__(self, number_of_items: int = -1):
+        """
+        Counts the items which have been read from it
+        :param number_of_items: -1 for no end
+        """
+        self.number_read = 0
+        self._number_of_items = number_of_items
+
+    def __iter__(self) -> Iterator[int]:
+        return self
+
+    def __next__(self) -> int:
+        if self.number_read == self._number_of_items:
+            raise StopIteration
+        self.number_read += 1
+        return self.number_read - 1
+
+
+async def _wait_for(condition: Callable[[], bool]):
+    deadline = time.monotonic() + _TIMEOUT_S
+    while not condition():
+        assert time.monotonic() < deadline, "timed out waiting for the worker thread"
+        await asyncio.sleep(0.001)
+
+
+@pytest.mark.parametrize("prefetch_depth", (0, 1, 2, 5))
+def test_items_arrive_in_order(prefetch_depth):
+    async def read_all():
+        reader = create_reader(iter(range(20)), prefetch_depth)
+        try:
+            return [item async for item in reader]
+        finally:
+            reader.close()
+
+    assert asyncio.run(read_all()) == list(range(20))
+
+
+@pytest.mark.parametrize("prefetch_depth", (1, 2, 4))
+def test_at_most_prefetch_depth_items_are_read_ahead(prefetch_depth):
+    async def check_read_ahead():
+        data = _CountingIterator()
+        reader = Prefetcher(data, prefetch_depth)
+        try:
+            await _wait_for(lambda: data.number_read == prefetch_depth)
+            await asyncio.sleep(_SETTLE_S)
+            assert data.number_read == prefetch_depth
+            # Taking an item frees a slot for one more to be read
+            assert await reader.__anext__() == 0
+            await _wait_for(lambda: data.number_read == prefetch_depth + 1)
+            await asyncio.sleep(_SETTLE_S)
+            assert data.number_read == prefetch_depth + 1
+        finally:
+            reader.close()
+
+    asyncio.run(check_read_ahead())
+
+
+@pytest.mark.parametrize("prefetch_depth", (0, 2))
+def test_error_from_iterator_is_raised_by_reader(prefetch_depth):
+    def failing_data():
+        yield 1
+        raise ValueError("failed to read block")
+
+    async def read_all():
+        reader = create_reader(failing_data(), prefetch_depth)
+        try:
+            assert await reader.__anext__() == 1
+            with pytest.raises(ValueError, match="failed to read block"):
+                await reader.__anext__()
+        finally:
+            reader.close()
+
+    asyncio.run(read_all())
+
+
+def test_close_stops_thread_which_is_waiting_for_a_free_slot():
+    async def close_when_full():
+        data = _CountingIterator()
+        reader = Prefetcher(data, 1)
+        await _wait_for(lambda: data.number_read == 1)
+        reader.close()
+        assert not reader._thread.is_alive()
+        assert data.number_read == 1
+
+    asyncio.run(close_when_full())
@@ -0,0 +1,185 @@
+import asyncio
+import json
+import logging
+import sys
+
+import h5py
+import numpy as np
+import pytest
+from nexus_helpers import RecordingProducer, create_entry, create_event_data
+from streaming_data_types.eventdata_ev42 import deserialise_ev42
+from streaming_data_types.logdata_f142 import deserialise_f142
+from streaming_data_types.run_start_pl72 import deserialise_pl72
+
+from nexus_streamer.event_data_source import DEFAULT_PULSES_PER_BLOCK
+from nexus_streamer.launch_nexus_streamer import publish_run
+from nexus_streamer.parse_commandline_args import parse_args
+from nexus_streamer.prepared_run import PreparedRun, get_playlist
+
+# More pulses than are read in one block, so that chunks are dropped as the run is published
+NUMBER_OF_PULSES = 2 * DEFAULT_PULSES_PER_BLOCK + 10
+EVENTS_PER_PULSE = 3
+
+
+@pytest.fixture
+def nexus_filename(tmp_path) -> str:
+    filename = str(tmp_path / "run.nxs")
+    number_of_events = NUMBER_OF_PULSES * EVENTS_PER_PULSE
+    with h5py.File(filename, "w") as nexus_file:
+        entry = create_entry(nexus_file)
+        create_event_data(
+            entry,
+            event_id=np.arange(number_of_events) % 13,
+            event_time_offset=np.arange(number_of_events) * 1_000,
+            # ISIS style, with the start of the pulse after the last one appended
+            event_index=np.arange(NUMBER_OF_PULSES + 1) * EVENTS_PER_PULSE,
+            event_time_zero=np.arange(NUMBER_OF_PULSES) * 71_000_000,
+            chunk_length=16,
+            compression="gzip",
+        )
+        log = entry.create_group("temperature")
+        log.attrs["NX_class"] = "NXlog"
+        time = log.create_dataset("time", data=np.arange(10) * 0.1)
+        time.attrs["units"] = "s"
+        log["value"] = np.arange(10) + 300.0
+    return filename
+
+
+def _parse_args(monkeypatch, filename: str, *options: str):
+    monkeypatch.setattr(
+        sys,
+        "argv",
+        ["nexus_streamer", "-f", filename, "-b", "localhost:9092", "-i", "TEST"]
+        + list(options),
+    )
+    return parse_args()
+
+
+class _PublishedRun:
+    def __init__(self, producer: RecordingProducer):
+        """
+        Data published in a run, with times relative to the first pulse of the run
+        """
+        topic, payload, _, _ = producer.messages[0]
+        assert topic == "TEST_runInfo"
+        self.nexus_structure = json.loads(deserialise_pl72(payload).nexus_structure)
+        for child in self.nexus_structure["children"][0]["children"]:
+            if child.get("name") == "start_time":
+                # The start time of this run, which differs between runs
+                del child["values"]
+        events = [
+            deserialise_ev42(payload)
+            for topic, payload, _, _ in producer.messages
+            if topic == "TEST_events"
+        ]
+        logs = [
+            deserialise_f142(payload)
+            for topic, payload, _, _ in producer.messages
+            if topic == "TEST_sampleEnv"
+        ]
+        assert len(events) + len(logs) + 1 == len(producer.messages)
+        first_pulse_time = events[0].pulse_time
+        self.events = [
+            (
+                message.pulse_time - first_pulse_time,
+                message.detector_id.tolist(),
+                message.time_of_flight.tolist(),
+            )
+            for message in events
+        ]
+        self.log_values = [
+            (message.timestamp_unix_ns - first_pulse_time, message.value)
+            for message in logs
+        ]
+
+
+@pytest.mark.parametrize("decompression_workers", ("0", "2"))
+def test_prepared_run_publishes_the_same_data_each_time_it_is_streamed(
+    monkeypatch, nexus_filename, decompression_workers
+):
+    args = _parse_args(
+        monkeypatch, nexus_filename, "--decompression-workers", decompression_workers
+    )
+    logger = logging.getLogger("test")
+    run = PreparedRun(nexus_filename, args)
+    try:
+        published_runs = []
+        for run_id in range(3):
+            producer = RecordingProducer()
+            asyncio.run(
+                publish_run(producer, run_id, args, logger, prepared_run=run)  # type: ignore
+            )
+            assert run.nexus_file  # The prepared run is not closed
+            published_runs.append(_PublishedRun(producer))
+    finally:
+        run.close()
+
+    first_run = published_runs[0]
+    assert len(first_run.events) == NUMBER_OF_PULSES
+    assert sum(len(detector_id) for _, detector_id, _ in first_run.events) == (
+        NUMBER_OF_PULSES * EVENTS_PER_PULSE
+    )
+    assert len(first_run.log_values) == 10
+    for published_run in published_runs[1:]:
+        assert published_run.events == first_run.events
+        assert published_run.log_values == first_run.log_values
+        assert published_run.nexus_structure == first_run.nexus_structure
+
+
+def _create_files(directory, *filenames: str):
+    for filename in filenames:
+        with h5py.File(directory / filename, "w") as nexus_file:
+            create_entry(nexus_file)
+
+
+def test_playlist_of_a_directory_is_its_nexus_files_in_name_order(tmp_path):
+    _create_files(tmp_path, "run_3.nxs", "run_1.h5", "run_2.NXS", "run_0.hdf5")
+    (tmp_path / "notes.txt").write_text("not a run")
+    (tmp_path / "subdirectory.nxs").mkdir()
+    assert get_playlist(str(tmp_path)) == [
+        str(tmp_path / filename)
+        for filename in ("run_0.hdf5", "run_1.h5", "run_2.NXS", "run_3.nxs")
+    ]
+
+
+def test_playlist_of_a_nexus_file_is_the_file(tmp_path):
+    _create_files(tmp_path, "run.txt")
+    assert get_playlist(str(tmp_path / "run.txt")) == [str(tmp_path / "run.txt")]
+
+
+def test_playlist_file_is_read_in_order_relative_to_its_directory(tmp_path):
+    runs_directory = tmp_path / "runs"
+    runs_directory.mkdir()
+    _create_files(runs_directory, "run_2.nxs", "run_1.nxs")
+    playlist = tmp_path / "playlist.txt"
+    playlist.write_text(
+        "# Runs for the test\n"
+        "runs/run_2.nxs\n"
+        "\n"
+        f"  {runs_directory / 'run_1.nxs'}  \n"
+        "runs/run_2.nxs\n"
+    )
+    assert get_playlist(str(playlist)) == [
+        str(tmp_path / "runs/run_2.nxs"),
+        str(runs_directory / "run_1.nxs"),
+        str(tmp_path / "runs/run_2.nxs"),
+    ]
+
+
+def test_playlist_of_a_glob_pattern_is_the_matching_files_in_name_order(tmp_path):
+    _create_files(tmp_path, "run_2.nxs", "run_10.nxs", "run_1.nxs", "other.nxs")
+    assert get_playlist(str(tmp_path / "run_*.nxs")) == [
+        str(tmp_path / filename)
+        for filename in ("run_1.nxs", "run_10.nxs", "run_2.nxs")
+    ]
+
+
+@pytest.mark.parametrize(
+    "playlist", ("missing.nxs", "run_*.nxs", "empty_directory", "empty.txt")
+)
+def test_empty_or_missing_playlist_is_logged_as_an_error(tmp_path, caplog, playlist):
+    (tmp_path / "empty_directory").mkdir()
+    (tmp_path / "empty.txt").write_text("# No runs\n\n")
+    with caplog.at_level(logging.ERROR):
+        assert get_playlist(str(tmp_path / playlist)) == []
+    assert f"No files found for playlist {tmp_path / playlist}" in caplog.text
@@ -0,0 +1,142 @@
+import os
+from typing import List, Tuple
+
+import h5py
+import numpy as np
+import pytest
+from nexus_helpers import create_entry, create_event_data
+
+from nexus_streamer import event_data_source, pulse_index_cache
+from nexus_streamer.event_data_source import EventDataSource
+from nexus_streamer.pulse_index_cache import (
+    EVENT_INDEX,
+    PULSE_TIMES,
+    PulseIndexCache,
+    create_pulse_index_cache,
+)
+
+NUMBER_OF_PULSES = 20
+EVENTS_PER_PULSE = 3
+SOURCE_PATH = "/entry/events"
+
+
+def _write_file(filename: str, number_of_pulses: int = NUMBER_OF_PULSES):
+    number_of_events = number_of_pulses * EVENTS_PER_PULSE
+    with h5py.File(filename, "w") as nexus_file:
+        entry = create_entry(nexus_file)
+        create_event_data(
+            entry,
+            event_id=np.arange(number_of_events) % 7,
+            event_time_offset=np.arange(number_of_events) * 10,
+            event_index=np.arange(number_of_pulses) * EVENTS_PER_PULSE,
+            event_time_zero=np.arange(number_of_pulses) * 71_000_000,
+        )
+
+
+@pytest.fixture
+def nexus_filename(tmp_path) -> str:
+    filename = str(tmp_path / "run.nxs")
+    _write_file(filename)
+    return filename
+
+
+def _read_pulses(filename: str, cache: PulseIndexCache) -> List[Tuple]:
+    with h5py.File(filename, "r") as nexus_file:
+        source = EventDataSource(nexus_file[SOURCE_PATH], pulse_index_cache=cache)
+        pulses = []
+        for time_of_flight, detector_ids, pulse_time in source.get_data():
+            if time_of_flight is None or detector_ids is None:
+                break
+            pulses.append((time_of_flight.tolist(), detector_ids.tolist(), pulse_time))
+        return pulses
+
+
+def _cache_files(cache_directory) -> List[str]:
+    return sorted(os.listdir(cache_directory))
+
+
+def test_cached_arrays_are_memory_mapped_instead_of_read_from_the_file(
+    monkeypatch, tmp_path, nexus_filename
+):
+    cache_directory = str(tmp_path / "cache")
+    pulses = _read_pulses(
+        nexus_filename, PulseIndexCache(cache_directory, nexus_filename)
+    )
+    assert len(pulses) == NUMBER_OF_PULSES
+    assert len(_cache_files(cache_directory)) == 2
+
+    def fail_to_read(*_):
+        raise AssertionError("pulse dataset was read from the NeXus file")
+
+    monkeypatch.setattr(
+        event_data_source._WindowedPulseColumn, "__getitem__", fail_to_read
+    )
+    cache = PulseIndexCache(cache_directory, nexus_filename)
+    for array_name in (PULSE_TIMES, EVENT_INDEX):
+        assert isinstance(cache.load(SOURCE_PATH, array_name), np.memmap)
+    assert _read_pulses(nexus_filename, cache) == pulses
+
+
+def test_cache_is_not_used_when_the_file_changes(tmp_path, nexus_filename):
+    cache_directory = str(tmp_path / "cache")
+    _read_pulses(nexus_filename, PulseIndexCache(cache_directory, nexus_filename))
+
+    _write_file(nexus_filename, NUMBER_OF_PULSES + 5)
+    cache = PulseIndexCache(cache_directory, nexus_filename)
+    assert cache.load(SOURCE_PATH, PULSE_TIMES) is None
+    assert cache.load(SOURCE_PATH, EVENT_INDEX) is None
+    assert len(_read_pulses(nexus_filename, cache)) == NUMBER_OF_PULSES + 5
+    # Arrays for the changed file are saved alongside those for the old one
+    assert len(_cache_files(cache_directory)) == 4
+
+
+def test_cache_is_not_used_when_only_the_modification_time_changes(
+    tmp_path, nexus_filename
+):
+    cache = PulseIndexCache(str(tmp_path), nexus_filename)
+    cache.save(SOURCE_PATH, PULSE_TIMES, np.arange(5))
+    file_status = os.stat(nexus_filename)
+    os.utime(nexus_filename, ns=(file_status.st_atime_ns, file_status.st_mtime_ns + 1))
+    assert (
+        PulseIndexCache(str(tmp_path), nexus_filename).load(SOURCE_PATH, PULSE_TIMES)
+        is None
+    )
+
+
+def _write_part_then_fail(error: BaseException):
+    def save(cache_file, array: np.ndarray):
+        cache_file.write(b"\x93NUMPY partial")
+        raise error
+
+    return save
+
+
+@pytest.mark.parametrize("error", (KeyboardInterrupt(), RuntimeError("failed")))
+def test_interrupted_write_leaves_no_partial_cache(
+    monkeypatch, tmp_path, nexus_filename, error
+):
+    cache_directory = tmp_path / "cache"
+    cache = PulseIndexCache(str(cache_directory), nexus_filename)
+    monkeypatch.setattr(pulse_index_cache.np, "save", _write_part_then_fail(error))
+    with pytest.raises(type(error)):
+        cache.save(SOURCE_PATH, PULSE_TIMES, np.arange(5))
+    assert _cache_files(cache_directory) == []
+    monkeypatch.undo()
+    assert cache.load(SOURCE_PATH, PULSE_TIMES) is None
+
+
+def test_failed_write_is_logged_and_leaves_no_partial_cache(
+    monkeypatch, tmp_path, nexus_filename, caplog
+):
+    cache_directory = tmp_path / "cache"
+    cache = PulseIndexCache(str(cache_directory), nexus_filename)
+    monkeypatch.setattr(
+        pulse_index_cache.np, "save", _write_part_then_fail(OSError("disk full"))
+    )
+    cache.save(SOURCE_PATH, PULSE_TIMES, np.arange(5))
+    assert "disk full" in caplog.text
+    assert _cache_files(cache_directory) == []
+
+
+def test_no_cache_without_a_cache_directory(nexus_filename):
+    assert create_pulse_index_cache(None, nexus_filename) is None
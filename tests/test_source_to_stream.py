@@ -0,0 +1,124 @@
+import asyncio
+from typing import List, Optional, Sequence
+
+import h5py
+import numpy as np
+import pytest
+from nexus_helpers import RecordingProducer, create_entry, create_event_data
+from streaming_data_types.eventdata_ev42 import EventData, deserialise_ev42
+
+from nexus_streamer.detector_partitioning import DetectorIdPartitioning
+from nexus_streamer.event_data_source import EventDataSource
+from nexus_streamer.isis_data_source import IsisDataSource
+from nexus_streamer.merge_scheduler import MergeScheduler
+from nexus_streamer.metrics import get_metrics, reset_metrics
+from nexus_streamer.playback_clock import PlaybackClock
+from nexus_streamer.source_to_stream import EventSourceToStream
+
+NUMBER_OF_PULSES = 5
+EVENTS_PER_PULSE = 8
+# Each pulse has two events in each of these ranges
+RANGE_STARTS = [1, 11, 21, 31]
+
+
+@pytest.fixture
+def isis_file(tmp_path) -> h5py.File:
+    with h5py.File(tmp_path / "isis.nxs", "w") as nexus_file:
+        entry = create_entry(nexus_file)
+        pulse_ids = np.array([1, 12, 23, 34, 2, 13, 24, 35])
+        create_event_data(
+            entry,
+            event_id=np.tile(pulse_ids, NUMBER_OF_PULSES),
+            event_time_offset=np.arange(NUMBER_OF_PULSES * EVENTS_PER_PULSE),
+            event_index=np.arange(NUMBER_OF_PULSES) * EVENTS_PER_PULSE,
+            event_time_zero=np.arange(NUMBER_OF_PULSES) * 71_000_000,
+        )
+        framelog = nexus_file.create_group("raw_data_1/framelog")
+        framelog["proton_charge/value"] = np.arange(NUMBER_OF_PULSES) * 1.5
+        framelog["period_log/value"] = np.arange(NUMBER_OF_PULSES, dtype=np.int32) + 1
+    nexus_file = h5py.File(tmp_path / "isis.nxs", "r")
+    yield nexus_file
+    nexus_file.close()
+
+
+def _stream(
+    nexus_file: h5py.File, published_ranges: Optional[Sequence[int]] = None
+) -> List[EventData]:
+    streamer = EventSourceToStream(
+        EventDataSource(nexus_file["entry/events"]),
+        RecordingProducer(),  # type: ignore
+        "TEST_events",
+        PlaybackClock(0),
+        isis_data_source=IsisDataSource(nexus_file),
+        prefetch_depth=0,
+        partitioning=DetectorIdPartitioning(RANGE_STARTS),
+        published_ranges=published_ranges,
+    )
+
+    async def get_payloads() -> List[bytes]:
+        try:
+            return [bytes(payload) async for payload, _ in streamer.get_messages()]
+        finally:
+            streamer.stop()
+
+    return [deserialise_ev42(payload) for payload in asyncio.run(get_payloads())]
+
+
+def _check_isis_data_is_for_pulse(messages: List[EventData]):
+    pulse_times = sorted({message.pulse_time for message in messages})
+    for message in messages:
+        frame = pulse_times.index(message.pulse_time)
+        assert message.specific_data["proton_charge"] == pytest.approx(frame * 1.5)
+        assert message.specific_data["period_number"] == frame + 1
+
+
+def test_isis_data_advances_once_per_pulse_when_events_are_split_by_range(
+    isis_file,
+):
+    messages = _stream(isis_file)
+    assert len(messages) == NUMBER_OF_PULSES * len(RANGE_STARTS)
+    _check_isis_data_is_for_pulse(messages)
+
+
+def test_isis_data_advances_for_pulses_of_ranges_which_are_not_published(
+    isis_file,
+):
+    messages = _stream(isis_file, published_ranges=[2, 3])
+    assert len(messages) == NUMBER_OF_PULSES * 2
+    assert {message.detector_id[0] for message in messages} == {23, 34}
+    _check_isis_data_is_for_pulse(messages)
+
+
+def test_metrics_of_sources_with_the_same_name_are_kept_separate(tmp_path):
+    reset_metrics()
+    with h5py.File(tmp_path / "banks.nxs", "w") as nexus_file:
+        entry = create_entry(nexus_file)
+        for bank, number_of_pulses in (("bank_1", 2), ("bank_2", 3)):
+            create_event_data(
+                entry.create_group(bank),
+                event_id=np.ones(number_of_pulses),
+                event_time_offset=np.zeros(number_of_pulses),
+                event_index=np.arange(number_of_pulses),
+                event_time_zero=np.arange(number_of_pulses),
+            )
+    with h5py.File(tmp_path / "banks.nxs", "r") as nexus_file:
+        streamers = [
+            EventSourceToStream(
+                EventDataSource(nexus_file[f"entry/{bank}/events"]),
+                RecordingProducer(),  # type: ignore
+                "TEST_events",
+                PlaybackClock(0),
+                prefetch_depth=0,
+            )
+            for bank in ("bank_1", "bank_2")
+        ]
+        scheduler = MergeScheduler(streamers)  # type: ignore
+        try:
+            asyncio.run(scheduler.run())
+        finally:
+            scheduler.stop()
+
+    assert dict(get_metrics().messages.export()) == {
+        ("/entry/bank_1/events", "TEST_events"): 2,
+        ("/entry/bank_2/events", "TEST_events"): 3,
+    }
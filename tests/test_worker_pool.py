@@ -0,0 +1,63 @@
+from collections import Counter
+from typing import List, Optional, Tuple
+
+from nexus_streamer.worker_pool import EventShard, assign_event_shards
+
+
+def _assigned_units(shards: List[List[EventShard]]) -> Counter:
+    """
+    Number of times each whole source, (path, None), or range of a source,
+    (path, range number), is assigned to a worker
+    """
+    units: List[Tuple[str, Optional[int]]] = []
+    for worker_shards in shards:
+        for shard in worker_shards:
+            if shard.ranges is None:
+                units.append((shard.source_path, None))
+            else:
+                units.extend((shard.source_path, number) for number in shard.ranges)
+    return Counter(units)
+
+
+def test_largest_sources_are_given_to_the_worker_with_fewest_events():
+    shards = assign_event_shards({"a": 100, "b": 60, "c": 50, "d": 10}, {}, 2)
+    assert shards == [
+        [EventShard("a"), EventShard("d")],
+        [EventShard("b"), EventShard("c")],
+    ]
+
+
+def test_sources_are_not_split_when_there_are_enough_for_every_worker():
+    shards = assign_event_shards({"a": 100, "b": 10}, {"a": 4}, 2)
+    assert shards == [[EventShard("a")], [EventShard("b")]]
+
+
+def test_workers_are_left_without_shards_when_no_source_can_be_split():
+    shards = assign_event_shards({"a": 100, "b": 10}, {}, 4)
+    assert shards == [[EventShard("a")], [EventShard("b")], [], []]
+
+
+def test_ranges_of_sources_are_shared_out_when_there_are_more_workers_than_sources():
+    shards = assign_event_shards({"a": 400, "b": 100}, {"a": 4}, 3)
+    assert shards == [
+        [EventShard("a", (0, 3))],
+        [EventShard("b"), EventShard("a", (1,))],
+        [EventShard("a", (2,))],
+    ]
+
+
+def test_every_range_is_assigned_exactly_once():
+    source_sizes = {"a": 1000, "b": 700, "c": 30}
+    number_of_ranges = {"a": 5, "b": 3}
+    for number_of_workers in range(4, 12):
+        shards = assign_event_shards(source_sizes, number_of_ranges, number_of_workers)
+        assert len(shards) == number_of_workers
+        assert _assigned_units(shards) == Counter(
+            [("a", number) for number in range(5)]
+            + [("b", number) for number in range(3)]
+            + [("c", None)]
+        )
+        # Ranges of a source given to the same worker are published as one shard
+        for worker_shards in shards:
+            paths = [shard.source_path for shard in worker_shards]
+            assert len(paths) == len(set(paths))